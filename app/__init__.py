@@ -1,12 +1,61 @@
 # app/__init__.py
 
+import os
+
 from flask import Flask
 
-app = Flask(__name__)
-app.secret_key = 'supersecretkey123'  # ваш секретный ключ
-app.config['DATABASE'] = 'an30.db'    # имя файла с базой данных
-app.config['SQLITE_TIMEOUT'] = 20
+# Приложение собирается фабрикой create_app(): импорт пакета ничего не
+# создаёт и не открывает базу, поэтому create_app() можно вызывать в мастере
+# gunicorn --preload (`gunicorn "app:create_app()" --preload`). Соединения
+# с базой и пулы потоков создаются лениво уже в воркерах. Схема базы
+# создаётся отдельной командой: `flask --app app init-db`.
+
+
+def create_app(config=None):
+    """
+    Создаёт и настраивает приложение. config — dict, переопределяющий
+    настройки по умолчанию (например DATABASE для тестов и замеров).
+    """
+    app = Flask(__name__)
+    app.secret_key = 'supersecretkey123'  # ваш секретный ключ
+    app.config['DATABASE'] = 'an30.db'    # имя файла с базой данных
+    app.config['ARCHIVE_DATABASE'] = None  # файл архива закрытых периодов (None — <база>_archive.db)
+    app.config['SQLITE_TIMEOUT'] = 20
+    app.config['SQLITE_POOL_SIZE'] = 8            # соединений в пуле на воркер
+    app.config['SQLITE_CACHED_STATEMENTS'] = 256  # кэш подготовленных запросов на соединение
+    app.config['SQLITE_CACHE_SIZE'] = -16000      # кэш страниц, KiB (отрицательное значение)
+    app.config['SQLITE_MMAP_SIZE'] = 256 * 1024 * 1024
+    app.config['WRITE_QUEUE'] = True           # записи через поток-писатель с групповым коммитом
+    app.config['WRITE_BATCH_MAX'] = 100        # заданий в одной транзакции писателя
+    app.config['WRITE_TIMEOUT'] = 30           # сколько запрос ждёт результата записи, с
+    app.config['CHANGEFEED_POLL_INTERVAL'] = 1.0  # как часто опросчик читает change_log, с
+    app.config['CHANGEFEED_BUFFER'] = 1000        # последних событий в памяти воркера
+    app.config['SSE_KEEPALIVE'] = 15              # пустой комментарий в простаивающий поток, с
+    app.config['SSE_MAX_AGE'] = 300               # поток закрывается, браузер переподключается, с
+    app.config['SSE_MAX_SUBSCRIBERS'] = 32        # подписчиков /events на воркер; меньше threads в gunicorn.conf.py
+    app.config['SSE_RETRY_AFTER'] = 30            # через сколько переподключаться, если мест нет, с
+    app.config['EXPORT_BATCH_SIZE'] = 1000                 # строк за один fetchmany при выгрузке
+    app.config['EXPORT_SPOOL_MAX_SIZE'] = 8 * 1024 * 1024  # до этого размера отчёт держится в памяти
+    app.config['EXPORT_JOB_WORKERS'] = 2                   # потоков фоновой выгрузки на воркер
+    app.config['ANALYTICS_WORKERS'] = 3                    # потоков для сводных листов аналитической книги
+    app.config['EXPORT_CACHE_DIR'] = os.path.join(app.instance_path, 'export_cache')
+    app.config['EXPORT_CACHE_MAX_BYTES'] = 512 * 1024 * 1024
+    app.config['EXPORT_CACHE_MAX_AGE'] = 7 * 24 * 3600     # секунд
+    app.config['IMPORT_BATCH_SIZE'] = 500                  # строк на один executemany при импорте
+    app.config['CALENDAR_CACHE_SIZE'] = 512                # месяцев календаря в памяти воркера
+    app.config['CALENDAR_CACHE_DIR'] = None                # каталог общего дискового кэша календаря (None — только память)
+    app.config['SQL_INSTRUMENTATION'] = True               # счётчики запросов, Server-Timing, /metrics
+    app.config['SQL_SLOW_MS'] = 100                        # порог медленного запроса для лога, мс
+    if config:
+        app.config.update(config)
+
+    from . import database, metrics
+    database.init_app(app)
+    metrics.init_app(app)
 
-# Импортируем здесь же наши роуты,
-# чтобы они зарегистрировались на объекте app
-from . import routes
+    # Роуты, API и команды CLI регистрируются блюпринтами
+    from . import routes, api, cli
+    app.register_blueprint(routes.bp)
+    app.register_blueprint(api.bp)
+    app.register_blueprint(cli.bp)
+    return app
@@ -0,0 +1,217 @@
+# app/analytics.py
+
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from werkzeug.datastructures import MultiDict
+
+from .database import get_db
+from .export import export_query, iter_rows, write_detail_sheet, xlsx_styles
+from .queries import STATUSES
+
+# Аналитическая книга: сводные листы считаются в SQL (GROUP BY по агрегатам
+# usage_daily, см. миграцию 5), а не сводными таблицами Excel по 100k строк.
+# usage_daily не теряет строки при переносе в архив, поэтому сводки охватывают
+# и закрытые периоды. Запросы листов выполняются параллельно, каждый в своём
+# потоке со своим соединением; книгу собирает один поток — openpyxl не
+# потокобезопасен. Лист с детализацией (detail=1) — обычная выгрузка строк.
+
+STATUS_TITLES = {
+    'work': "Работа",
+    'stop': "Простой",
+    'repair': "Ремонт",
+    'holiday': "Выходной",
+}
+
+ANALYTICS_NAME_SQL = '''
+    CASE WHEN e.id IS NULL THEN '{deleted}' ELSE e.name END
+'''
+
+# Часы по (сущность, месяц)
+HOURS_BY_MONTH_SQL = '''
+    SELECT u.entity_id, {name} AS name, substr(u.day, 1, 7) AS month, SUM(u.hours)
+      FROM usage_daily u
+      LEFT JOIN {table} e ON e.id = u.entity_id
+     WHERE u.kind = ? AND u.day BETWEEN ? AND ?
+     GROUP BY u.entity_id, month
+'''
+
+# Дни по (сущность, статус): строка usage_daily — один день с этим статусом
+STATUS_DAYS_SQL = '''
+    SELECT u.entity_id, {name} AS name, u.status, COUNT(*)
+      FROM usage_daily u
+      LEFT JOIN {table} e ON e.id = u.entity_id
+     WHERE u.kind = ? AND u.day BETWEEN ? AND ?
+     GROUP BY u.entity_id, u.status
+'''
+
+# (ключ, заголовок листа, вид листа, вид сущности, справочник, подпись удалённой записи)
+ANALYTICS_SHEETS = (
+    ("machine_hours", "Техника по месяцам", "hours", "machine", "machines", "Техника удалёна"),
+    ("machine_status", "Статусы техники", "status", "machine", "machines", "Техника удалёна"),
+    ("counterparty_hours", "Контрагенты по месяцам", "hours",
+     "counterparty", "counterparties", "Контрагент удалён"),
+)
+
+
+def analytics_period(args):
+    """
+    Период сводок (date_from, date_to) из параметров запроса; пустые границы — без ограничения.
+    """
+    return args.get('date_from') or '0000-00-00', args.get('date_to') or '9999-12-31'
+
+
+def _run_sheet_query(app, sql, params):
+    # Отдельный поток — отдельный контекст приложения и своё соединение из пула
+    with app.app_context():
+        return get_db().execute(sql, params).fetchall()
+
+
+def load_sheets(args):
+    """
+    Выполняет запросы всех сводных листов параллельно (ANALYTICS_WORKERS потоков).
+    Возвращает {лист: строки запроса}.
+    """
+    app = current_app._get_current_object()
+    period = analytics_period(args)
+    with ThreadPoolExecutor(max_workers=app.config['ANALYTICS_WORKERS'],
+                            thread_name_prefix='analytics') as pool:
+        futures = {
+            key: pool.submit(_run_sheet_query, app,
+                             SHEET_LAYOUTS[layout][0].format(
+                                 table=table, name=ANALYTICS_NAME_SQL.format(deleted=deleted)),
+                             (kind,) + period)
+            for key, _, layout, kind, table, deleted in ANALYTICS_SHEETS
+        }
+        return {key: future.result() for key, future in futures.items()}
+
+
+def _months_between(first, last):
+    """
+    Все месяцы 'YYYY-MM' от first до last включительно.
+    """
+    year, month = int(first[:4]), int(first[5:7])
+    months = []
+    while f"{year:04d}-{month:02d}" <= last:
+        months.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def _pivot(rows):
+    """
+    Строки (id, имя, колонка, значение) -> ({id: (имя, {колонка: значение})}, колонки).
+    """
+    table = {}
+    columns = set()
+    for entity_id, name, column, value in rows:
+        table.setdefault(entity_id, (name, {}))[1][column] = value
+        columns.add(column)
+    return table, columns
+
+
+def _header_row(ws, titles):
+    from openpyxl.cell import WriteOnlyCell
+
+    styles = xlsx_styles()
+    row = []
+    for title in titles:
+        cell = WriteOnlyCell(ws, value=title)
+        cell.fill = styles.header_fill
+        cell.font = styles.header_font
+        row.append(cell)
+    return row
+
+
+def _write_hours_sheet(wb, title, rows):
+    ws = wb.create_sheet(title)
+    table, columns = _pivot(rows)
+    months = _months_between(min(columns), max(columns)) if columns else []
+    ws.column_dimensions['A'].width = 25
+    ws.append(_header_row(ws, ["Название"] + months + ["Итого"]))
+    for name, values in sorted(table.values(), key=lambda item: item[0]):
+        hours = [values.get(m, 0) for m in months]
+        ws.append([name] + hours + [sum(hours)])
+    if table:
+        ws.append(["Итого"] + [sum(values.get(m, 0) for _, values in table.values()) for m in months]
+                  + [sum(sum(values.values()) for _, values in table.values())])
+
+
+def _write_status_sheet(wb, title, rows):
+    from openpyxl.styles import Font
+    from openpyxl.utils import get_column_letter
+
+    styles = xlsx_styles()
+    ws = wb.create_sheet(title)
+    table, _ = _pivot(rows)
+    ws.column_dimensions['A'].width = 25
+    for col in range(2, len(STATUSES) + 2):
+        ws.column_dimensions[get_column_letter(col)].width = 15
+    header = _header_row(ws, ["Название"] + [f"{STATUS_TITLES[st]}, дн." for st in STATUSES])
+    for cell, status_ in zip(header[1:], STATUSES):
+        cell.fill = styles.status_fills[status_]
+        cell.font = Font(bold=True)
+    ws.append(header)
+    for name, values in sorted(table.values(), key=lambda item: item[0]):
+        ws.append([name] + [values.get(st, 0) for st in STATUSES])
+
+
+# вид листа -> (запрос, функция записи листа)
+SHEET_LAYOUTS = {
+    'hours': (HOURS_BY_MONTH_SQL, _write_hours_sheet),
+    'status': (STATUS_DAYS_SQL, _write_status_sheet),
+}
+
+
+def write_analytics_xlsx(sheets, fileobj, detail_rows=None):
+    """
+    Пишет сводные листы (результат load_sheets) и, если переданы строки
+    выгрузки, лист детализации — в одну книгу в режиме write-only.
+    """
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    for key, title, layout, *_ in ANALYTICS_SHEETS:
+        SHEET_LAYOUTS[layout][1](wb, title, sheets[key])
+    if detail_rows is not None:
+        write_detail_sheet(wb, detail_rows)
+    wb.save(fileobj)
+
+
+def detail_query(conn, args):
+    """
+    Выгрузка для листа детализации: всегда с фильтрами списка записей, чтобы
+    лист охватывал тот же период date_from/date_to, что и сводки.
+    """
+    args = MultiDict(args)
+    args['export'] = 'filtered'
+    return export_query(conn, args)
+
+
+def write_analytics(conn, args, batch_size, fileobj):
+    """
+    Считает сводные листы и пишет книгу в fileobj; detail=1 добавляет лист
+    с записями за тот же период (остальные фильтры — как у /export).
+    """
+    sheets = load_sheets(args)
+    detail_rows = None
+    if args.get('detail') == '1':
+        sql, pr = detail_query(conn, args)
+        detail_rows = iter_rows(conn.execute(sql, pr), batch_size)
+    write_analytics_xlsx(sheets, fileobj, detail_rows)
+
+
+def build_analytics_spool(conn, args, batch_size, spool_max_size):
+    """
+    Строит аналитическую книгу (write_analytics) во временный spool-файл
+    и возвращает его, перемотанным на начало.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=spool_max_size)
+    try:
+        write_analytics(conn, args, batch_size, spool)
+    except Exception:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
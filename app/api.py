@@ -0,0 +1,300 @@
+# app/api.py
+
+import sqlite3
+from datetime import datetime
+
+from flask import Blueprint, jsonify, request
+
+from .database import get_db, insert_with_free_id, get_data_versions, get_version_stamps
+from .archive import archive_cutoff_for, cutoff_for_filters, ensure_open_period
+from .conflicts import ensure_no_conflicts
+from .writer import run_write
+from .queries import (parse_record_filters, build_where, order_sql, and_where, keyset_condition,
+                      encode_cursor, decode_cursor, count_records, records_list_sql)
+from .refcache import REFERENCE_TABLES, get_reference, get_active
+from .validation import record_fields
+from .calendar_data import clamp_year_month
+from .conditional import page_validator, not_modified, conditional_response
+from .heatmap import (HEATMAP_MAX_MACHINES, STATUS_CODES, parse_machine_ids, get_year_version,
+                      load_year_heatmap)
+from . import calendar_cache
+
+# JSON API v1 для шлюза телематики и планшетов диспетчеров.
+# Фильтры и сортировки списка — те же, что у /admin/records.
+
+bp = Blueprint('api', __name__)
+
+API_PAGE_SIZE = 100
+API_PAGE_MAX = 1000
+API_BATCH_MAX = 1000
+API_CHANGES_MAX = 1000
+
+RECORD_COLUMNS = ("date", "machine_id", "driver_id", "status", "start_time",
+                  "end_time", "hours", "comment", "counterparty_id")
+
+
+def record_json(row):
+    """
+    Строка RECORDS_LIST_SELECT -> dict для ответа API.
+    """
+    return {
+        'id': row[0],
+        'date': row[1],
+        'machine_id': row[10],
+        'machine': row[2],
+        'driver_id': row[11],
+        'driver': row[3],
+        'counterparty_id': row[12],
+        'counterparty': row[8],
+        'status': row[9],
+        'start_time': row[4],
+        'end_time': row[5],
+        'hours': row[6],
+        'comment': row[7],
+    }
+
+
+def api_error(message, code=400):
+    return jsonify({'error': message}), code
+
+
+def _fetch_records(conn, ids):
+    if not ids:
+        return []
+    # по id ищем и в архиве
+    select_sql, select_pr = records_list_sql({'sort': None}, archive_cutoff_for(conn, include=True))
+    marks = ",".join("?" for _ in ids)
+    rows = conn.execute(f"{select_sql} WHERE r.id IN ({marks}) ORDER BY r.id", select_pr + list(ids)).fetchall()
+    return [record_json(r) for r in rows]
+
+# --------------------- ЗАПИСИ ---------------------
+
+@bp.route('/api/v1/records')
+def api_records():
+    f = parse_record_filters(request.args)
+    limit = min(max(request.args.get('limit', type=int, default=API_PAGE_SIZE), 1), API_PAGE_MAX)
+
+    conn = get_db()
+    cutoff = cutoff_for_filters(conn, f)
+    where_sql, pr = build_where(f, cutoff)
+    after = decode_cursor(f['sort'], request.args.get('cursor'))
+    if request.args.get('cursor') and after is None:
+        return api_error("Некорректный cursor")
+    page_where, page_pr = where_sql, list(pr)
+    if after is not None:
+        cond, cond_pr = keyset_condition(f['sort'], after)
+        page_where = and_where(where_sql, cond)
+        page_pr += cond_pr
+
+    select_sql, select_pr = records_list_sql(f, cutoff)
+    rows = conn.execute(f"{select_sql} {page_where} {order_sql(f['sort'])} LIMIT ?",
+                        select_pr + page_pr + [limit + 1]).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    result = {
+        'items': [record_json(r) for r in rows],
+        'next_cursor': encode_cursor(f['sort'], rows[-1]) if has_more else None,
+    }
+    if request.args.get('count') == '1':
+        version = get_data_versions(conn, ("records",))["records"]
+        result['total'] = count_records(conn, where_sql, pr, version, cutoff)
+    return jsonify(result)
+
+
+@bp.route('/api/v1/records/<int:id>')
+def api_record(id):
+    items = _fetch_records(get_db(), [id])
+    if not items:
+        return api_error("Запись не найдена", 404)
+    return jsonify(items[0])
+
+
+# Обработчики элементов пакета: меняют records и добавляют в touched
+# пары (machine_id, дата) для сброса кэша календаря после коммита.
+
+def _create(conn, item, touched):
+    fields = record_fields(item)
+    ensure_open_period(conn, fields['date'])
+    ensure_no_conflicts(conn, fields['date'], fields['start_time'], fields['end_time'],
+                        fields['machine_id'], fields['driver_id'])
+    new_id = insert_with_free_id(conn, "records", RECORD_COLUMNS, [fields[c] for c in RECORD_COLUMNS])
+    touched.append((fields['machine_id'], fields['date']))
+    return {'id': new_id}
+
+
+def _update(conn, item, touched):
+    rec_id = item.get('id')
+    if not isinstance(rec_id, int):
+        raise ValueError("Не указан id записи")
+    current = conn.execute(f"SELECT {', '.join(RECORD_COLUMNS)} FROM records WHERE id=?", (rec_id,)).fetchone()
+    if not current:
+        raise LookupError("Запись не найдена (или перенесена в архив)")
+    # частичное обновление: непереданные поля остаются прежними
+    merged = dict(zip(RECORD_COLUMNS, current))
+    merged.update({k: v for k, v in item.items() if k in RECORD_COLUMNS})
+    fields = record_fields(merged)
+    ensure_open_period(conn, fields['date'])
+    ensure_no_conflicts(conn, fields['date'], fields['start_time'], fields['end_time'],
+                        fields['machine_id'], fields['driver_id'], exclude_id=rec_id)
+    sets = ", ".join(f"{c}=?" for c in RECORD_COLUMNS)
+    conn.execute(f"UPDATE records SET {sets} WHERE id=?", [fields[c] for c in RECORD_COLUMNS] + [rec_id])
+    touched.extend([(current[1], current[0]), (fields['machine_id'], fields['date'])])
+    return {'id': rec_id}
+
+
+def _delete(conn, rec_id, touched):
+    if not isinstance(rec_id, int):
+        raise ValueError("id записи должен быть числом")
+    old = conn.execute("SELECT machine_id, date FROM records WHERE id=?", (rec_id,)).fetchone()
+    if not old:
+        raise LookupError("Запись не найдена")
+    conn.execute("DELETE FROM records WHERE id=?", (rec_id,))
+    touched.append(old)
+    return {'id': rec_id}
+
+
+@bp.route('/api/v1/records/batch', methods=['POST'])
+def api_records_batch():
+    """
+    Пакетное изменение записей одной транзакцией:
+    {"create": [{...}], "update": [{"id": 1, ...}], "delete": [1, 2]}.
+    Каждый элемент выполняется в своём SAVEPOINT: ошибка в одном не отменяет остальные.
+    Ответ: {"create": [{"ok": true, "id": 5} | {"ok": false, "error": "..."}], ...}.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return api_error("Ожидается JSON-объект")
+    ops = [("create", _create), ("update", _update), ("delete", _delete)]
+    for name, _ in ops:
+        if not isinstance(body.get(name, []), list):
+            return api_error(f"Поле {name} должно быть списком")
+    if sum(len(body.get(name, [])) for name, _ in ops) > API_BATCH_MAX:
+        return api_error(f"Не больше {API_BATCH_MAX} элементов за запрос", 413)
+
+    # весь пакет — одно задание писателя, то есть одна транзакция
+    results, touched = run_write(_apply_batch, body, ops)
+    calendar_cache.evict_records(touched)
+    return jsonify(results)
+
+
+def _apply_batch(conn, body, ops):
+    results = {}
+    touched = []
+    for name, handler in ops:
+        results[name] = []
+        for item in body.get(name, []):
+            conn.execute("SAVEPOINT item")
+            try:
+                res = dict(handler(conn, item, touched), ok=True)
+                conn.execute("RELEASE item")
+            except (ValueError, LookupError, TypeError, AttributeError, sqlite3.IntegrityError) as e:
+                conn.execute("ROLLBACK TO item")
+                conn.execute("RELEASE item")
+                res = {'ok': False, 'error': str(e)}
+            results[name].append(res)
+    return results, touched
+
+# --------------------- СПРАВОЧНИКИ ---------------------
+
+@bp.route('/api/v1/<any(machines, drivers, counterparties):table>')
+def api_reference(table):
+    rows = get_reference(get_db(), table)
+    # удалённые тоже отдаются (active=false): по ним клиент показывает имена в старых записях
+    return jsonify({'items': [{'id': r[0], 'name': r[1], 'active': bool(r[2])} for r in rows]})
+
+# --------------------- ГОД ТЕХНИКИ ---------------------
+
+@bp.route('/api/v1/heatmap')
+def api_heatmap():
+    """
+    Статусы и часы техники по дням года: ?year=2024&machine=1&machine=2.
+    Без machine — вся действующая техника страницами по HEATMAP_MAX_MACHINES
+    в порядке имени: next_offset — offset следующей страницы (None — последняя).
+    На машину два массива длиной в число дней года: status (код из statuses,
+    0 — записей нет) и hours.
+    """
+    year = request.args.get('year', type=int, default=datetime.now().year)
+    year, _ = clamp_year_month(year, 1)
+    ids = parse_machine_ids(request.args.getlist('machine'))
+    if ids is None:
+        return api_error("Некорректный machine")
+    if len(ids) > HEATMAP_MAX_MACHINES:
+        return api_error(f"Не больше {HEATMAP_MAX_MACHINES} машин за запрос")
+    offset = request.args.get('offset', type=int, default=0)
+    if offset < 0:
+        return api_error("Некорректный offset")
+
+    conn = get_db()
+    machines = {r[0]: r for r in get_reference(conn, "machines")}
+    next_offset = None
+    if not ids:
+        active = [r[0] for r in get_active(conn, "machines")]
+        ids = active[offset:offset + HEATMAP_MAX_MACHINES]
+        if offset + HEATMAP_MAX_MACHINES < len(active):
+            next_offset = offset + HEATMAP_MAX_MACHINES
+    unknown = [m_id for m_id in ids if m_id not in machines]
+    if unknown:
+        return api_error(f"Техника не найдена: {unknown[0]}", 404)
+
+    stamps = get_version_stamps(conn, ("machines",))
+    stamps['year'] = get_year_version(conn, year, ids)
+    validator = page_validator('api_heatmap', stamps, year, ids)
+    cached = not_modified(validator)
+    if cached is not None:
+        return cached
+
+    first, days, heatmap = load_year_heatmap(conn, year, ids)
+    return conditional_response(validator, jsonify({
+        'year': year,
+        'start': first.isoformat(),
+        'days': days,
+        'statuses': list(STATUS_CODES),
+        'machines': [{
+            'id': m_id,
+            'name': machines[m_id][1],
+            'active': bool(machines[m_id][2]),
+            'status': heatmap[m_id][0],
+            'hours': heatmap[m_id][1],
+        } for m_id in ids],
+        'next_offset': next_offset,
+    }))
+
+# --------------------- ИНКРЕМЕНТАЛЬНАЯ СИНХРОНИЗАЦИЯ ---------------------
+
+@bp.route('/api/v1/changes')
+def api_changes():
+    """
+    Изменения после seq=since: для каждой таблицы — актуальные версии изменённых
+    строк (upserted) и id удалённых (deleted). Клиент сохраняет next_since
+    и передаёт его в следующем запросе; has_more=true — есть ещё изменения.
+    """
+    since = request.args.get('since', type=int, default=0)
+    conn = get_db()
+    rows = conn.execute('''
+        SELECT seq, tbl, row_id FROM change_log WHERE seq > ? ORDER BY seq LIMIT ?
+    ''', (since, API_CHANGES_MAX + 1)).fetchall()
+    has_more = len(rows) > API_CHANGES_MAX
+    rows = rows[:API_CHANGES_MAX]
+
+    touched = {t: set() for t in REFERENCE_TABLES + ("records",)}
+    for _, tbl, row_id in rows:
+        if tbl in touched:
+            touched[tbl].add(row_id)
+
+    changes = {}
+    for tbl, ids in touched.items():
+        if tbl == "records":
+            upserted = _fetch_records(conn, sorted(ids))
+        else:
+            marks = ",".join("?" for _ in ids)
+            upserted = [{'id': r[0], 'name': r[1], 'active': bool(r[2])} for r in conn.execute(
+                f"SELECT id, name, active FROM {tbl} WHERE id IN ({marks}) ORDER BY id", sorted(ids))] if ids else []
+        present = {item['id'] for item in upserted}
+        changes[tbl] = {'upserted': upserted, 'deleted': sorted(ids - present)}
+
+    return jsonify({
+        'changes': changes,
+        'next_since': rows[-1][0] if rows else since,
+        'has_more': has_more,
+    })
@@ -0,0 +1,240 @@
+# app/archive.py
+
+import os
+import time
+from datetime import date
+
+from flask import current_app, g
+
+# Архив закрытых периодов: записи с датой раньше границы (archive_state.cutoff)
+# переносятся в отдельный файл SQLite. Рабочая база остаётся маленькой, и её
+# индексы помещаются в кэш страниц. Архив подключается (ATTACH) к соединению
+# только когда запрос заходит в архивный период; тогда records в запросе
+# заменяется объединением рабочей и архивной таблиц (records_source).
+
+ARCHIVE_SCHEMA = "archive"
+
+# Явный список столбцов: схемы рабочей и архивной таблиц не обязаны совпадать по порядку
+RECORD_COLUMNS = "id, date, machine_id, driver_id, start_time, end_time, hours, comment, counterparty_id, status"
+
+ARCHIVE_RECORDS_SQL = f'''
+    (SELECT {RECORD_COLUMNS} FROM main.records
+     UNION ALL
+     SELECT {RECORD_COLUMNS} FROM {ARCHIVE_SCHEMA}.records WHERE date < ?)
+'''
+
+
+def archive_path():
+    """
+    Файл архива: ARCHIVE_DATABASE или <база>_archive.db рядом с рабочей базой.
+    """
+    path = current_app.config.get('ARCHIVE_DATABASE')
+    if path:
+        return path
+    base, ext = os.path.splitext(current_app.config['DATABASE'])
+    return f"{base}_archive{ext or '.db'}"
+
+
+def get_cutoff(conn):
+    """
+    Граница архива 'YYYY-MM-DD' (записи раньше неё — в архиве) или None.
+    Читается один раз за запрос.
+    """
+    if g and '_archive_cutoff' in g:
+        return g._archive_cutoff
+    row = conn.execute("SELECT cutoff FROM archive_state WHERE id=1").fetchone()
+    cutoff = row[0] if row else None
+    if g:
+        g._archive_cutoff = cutoff
+    return cutoff
+
+
+def is_attached(conn):
+    return any(row[1] == ARCHIVE_SCHEMA for row in conn.execute("PRAGMA database_list"))
+
+
+def attach(conn):
+    """
+    Подключает архив к соединению, если он ещё не подключён.
+    Соединение остаётся с архивом и после возврата в пул.
+    """
+    if not is_attached(conn):
+        conn.execute(f"ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}", (archive_path(),))
+
+
+def archive_cutoff_for(conn, date_from=None, include=False):
+    """
+    Граница архива, если запрос с датой начала date_from заходит в архивный
+    период (или include=True), иначе None. Пустая date_from — период открыт
+    в прошлое и тоже заходит в архив. Если граница возвращается, архив уже
+    подключён к conn.
+    """
+    cutoff = get_cutoff(conn)
+    if not cutoff:
+        return None
+    if not include and date_from and date_from >= cutoff:
+        return None
+    attach(conn)
+    return cutoff
+
+
+# Поля фильтров списка записей (parse_record_filters), кроме сортировки
+FILTER_FIELDS = ('date_from', 'date_to', 'mach', 'driv', 'cpar', 'status', 'comment_sub')
+
+
+def cutoff_for_filters(conn, f, hot_when_unfiltered=False):
+    """
+    archive_cutoff_for() для фильтров списка записей (см. parse_record_filters):
+    без «Дата с» архив читается. hot_when_unfiltered — для страницы списка:
+    без единого фильтра она показывает только рабочую базу, пока архив
+    не запрошен явно (archive=1).
+    """
+    if hot_when_unfiltered and not f['archive'] and not any(f[k] for k in FILTER_FIELDS):
+        return None
+    return archive_cutoff_for(conn, f['date_from'], f['archive'])
+
+
+def records_source(cutoff):
+    """
+    Источник строк records для FROM: рабочая таблица или, если передана
+    граница архива, объединение с архивом. Возвращает (sql, params).
+    """
+    if cutoff is None:
+        return "records", []
+    return ARCHIVE_RECORDS_SQL, [cutoff]
+
+
+def ensure_open_period(conn, date_str):
+    """
+    ValueError, если дата попадает в закрытый (архивный) период.
+    """
+    cutoff = get_cutoff(conn)
+    if cutoff and date_str and str(date_str) < cutoff:
+        raise ValueError(f"Период до {cutoff} закрыт и перенесён в архив")
+
+# --------------------- ПЕРЕНОС В АРХИВ ---------------------
+
+def _create_archive_schema(conn):
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {ARCHIVE_SCHEMA}.records (
+            id INTEGER PRIMARY KEY,
+            date DATE NOT NULL,
+            machine_id INTEGER,
+            driver_id INTEGER,
+            start_time TEXT,
+            end_time TEXT,
+            hours INTEGER DEFAULT 0,
+            comment TEXT,
+            counterparty_id INTEGER,
+            status TEXT NOT NULL
+        )
+    ''')
+    # те же индексы, что у рабочей таблицы (migration 1)
+    for name, columns in (("machine_date", "machine_id, date"), ("driver_date", "driver_id, date"),
+                          ("counterparty_date", "counterparty_id, date"), ("status_date", "status, date"),
+                          ("date", "date"), ("hours_date", "hours, date")):
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.idx_records_{name} ON records({columns})")
+    conn.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS {ARCHIVE_SCHEMA}.records_fts USING fts5(
+            comment,
+            content='records',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+
+
+def _copy_to_archive(conn, cutoff, changed_only=False):
+    """
+    Копирует записи с датой < cutoff в архив (changed_only — только те,
+    которых там нет или которые отличаются). Возвращает число скопированных.
+    """
+    cond = ""
+    if changed_only:
+        same = " AND ".join(f"a.{c} IS m.{c}" for c in RECORD_COLUMNS.split(", "))
+        cond = f"AND NOT EXISTS (SELECT 1 FROM {ARCHIVE_SCHEMA}.records a WHERE {same})"
+    copied = conn.execute(f'''
+        INSERT OR REPLACE INTO {ARCHIVE_SCHEMA}.records ({RECORD_COLUMNS})
+        SELECT {RECORD_COLUMNS} FROM main.records m WHERE m.date < ? {cond}
+    ''', (cutoff,)).rowcount
+    if copied:
+        conn.execute(f"INSERT INTO {ARCHIVE_SCHEMA}.records_fts (records_fts) VALUES ('rebuild')")
+    return copied
+
+
+def _drop_stale_copies(conn, cutoff, current):
+    """
+    Удаляет из архива копии строк переносимого периода [current, cutoff),
+    которых в рабочей таблице уже нет с датой < cutoff: строка удалена после
+    первого шага (или после прерванного переноса) или её дата сдвинута за
+    границу. Иначе удалённая запись воскресла бы в архиве, а её id, освобождённый
+    в free_ids, оказался бы занят и в рабочей базе, и в архиве.
+    Возвращает число удалённых копий.
+    """
+    lower, lower_pr = ("a.date >= ? AND ", [current]) if current else ("", [])
+    dropped = conn.execute(f'''
+        DELETE FROM {ARCHIVE_SCHEMA}.records
+         WHERE id IN (SELECT a.id FROM {ARCHIVE_SCHEMA}.records a
+                       WHERE {lower}a.date < ?
+                         AND NOT EXISTS (SELECT 1 FROM main.records m
+                                          WHERE m.id = a.id AND m.date < ?))
+    ''', lower_pr + [cutoff, cutoff]).rowcount
+    if dropped:
+        conn.execute(f"INSERT INTO {ARCHIVE_SCHEMA}.records_fts (records_fts) VALUES ('rebuild')")
+    return dropped
+
+
+def archive_records(conn, cutoff):
+    """
+    Переносит записи с датой < cutoff в архив и сдвигает границу.
+    Граница только растёт; повторный запуск с той же границей доделывает
+    прерванный перенос. Возвращает число перенесённых записей.
+
+    Основной объём копируется отдельной транзакцией архива, пока рабочая база
+    доступна на запись. Затем под блокировкой записи рабочей базы архив
+    сверяется с records: докопируются строки, изменённые за это время,
+    убираются копии строк, которых в records больше нет, и только после этого
+    строки удаляются из records и сдвигается граница. Пока граница не сдвинута,
+    архивные строки после старой границы не читаются.
+    """
+    cutoff = date.fromisoformat(cutoff).isoformat()
+    current = get_cutoff(conn)
+    if current and cutoff < current:
+        return 0
+
+    conn.commit()
+    attach(conn)
+    _create_archive_schema(conn)
+
+    conn.execute("BEGIN")
+    try:
+        _copy_to_archive(conn, cutoff)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        _copy_to_archive(conn, cutoff, changed_only=True)
+        _drop_stale_copies(conn, cutoff, current)
+        max_id = conn.execute(f"SELECT MAX(id) FROM {ARCHIVE_SCHEMA}.records").fetchone()[0]
+        conn.execute("INSERT INTO archive_guard (active) VALUES (1)")
+        moved = conn.execute("DELETE FROM main.records WHERE date < ?", (cutoff,)).rowcount
+        conn.execute("DELETE FROM archive_guard")
+        conn.execute('''
+            INSERT INTO archive_state (id, cutoff, archived_at) VALUES (1, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET cutoff=excluded.cutoff, archived_at=excluded.archived_at
+        ''', (cutoff, int(time.time())))
+        if max_id is not None:
+            conn.execute('''
+                INSERT INTO id_floors (tbl, max_id) VALUES ('records', ?)
+                ON CONFLICT (tbl) DO UPDATE SET max_id=MAX(max_id, excluded.max_id)
+            ''', (max_id,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if g:
+        g.pop('_archive_cutoff', None)
+    return moved
@@ -0,0 +1,125 @@
+# app/calendar_cache.py
+
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+from flask import current_app
+
+# Кэш отрендеренной сетки календаря техники за месяц.
+# Ключ — (machine_id, год, месяц), вместе с HTML хранится версия данных,
+# из которых он построен (month_versions + версии справочников). Если версия
+# не совпала, запись считается устаревшей — так правки из другого воркера
+# тоже замечаются. Запись в records вызывает evict_records() и сразу
+# выбрасывает затронутые месяцы.
+#
+# Два уровня: LRU в памяти воркера (CALENDAR_CACHE_SIZE месяцев) и, если задан
+# CALENDAR_CACHE_DIR, файлы на диске, общие для всех воркеров gunicorn.
+
+_memory = OrderedDict()  # (machine_id, год, месяц) -> (версия, html)
+_lock = threading.Lock()
+
+
+def _disk_prefix(key):
+    path = current_app.config.get('CALENDAR_CACHE_DIR')
+    if not path:
+        return None
+    machine_id, year, month = key
+    return os.path.join(path, f"{machine_id}-{year:04d}-{month:02d}")
+
+
+def _disk_get(key, version):
+    prefix = _disk_prefix(key)
+    if prefix is None:
+        return None
+    try:
+        with open(f"{prefix}.{version}.html", encoding='utf-8') as fh:
+            return fh.read()
+    except OSError:
+        return None
+
+
+def _disk_drop(prefix, keep=None):
+    directory, name = os.path.split(prefix)
+    try:
+        entries = os.listdir(directory)
+    except OSError:
+        return
+    for entry in entries:
+        if entry.startswith(name + ".") and entry.endswith(".html") and entry != keep:
+            try:
+                os.remove(os.path.join(directory, entry))
+            except OSError:
+                pass
+
+
+def _disk_put(key, version, html):
+    prefix = _disk_prefix(key)
+    if prefix is None:
+        return
+    os.makedirs(os.path.dirname(prefix), exist_ok=True)
+    path = f"{prefix}.{version}.html"
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as fh:
+        fh.write(html)
+    os.replace(tmp, path)
+    # старые версии этого месяца больше не понадобятся
+    _disk_drop(prefix, keep=os.path.basename(path))
+
+
+def _memory_put(key, version, html):
+    with _lock:
+        _memory[key] = (version, html)
+        _memory.move_to_end(key)
+        while len(_memory) > current_app.config['CALENDAR_CACHE_SIZE']:
+            _memory.popitem(last=False)
+
+
+def get_grid(machine_id, year, month, version, render):
+    """
+    HTML сетки месяца из кэша; при промахе вызывает render() и кэширует результат.
+    version — строка, меняющаяся при любом изменении данных сетки.
+    """
+    key = (machine_id, year, month)
+    with _lock:
+        cached = _memory.get(key)
+        if cached and cached[0] == version:
+            _memory.move_to_end(key)
+            return cached[1]
+
+    html = _disk_get(key, version)
+    if html is None:
+        html = render()
+        _disk_put(key, version, html)
+    _memory_put(key, version, html)
+    return html
+
+
+def evict(machine_id, year, month):
+    """
+    Выбрасывает сетку одного месяца техники из памяти и с диска.
+    """
+    key = (machine_id, year, month)
+    with _lock:
+        _memory.pop(key, None)
+    prefix = _disk_prefix(key)
+    if prefix is not None:
+        _disk_drop(prefix)
+
+
+def evict_records(rows):
+    """
+    Выбрасывает месяцы, затронутые записями: rows — пары (machine_id, дата 'YYYY-MM-DD').
+    Вызывается после записи в records.
+    """
+    months = set()
+    for machine_id, date_str in rows:
+        if machine_id is None or not date_str:
+            continue
+        try:
+            months.add((int(machine_id), int(date_str[:4]), int(date_str[5:7])))
+        except (TypeError, ValueError):
+            continue
+    for key in months:
+        evict(*key)
@@ -0,0 +1,124 @@
+# app/calendar_data.py
+
+from datetime import date, timedelta
+
+from .archive import archive_cutoff_for, records_source
+
+# Один SELECT для всех дней месяца: вместо запроса на каждый день
+# выбираем диапазон дат целиком и раскладываем строки по дням в Python.
+MONTH_RECORDS_SQL = '''
+    SELECT
+      r.machine_id,
+      r.date,
+      CASE
+        WHEN r.driver_id IS NULL THEN '—'
+        WHEN d.id IS NULL THEN 'Водитель удалён'
+        ELSE d.name
+      END AS driver_name,
+      r.status,
+      r.start_time,
+      r.end_time,
+      CASE
+        WHEN r.counterparty_id IS NULL THEN ''
+        WHEN c.id IS NULL THEN 'Контрагент удалён'
+        ELSE c.name
+      END AS counterparty_name
+    FROM {source} r
+    LEFT JOIN drivers d ON r.driver_id=d.id
+    LEFT JOIN counterparties c ON r.counterparty_id=c.id
+    WHERE {machine_filter} r.date BETWEEN ? AND ?
+    ORDER BY r.machine_id, r.date, r.id
+'''
+
+
+def clamp_year_month(year: int, month: int):
+    """
+    Ограничивает год и месяц допустимым диапазоном календаря.
+    """
+    month = min(max(month, 1), 12)
+    year = min(max(year, 2020), 2030)
+    return year, month
+
+
+def month_dates(year: int, month: int):
+    """
+    Возвращает список всех дат (datetime.date) указанного месяца.
+    """
+    first_day = date(year, month, 1)
+    next_first = (first_day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return [first_day + timedelta(days=i) for i in range((next_first - first_day).days)]
+
+
+def month_nav(year: int, month: int):
+    """
+    Возвращает (prev_year, prev_month, next_year, next_month) для ссылок навигации.
+    """
+    prev_year, prev_month = (year - 1, 12) if month == 1 else (year, month - 1)
+    next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return prev_year, prev_month, next_year, next_month
+
+
+def _month_rows(conn, year, month, machine_id=None):
+    dates = month_dates(year, month)
+    # месяц из закрытого периода читается вместе с архивом
+    source, params = records_source(archive_cutoff_for(conn, dates[0].isoformat()))
+    if machine_id is None:
+        sql = MONTH_RECORDS_SQL.format(source=source, machine_filter="")
+    else:
+        sql = MONTH_RECORDS_SQL.format(source=source, machine_filter="r.machine_id=? AND")
+        params.append(machine_id)
+    params += [dates[0].isoformat(), dates[-1].isoformat()]
+    return dates, conn.execute(sql, params)
+
+
+def load_machine_month(conn, machine_id: int, year: int, month: int):
+    """
+    Загружает записи одной техники за месяц одним запросом.
+    Возвращает (dates, recs_dict), где recs_dict[date] — список строк
+    (driver_name, status, start_time, end_time, counterparty_name).
+    """
+    dates, rows = _month_rows(conn, year, month, machine_id)
+    recs_dict = {d: [] for d in dates}
+    by_iso = {d.isoformat(): recs_dict[d] for d in dates}
+    for row in rows:
+        day_recs = by_iso.get(row[1])
+        if day_recs is not None:
+            day_recs.append(row[2:])
+    return dates, recs_dict
+
+
+def load_machine_day(conn, machine_id: int, day: date):
+    """
+    Записи одной техники за один день — для перерисовки ячейки календаря.
+    Возвращает список строк в том же формате, что и в load_machine_month().
+    """
+    source, params = records_source(archive_cutoff_for(conn, day.isoformat()))
+    sql = MONTH_RECORDS_SQL.format(source=source, machine_filter="r.machine_id=? AND")
+    rows = conn.execute(sql, params + [machine_id, day.isoformat(), day.isoformat()])
+    return [row[2:] for row in rows]
+
+
+def load_fleet_month(conn, year: int, month: int, machines=None):
+    """
+    Загружает сетку всего парка техники за месяц двумя запросами
+    (список техники + все записи месяца). Список техники можно передать
+    готовым (например, из кэша справочников) — тогда запрос один.
+    Удалённая техника (active=0) попадает в сетку, только если у неё
+    есть записи за этот месяц.
+    Возвращает (machines, dates, grid), где grid[machine_id][date] —
+    список строк в том же формате, что и в load_machine_month().
+    """
+    if machines is None:
+        machines = conn.execute("SELECT * FROM machines ORDER BY id").fetchall()
+    dates, rows = _month_rows(conn, year, month)
+    rows = rows.fetchall()
+    busy = {row[0] for row in rows}
+    machines = [m for m in machines if m[2] or m[0] in busy]
+    grid = {m[0]: {d: [] for d in dates} for m in machines}
+    by_iso = {(m_id, d.isoformat()): days[d]
+              for m_id, days in grid.items() for d in dates}
+    for row in rows:
+        day_recs = by_iso.get((row[0], row[1]))
+        if day_recs is not None:
+            day_recs.append(row[2:])
+    return machines, dates, grid
@@ -0,0 +1,170 @@
+# app/changefeed.py
+
+import json
+import os
+import sqlite3
+import threading
+from collections import deque
+
+from .database import get_db
+
+# Лента изменений для живых страниц (SSE, роут /events). Источник — журнал
+# change_log (migrations 6 и 10), который пишут триггеры при каждой правке
+# записей и справочников, из любого воркера.
+#
+# Журнал читает один поток-опросчик на процесс: раз в CHANGEFEED_POLL_INTERVAL
+# (или сразу после коммита писателя этого процесса, см. notify) он забирает
+# новые строки одним запросом по первичному ключу и кладёт готовые SSE-события
+# в кольцевой буфер. Подписчики ждут на общем Condition: простаивающий
+# подписчик не выполняет ни одного запроса к SQLite, а событие сериализуется
+# один раз для всех.
+#
+# Открытый поток SSE занимает поток сервера, поэтому gunicorn запускается
+# с воркерами gthread (gunicorn.conf.py), а не sync; SSE_MAX_AGE периодически
+# закрывает поток, и браузер переподключается. Потоки воркера общие с обычными
+# запросами, поэтому подписчиков на процесс не больше SSE_MAX_SUBSCRIBERS:
+# сверх этого /events отвечает 503, и страница переподключается позже.
+
+# путь к базе -> (pid, лента)
+_feeds = {}
+_feeds_lock = threading.Lock()
+
+MAX_SEQ = 2 ** 63 - 1  # верхняя граница INTEGER в SQLite
+
+CHANGES_SQL = '''
+    SELECT seq, tbl, row_id, op, machine_id, day
+      FROM change_log
+     WHERE seq > ? AND seq <= ?
+     ORDER BY seq
+     LIMIT ?
+'''
+
+
+def get_change_seq(conn):
+    """
+    Последний seq журнала изменений: с него страница подписывается на ленту.
+    """
+    return conn.execute("SELECT IFNULL(MAX(seq), 0) FROM change_log").fetchone()[0]
+
+
+def _event(row):
+    seq, tbl, row_id, op, machine_id, day = row
+    data = {'table': tbl, 'id': row_id, 'op': op}
+    if tbl == "records":
+        data.update(machine_id=machine_id, date=day)
+    text = f"id: {seq}\nevent: change\ndata: {json.dumps(data)}\n\n"
+    return seq, tbl, machine_id, text
+
+
+class ChangeFeed:
+    def __init__(self, app):
+        self.app = app
+        self.size = app.config['CHANGEFEED_BUFFER']
+        self.events = deque(maxlen=self.size)  # (seq, таблица, machine_id, текст SSE)
+        self.cond = threading.Condition()
+        self.wake = threading.Event()
+        self.subscribers = 0
+        with app.app_context():
+            self.last_seq = get_change_seq(get_db())
+        # события с seq <= floor в буфере уже нет
+        self.floor = self.last_seq
+        self.thread = threading.Thread(target=self._loop, name='changefeed', daemon=True)
+        self.thread.start()
+
+    def _loop(self):
+        interval = self.app.config['CHANGEFEED_POLL_INTERVAL']
+        while True:
+            self.wake.wait(interval)
+            self.wake.clear()
+            try:
+                with self.app.app_context():
+                    rows = get_db().execute(CHANGES_SQL, (self.last_seq, MAX_SEQ, self.size)).fetchall()
+            except sqlite3.Error:
+                self.app.logger.exception("Лента изменений: ошибка чтения change_log")
+                continue
+            if rows:
+                self._publish(rows)
+                if len(rows) == self.size:
+                    self.wake.set()  # за интервал набежало больше буфера — дочитываем сразу
+
+    def _publish(self, rows):
+        with self.cond:
+            for row in rows:
+                if len(self.events) == self.size:
+                    self.floor = self.events[0][0]
+                self.events.append(_event(row))
+            self.last_seq = rows[-1][0]
+            self.cond.notify_all()
+
+    def replay(self, conn, since):
+        """
+        События с since до начала буфера — из базы, один раз при подключении
+        отставшего клиента. Возвращает (события, seq, с которого дальше ждать
+        через wait) или None — клиент отстал больше чем на буфер (см. reset_event).
+        """
+        with self.cond:
+            floor = self.floor
+        if since >= floor:
+            return [], since
+        rows = conn.execute(CHANGES_SQL, (since, floor, self.size + 1)).fetchall()
+        if len(rows) > self.size:
+            return None
+        return [_event(row) for row in rows], floor
+
+    def reset_event(self):
+        """
+        SSE-событие reset с текущим seq. Страница не перезагружается (её HTML
+        мог прийти из кэша браузера по 304 с тем же старым seq), а заново
+        загружает показанные данные и подписывается с этого seq.
+        """
+        return f"event: reset\ndata: {json.dumps({'seq': self.last_seq})}\n\n"
+
+    def subscribe(self, limit):
+        """
+        Занимает место подписчика; False — в процессе уже limit подписчиков.
+        """
+        with self.cond:
+            if self.subscribers >= limit:
+                return False
+            self.subscribers += 1
+            return True
+
+    def unsubscribe(self):
+        with self.cond:
+            self.subscribers -= 1
+
+    def wait(self, since, timeout):
+        """
+        События буфера с seq > since; если их нет — ждёт до timeout секунд.
+        [] — новых событий нет, None — since вытеснен из буфера.
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self.last_seq > since, timeout)
+            if since < self.floor:
+                return None
+            found = []
+            for event in reversed(self.events):
+                if event[0] <= since:
+                    break
+                found.append(event)
+            found.reverse()
+            return found
+
+
+def get_feed(app):
+    path = app.config['DATABASE']
+    with _feeds_lock:
+        feed = _feeds.get(path)
+        # перезапуск после fork — см. app/writer.py
+        if feed is None or feed[0] != os.getpid() or not feed[1].thread.is_alive():
+            feed = _feeds[path] = (os.getpid(), ChangeFeed(app))
+        return feed[1]
+
+
+def notify(app):
+    """
+    Будит опросчика после коммита в этом процессе, не дожидаясь интервала.
+    """
+    feed = _feeds.get(app.config['DATABASE'])
+    if feed is not None and feed[0] == os.getpid():
+        feed[1].wake.set()
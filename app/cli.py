@@ -0,0 +1,92 @@
+# app/cli.py
+
+from datetime import date
+
+import click
+from flask import Blueprint, current_app
+
+from .database import get_db, init_db, check_query_plans, backup_database
+from .importer import import_records, read_rows
+from .archive import archive_records
+from .conflicts import audit_conflicts
+
+# --------------------- КОМАНДЫ flask CLI ---------------------
+
+# Команды добавляются прямо в группу flask (без префикса блюпринта)
+bp = Blueprint('cli', __name__, cli_group=None)
+
+@bp.cli.command('init-db')
+def init_db_command():
+    """Создаёт таблицы и применяет миграции схемы. Запускать при установке и после обновления."""
+    init_db()
+    click.echo(f"Схема базы готова: {current_app.config['DATABASE']}")
+
+@bp.cli.command('check-plans')
+def check_plans_command():
+    """Проверяет через EXPLAIN QUERY PLAN, что горячие запросы идут по индексам."""
+    conn = get_db()
+    problems = check_query_plans(conn)
+
+    if not problems:
+        click.echo("OK: полных сканов records в горячих запросах нет")
+        return
+    for name, detail in problems:
+        click.echo(f"FULL SCAN: {name}: {detail}")
+    raise SystemExit(1)
+
+@bp.cli.command('backup')
+@click.argument('dest')
+def backup_command(dest):
+    """Сохраняет согласованную копию базы в DEST, не останавливая приложение."""
+    backup_database(dest)
+    click.echo(f"Резервная копия сохранена: {dest}")
+
+@bp.cli.command('import-records')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def import_records_command(path):
+    """Импортирует записи из .xlsx или .csv (заголовки как в выгрузке)."""
+    with open(path, 'rb') as fh:
+        result = import_records(get_db(), read_rows(fh, path), current_app.config['IMPORT_BATCH_SIZE'])
+    click.echo(f"Добавлено: {result.inserted}, дубликатов пропущено: {result.duplicates}, "
+               f"ошибок: {len(result.errors)}")
+    for line_no, message in result.errors:
+        click.echo(f"  строка {line_no}: {message}")
+
+@bp.cli.command('archive-records')
+@click.option('--before', help="Граница архива YYYY-MM-DD: записи раньше неё уходят в архив.")
+@click.option('--keep-months', type=int, help="Оставить в рабочей базе N последних месяцев.")
+@click.option('--vacuum', is_flag=True, help="После переноса сжать файл рабочей базы.")
+def archive_records_command(before, keep_months, vacuum):
+    """Переносит записи закрытых периодов в архивную базу."""
+    if bool(before) == (keep_months is not None):
+        raise click.UsageError("Укажите ровно один из параметров --before или --keep-months")
+    if before:
+        try:
+            cutoff = date.fromisoformat(before).isoformat()
+        except ValueError:
+            raise click.BadParameter("ожидается дата YYYY-MM-DD", param_hint='--before')
+    else:
+        today = date.today()
+        months = today.year * 12 + today.month - 1 - keep_months
+        cutoff = date(months // 12, months % 12 + 1, 1).isoformat()
+
+    conn = get_db()
+    moved = archive_records(conn, cutoff)
+    click.echo(f"Граница архива: {cutoff}, перенесено записей: {moved}")
+    if vacuum and moved:
+        conn.execute("VACUUM main")
+        click.echo("Рабочая база сжата")
+
+@bp.cli.command('audit-conflicts')
+def audit_conflicts_command():
+    """Ищет пересекающиеся смены техники и водителей (один проход по отсортированным записям)."""
+    conflicts = audit_conflicts(get_db())
+    if not conflicts:
+        click.echo("OK: пересечений смен нет")
+        return
+    what = {'machine': "техника", 'driver': "водитель"}
+    for kind, resource_id, a, b in conflicts:
+        click.echo(f"{what[kind]} #{resource_id}: запись #{a[0]} {a[1]} {a[2]}–{a[3]} "
+                   f"и #{b[0]} {b[1]} {b[2]}–{b[3]}")
+    click.echo(f"Пересечений: {len(conflicts)}")
+    raise SystemExit(1)
@@ -0,0 +1,71 @@
+# app/conditional.py
+
+import hashlib
+from datetime import datetime, timezone
+
+from flask import g, request, make_response, session
+
+# Условные GET-запросы (ETag / Last-Modified) для страниц, которые держат
+# открытыми на настенных мониторах. Валидатор страницы строится из счётчиков
+# версий данных (data_versions, month_versions) — это один-два коротких
+# запроса; если браузер прислал тот же ETag, отвечаем 304, не выполняя
+# запросов страницы и не рендеря шаблон.
+
+
+class PageValidator:
+    def __init__(self, parts, updated_at=()):
+        raw = "|".join(str(p) for p in parts)
+        self.etag = hashlib.sha1(raw.encode('utf-8')).hexdigest()[:20]
+        stamps = [t for t in updated_at if t]
+        self.last_modified = (datetime.fromtimestamp(max(stamps), tz=timezone.utc)
+                              if stamps else None)
+
+    def is_fresh(self):
+        """
+        Совпадает ли закэшированная браузером копия с текущими данными.
+        If-None-Match важнее If-Modified-Since (секундной точности может не хватить).
+        """
+        if request.if_none_match:
+            return request.if_none_match.contains(self.etag)
+        if request.if_modified_since and self.last_modified:
+            return self.last_modified <= request.if_modified_since
+        return False
+
+
+def page_validator(name, stamps, *extra):
+    """
+    Валидатор страницы name по штампам версий {ключ: (версия, updated_at)}
+    и дополнительным параметрам (год, месяц, аргументы запроса и т.п.).
+    """
+    keys = sorted(stamps)
+    parts = [name, *extra] + [f"{k}:{stamps[k][0]}" for k in keys]
+    return PageValidator(parts, [stamps[k][1] for k in keys])
+
+
+def not_modified(validator):
+    """
+    Ответ 304, если копия браузера актуальна, иначе None.
+    Страница с flash-сообщениями всегда рендерится заново и не кэшируется.
+    """
+    if '_flashes' in session:
+        g._uncacheable_page = True
+        return None
+    if validator.is_fresh():
+        return conditional_response(validator, ('', 304))
+    return None
+
+
+def conditional_response(validator, rv):
+    """
+    Добавляет к ответу ETag и Last-Modified. Cache-Control: no-cache —
+    браузер хранит страницу, но каждый раз сверяется с сервером.
+    """
+    response = make_response(rv)
+    if g.get('_uncacheable_page'):
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    response.set_etag(validator.etag)
+    if validator.last_modified:
+        response.last_modified = validator.last_modified
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
@@ -0,0 +1,144 @@
+# app/conflicts.py
+
+from datetime import date, timedelta
+
+from .archive import archive_cutoff_for, records_source
+from .database import HOT_QUERIES
+
+# Пересечения смен: одна техника или один водитель не могут работать
+# в двух записях с пересекающимся временем. Запись без start_time/end_time
+# (выходной, ремонт без времени) ни с чем не пересекается. Если конец раньше
+# начала, смена переходит через полночь (как в compute_hours) — поэтому
+# запись за день D может пересечься с записями за D-1 и D+1.
+#
+# Время записи переводится в минуты от начала эпохи ordinal-дат, и дальше
+# всё сравнивается как полуоткрытые интервалы [начало, конец).
+
+# вид ресурса -> столбец records
+RESOURCES = (
+    ("machine", "machine_id"),
+    ("driver", "driver_id"),
+)
+
+# Записи ресурса за соседние дни — по индексам idx_records_{machine,driver}_date
+NEIGHBOURS_SQL = '''
+    SELECT r.id, r.date, r.start_time, r.end_time
+      FROM {source} r
+     WHERE r.{column}=? AND r.date BETWEEN ? AND ?
+       AND r.start_time IS NOT NULL AND r.end_time IS NOT NULL
+'''
+
+# Все записи со временем, упорядоченные по ресурсу и началу смены — для аудита
+SWEEP_SQL = '''
+    SELECT r.{column}, r.id, r.date, r.start_time, r.end_time
+      FROM records r
+     WHERE r.{column} IS NOT NULL
+       AND r.start_time IS NOT NULL AND r.end_time IS NOT NULL
+     ORDER BY r.{column}, r.date, r.start_time
+'''
+
+for _kind, _column in RESOURCES:
+    HOT_QUERIES.append((
+        f"conflicts: смены {_kind} за соседние дни",
+        NEIGHBOURS_SQL.format(source="records", column=_column),
+        (1, '2024-01-01', '2024-01-03'),
+    ))
+
+
+def _minutes(hhmm):
+    return int(hhmm[:2]) * 60 + int(hhmm[3:5])
+
+
+def shift_interval(date_str, start_time, end_time):
+    """
+    Интервал смены (начало, конец) в минутах или None, если времени нет
+    или оно некорректно. Смена с концом раньше начала переходит через полночь.
+    """
+    if not (start_time and end_time):
+        return None
+    try:
+        start = date.fromisoformat(str(date_str)).toordinal() * 1440 + _minutes(start_time)
+        length = (_minutes(end_time) - _minutes(start_time)) % 1440
+    except ValueError:
+        return None
+    if not length:
+        return None
+    return start, start + length
+
+
+def find_conflicts(conn, date_str, start_time, end_time, resources, exclude_id=None):
+    """
+    Записи, пересекающиеся со сменой (date_str, start_time, end_time).
+    resources — {вид ресурса: id} (например {'machine': 1, 'driver': 3}).
+    Возвращает список (вид ресурса, id записи, дата, начало, конец).
+    """
+    interval = shift_interval(date_str, start_time, end_time)
+    if interval is None:
+        return []
+    day = date.fromisoformat(str(date_str))
+    first, last = (day - timedelta(days=1)).isoformat(), (day + timedelta(days=1)).isoformat()
+    # предыдущий день может оказаться в архиве
+    source, source_pr = records_source(archive_cutoff_for(conn, first))
+
+    conflicts = []
+    for kind, column in RESOURCES:
+        resource_id = resources.get(kind)
+        if resource_id is None:
+            continue
+        sql = NEIGHBOURS_SQL.format(source=source, column=column)
+        for rec_id, rec_date, rec_start, rec_end in conn.execute(sql, source_pr + [resource_id, first, last]):
+            if rec_id == exclude_id:
+                continue
+            other = shift_interval(rec_date, rec_start, rec_end)
+            if other and other[0] < interval[1] and interval[0] < other[1]:
+                conflicts.append((kind, rec_id, rec_date, rec_start, rec_end))
+    return conflicts
+
+
+def ensure_no_conflicts(conn, date_str, start_time, end_time, machine_id, driver_id, exclude_id=None):
+    """
+    ValueError с описанием, если смена пересекается с другой сменой
+    той же техники или того же водителя.
+    """
+    conflicts = find_conflicts(conn, date_str, start_time, end_time,
+                               {'machine': machine_id, 'driver': driver_id}, exclude_id)
+    if not conflicts:
+        return
+    what = {'machine': "техники", 'driver': "водителя"}
+    details = "; ".join(f"{what[kind]}: запись #{rec_id} {rec_date} {st}–{en}"
+                        for kind, rec_id, rec_date, st, en in conflicts)
+    raise ValueError(f"Смена пересекается с другими сменами {details}")
+
+
+def _sweep(rows):
+    """
+    Один проход по сменам, упорядоченным по (ресурс, начало): держим список
+    ещё не закончившихся смен ресурса и сравниваем новую только с ними.
+    Отдаёт (ресурс, запись A, запись B), где запись — (id, дата, начало, конец).
+    """
+    current = None
+    active = []  # (конец, запись)
+    for resource_id, rec_id, rec_date, start_time, end_time in rows:
+        interval = shift_interval(rec_date, start_time, end_time)
+        if interval is None:
+            continue
+        if resource_id != current:
+            current, active = resource_id, []
+        start, end = interval
+        active = [(a_end, a_rec) for a_end, a_rec in active if a_end > start]
+        rec = (rec_id, rec_date, start_time, end_time)
+        for _, a_rec in active:
+            yield resource_id, a_rec, rec
+        active.append((end, rec))
+
+
+def audit_conflicts(conn):
+    """
+    Все пересечения смен в рабочей таблице records (архив закрыт для правок).
+    Возвращает список (вид ресурса, id ресурса, запись A, запись B).
+    """
+    found = []
+    for kind, column in RESOURCES:
+        rows = conn.execute(SWEEP_SQL.format(column=column))
+        found.extend((kind, resource_id, a, b) for resource_id, a, b in _sweep(rows))
+    return found
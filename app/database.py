@@ -1,19 +1,130 @@
 # app/database.py
 
+import os
 import sqlite3
-from flask import current_app
+import threading
+from flask import current_app, g
 from datetime import datetime, timedelta
 
-def get_db():
+from .sqltrace import InstrumentedConnection
+
+# --------------------- ПОДКЛЮЧЕНИЯ ---------------------
+
+# Пул простаивающих соединений текущего процесса (воркера gunicorn): путь к базе -> список.
+# Соединение берётся из пула на время запроса и возвращается при teardown контекста.
+_pool = {}
+_pool_lock = threading.Lock()
+_pool_pid = os.getpid()
+
+def connect(path=None):
     """
-    Подключение к базе данных с учётом таймаута, 
-    включаем foreign_keys=ON и возвращаем объект conn.
+    Открывает новое настроенное соединение (вне пула).
+    Включает WAL, synchronous=NORMAL, mmap, размер кэша страниц и foreign_keys=ON.
+    При SQL_INSTRUMENTATION соединение считает запросы и время (см. sqltrace).
     """
-    conn = sqlite3.connect(current_app.config['DATABASE'], 
-                           timeout=current_app.config['SQLITE_TIMEOUT'])
+    cfg = current_app.config
+    instrumented = cfg['SQL_INSTRUMENTATION']
+    conn = sqlite3.connect(path or cfg['DATABASE'],
+                           timeout=cfg['SQLITE_TIMEOUT'],
+                           cached_statements=cfg['SQLITE_CACHED_STATEMENTS'],
+                           check_same_thread=False,
+                           factory=InstrumentedConnection if instrumented else sqlite3.Connection)
+    if instrumented:
+        conn.slow_ms = cfg['SQL_SLOW_MS']
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA mmap_size = {int(cfg['SQLITE_MMAP_SIZE'])}")
+    conn.execute(f"PRAGMA cache_size = {int(cfg['SQLITE_CACHE_SIZE'])}")
     conn.execute("PRAGMA foreign_keys = ON")
     return conn
 
+def _idle_connections(path):
+    global _pool_pid
+    # После fork соединения родителя использовать нельзя — начинаем с пустого пула
+    if _pool_pid != os.getpid():
+        _pool.clear()
+        _pool_pid = os.getpid()
+    return _pool.setdefault(path, [])
+
+def acquire_connection(path=None):
+    """
+    Берёт соединение из пула процесса или открывает новое.
+    """
+    path = path or current_app.config['DATABASE']
+    with _pool_lock:
+        idle = _idle_connections(path)
+        conn = idle.pop() if idle else None
+    if conn is None:
+        return connect(path)
+    if isinstance(conn, InstrumentedConnection):
+        conn.stats.reset()
+        conn.slow_ms = current_app.config['SQL_SLOW_MS']
+    return conn
+
+def release_connection(conn, path=None):
+    """
+    Возвращает соединение в пул (незавершённая транзакция откатывается).
+    Лишние соединения сверх SQLITE_POOL_SIZE закрываются.
+    """
+    path = path or current_app.config['DATABASE']
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+    except sqlite3.Error:
+        conn.close()
+        return
+    with _pool_lock:
+        idle = _idle_connections(path)
+        if len(idle) < current_app.config['SQLITE_POOL_SIZE']:
+            idle.append(conn)
+            return
+    conn.close()
+
+def close_pool():
+    """
+    Закрывает все простаивающие соединения процесса.
+    """
+    with _pool_lock:
+        conns = [c for idle in _pool.values() for c in idle]
+        _pool.clear()
+    for conn in conns:
+        conn.close()
+
+def get_db():
+    """
+    Соединение текущего запроса (одно на контекст приложения).
+    Закрывать его не нужно — оно вернётся в пул в close_db().
+    """
+    if 'db' not in g:
+        g.db = acquire_connection()
+    return g.db
+
+def close_db(exc=None):
+    """
+    teardown_appcontext: возвращает соединение запроса в пул.
+    """
+    conn = g.pop('db', None)
+    if conn is not None:
+        release_connection(conn)
+
+def init_app(app):
+    app.teardown_appcontext(close_db)
+
+def backup_database(dest):
+    """
+    Онлайн-копия базы в файл dest через backup API SQLite. Копия снимается
+    за один шаг внутри читающей транзакции: это согласованный снимок вместе
+    с содержимым -wal, а писатели других процессов в WAL не блокируются.
+    Копия — самостоятельный файл без -wal/-shm.
+    """
+    src = connect()
+    dst = sqlite3.connect(dest)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
 def init_db():
     """
     Создаёт таблицы в базе, если они не существуют.
@@ -60,15 +171,612 @@ def init_db():
             )
         ''')
         conn.commit()
-        conn.close()
+        migrate(conn)
+
+# --------------------- МИГРАЦИИ СХЕМЫ ---------------------
+
+# Нумерованные шаги миграций. Текущая версия схемы хранится в PRAGMA user_version,
+# каждый шаг — список SQL-команд (или функций conn -> None), выполняемых в одной транзакции.
+MIGRATIONS = [
+    # 1: индексы под горячие запросы routes.py.
+    # Ведущий столбец каждого составного индекса — внешний ключ, поэтому
+    # ON DELETE SET NULL тоже находит строки по индексу, а не сканом таблицы.
+    (1, [
+        # календарь техники: machine_id=? AND date BETWEEN ? AND ?
+        "CREATE INDEX IF NOT EXISTS idx_records_machine_date ON records(machine_id, date)",
+        # фильтры админки по водителю/контрагенту/статусу с сортировкой по дате
+        "CREATE INDEX IF NOT EXISTS idx_records_driver_date ON records(driver_id, date)",
+        "CREATE INDEX IF NOT EXISTS idx_records_counterparty_date ON records(counterparty_id, date)",
+        "CREATE INDEX IF NOT EXISTS idx_records_status_date ON records(status, date)",
+        # диапазон дат, сортировка date_asc/date_desc (rowid добавляется к ключу сам)
+        "CREATE INDEX IF NOT EXISTS idx_records_date ON records(date)",
+        # сортировка hours_asc/hours_desc
+        "CREATE INDEX IF NOT EXISTS idx_records_hours_date ON records(hours, date)",
+    ]),
+]
+
+def migrate(conn):
+    """
+    Применяет к базе все миграции с номером больше PRAGMA user_version.
+    Возвращает итоговую версию схемы.
+    """
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    for version, steps in MIGRATIONS:
+        if version <= current:
+            continue
+        conn.commit()
+        conn.execute("BEGIN")
+        try:
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        current = version
+    return current
+
+# Горячие запросы приложения, которые обязаны идти по индексу.
+# Параметры-заглушки нужны только для EXPLAIN QUERY PLAN.
+HOT_QUERIES = [
+    ("calendar: месяц техники",
+     "SELECT * FROM records r WHERE r.machine_id=? AND r.date BETWEEN ? AND ? ORDER BY r.date, r.id",
+     (1, '2024-01-01', '2024-01-31')),
+    ("calendar: месяц парка",
+     "SELECT * FROM records r WHERE r.date BETWEEN ? AND ? ORDER BY r.machine_id, r.date, r.id",
+     ('2024-01-01', '2024-01-31')),
+    ("records: диапазон дат",
+     "SELECT * FROM records r WHERE r.date>=? AND r.date<=? ORDER BY r.date DESC, r.id DESC",
+     ('2024-01-01', '2024-12-31')),
+    ("records: фильтр по технике",
+     "SELECT * FROM records r WHERE r.machine_id=? ORDER BY r.date DESC, r.id DESC",
+     (1,)),
+    ("records: фильтр по водителю",
+     "SELECT * FROM records r WHERE r.driver_id=? ORDER BY r.date DESC, r.id DESC",
+     (1,)),
+    ("records: фильтр по контрагенту",
+     "SELECT * FROM records r WHERE r.counterparty_id=? ORDER BY r.date DESC, r.id DESC",
+     (1,)),
+    ("records: фильтр по статусу",
+     "SELECT * FROM records r WHERE r.status=? ORDER BY r.date DESC, r.id DESC",
+     ('work',)),
+    ("records: сортировка по часам",
+     "SELECT * FROM records r ORDER BY r.hours DESC, r.date DESC LIMIT 10",
+     ()),
+    ("records: первая страница",
+     "SELECT * FROM records r ORDER BY r.date DESC, r.id DESC LIMIT 10",
+     ()),
+    ("cascade: удаление техники",
+     "UPDATE records SET machine_id=NULL WHERE machine_id=?", (1,)),
+    ("cascade: удаление водителя",
+     "UPDATE records SET driver_id=NULL WHERE driver_id=?", (1,)),
+    ("cascade: удаление контрагента",
+     "UPDATE records SET counterparty_id=NULL WHERE counterparty_id=?", (1,)),
+]
+
+def check_query_plans(conn, queries=None):
+    """
+    Прогоняет горячие запросы через EXPLAIN QUERY PLAN и возвращает
+    список (название, шаг плана) для тех, что сканируют records целиком.
+    Пустой список — все запросы идут по индексам.
+    """
+    problems = []
+    for name, sql, params in (queries or HOT_QUERIES):
+        for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params):
+            detail = row[3]
+            # "SCAN r" без "USING ... INDEX" — полный проход по таблице
+            if detail.startswith("SCAN") and "INDEX" not in detail:
+                problems.append((name, detail))
+    return problems
+
+# --------------------- СВОБОДНЫЕ ID ---------------------
+
+# Таблицы, в которых новые строки получают наименьший свободный id
+ID_TABLES = ("machines", "drivers", "counterparties", "records")
+
+# Наименьший свободный id: минимум из «дыр» (таблица free_ids, поддерживается
+# триггерами) и MAX(id)+1. Оба подзапроса — поиск по индексу, O(log n).
+# MAX(id)+1 не опускается ниже id_floors.max_id (migration 8): id строк,
+# перенесённых в архив, заняты, хотя в таблице их уже нет.
+NEXT_FREE_ID_SQL = """(SELECT MIN(v) FROM (
+    SELECT MIN(id) AS v FROM free_ids WHERE tbl='{table}'
+    UNION ALL
+    SELECT MAX(IFNULL(MAX(id), 0), IFNULL((SELECT max_id FROM id_floors WHERE tbl='{table}'), 0)) + 1
+      FROM {table}
+))"""
+
+def _free_ids_migration(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS free_ids (
+            tbl TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            PRIMARY KEY (tbl, id)
+        ) WITHOUT ROWID
+    ''')
+    for t in ID_TABLES:
+        # удалённый id становится свободным, занятый — перестаёт им быть
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{t}_free_id_ad AFTER DELETE ON {t}
+            BEGIN
+                INSERT OR IGNORE INTO free_ids (tbl, id) VALUES ('{t}', OLD.id);
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{t}_free_id_ai AFTER INSERT ON {t}
+            BEGIN
+                DELETE FROM free_ids WHERE tbl='{t}' AND id=NEW.id;
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{t}_free_id_au AFTER UPDATE OF id ON {t}
+            WHEN OLD.id <> NEW.id
+            BEGIN
+                INSERT OR IGNORE INTO free_ids (tbl, id) VALUES ('{t}', OLD.id);
+                DELETE FROM free_ids WHERE tbl='{t}' AND id=NEW.id;
+            END
+        ''')
+        # Однократно заполняем «дыры», накопившиеся до миграции
+        conn.execute(f'''
+            WITH RECURSIVE seq(i) AS (
+                SELECT 1 WHERE EXISTS (SELECT 1 FROM {t})
+                UNION ALL
+                SELECT i + 1 FROM seq WHERE i < (SELECT IFNULL(MAX(id), 0) FROM {t})
+            )
+            INSERT OR IGNORE INTO free_ids (tbl, id)
+            SELECT '{t}', i FROM seq WHERE NOT EXISTS (SELECT 1 FROM {t} WHERE id=seq.i)
+        ''')
+
+MIGRATIONS.append((2, [_free_ids_migration]))
 
 def get_next_free_id(conn, table_name: str) -> int:
     """
     Определяет следующее свободное числовое поле id для таблицы (id начинаются с 1).
     """
-    rows = conn.execute(f"SELECT id FROM {table_name} ORDER BY id").fetchall()
-    used = {r[0] for r in rows}
-    candidate = 1
-    while candidate in used:
-        candidate += 1
-    return candidate
+    if table_name not in ID_TABLES:
+        raise ValueError(f"Неизвестная таблица: {table_name}")
+    return conn.execute("SELECT " + NEXT_FREE_ID_SQL.format(table=table_name)).fetchone()[0]
+
+def insert_with_free_id(conn, table_name: str, columns, values) -> int:
+    """
+    Вставляет строку с наименьшим свободным id одним INSERT-ом:
+    выбор id и вставка выполняются атомарно под блокировкой записи,
+    поэтому два воркера не получат одинаковый id. Коммит — за вызывающим.
+    Возвращает id новой строки.
+    """
+    if table_name not in ID_TABLES:
+        raise ValueError(f"Неизвестная таблица: {table_name}")
+    cols = ", ".join(columns)
+    marks = ", ".join("?" for _ in columns)
+    cur = conn.execute(
+        f"INSERT INTO {table_name} (id, {cols}) "
+        f"VALUES ({NEXT_FREE_ID_SQL.format(table=table_name)}, {marks})",
+        tuple(values))
+    return cur.lastrowid
+
+# --------------------- ВЕРСИИ ДАННЫХ ---------------------
+
+# Счётчики изменений таблиц. Триггеры увеличивают version при каждой записи,
+# поэтому любой воркер одним запросом узнаёт, изменились ли данные.
+VERSIONED_TABLES = ("machines", "drivers", "counterparties", "records")
+
+def _data_versions_migration(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0,
+            updated_at INTEGER
+        )
+    ''')
+    for t in VERSIONED_TABLES:
+        conn.execute("INSERT OR IGNORE INTO data_versions (name, version, updated_at) "
+                     "VALUES (?, 0, CAST(strftime('%s','now') AS INTEGER))", (t,))
+        for event, suffix in (("INSERT", "ai"), ("UPDATE", "au"), ("DELETE", "ad")):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{t}_version_{suffix} AFTER {event} ON {t}
+                BEGIN
+                    UPDATE data_versions
+                       SET version = version + 1,
+                           updated_at = CAST(strftime('%s','now') AS INTEGER)
+                     WHERE name='{t}';
+                END
+            ''')
+
+MIGRATIONS.append((3, [_data_versions_migration]))
+
+def get_data_versions(conn, names=VERSIONED_TABLES):
+    """
+    Возвращает {имя таблицы: версия} для указанных таблиц одним запросом.
+    """
+    marks = ",".join("?" for _ in names)
+    rows = conn.execute(f"SELECT name, version FROM data_versions WHERE name IN ({marks})",
+                        tuple(names)).fetchall()
+    versions = dict.fromkeys(names, 0)
+    versions.update(rows)
+    return versions
+
+def data_version_stamp(conn, names=VERSIONED_TABLES) -> str:
+    """
+    Строковый штамп версий данных, например "records:12,machines:3".
+    """
+    versions = get_data_versions(conn, names)
+    return ",".join(f"{n}:{versions[n]}" for n in names)
+
+# --------------------- ПОЛНОТЕКСТОВЫЙ ПОИСК ---------------------
+
+def _records_fts_migration(conn):
+    # external content: текст хранится только в records, индекс — в records_fts
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS records_fts USING fts5(
+            comment,
+            content='records',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_records_fts_ai AFTER INSERT ON records
+        BEGIN
+            INSERT INTO records_fts (rowid, comment) VALUES (NEW.id, NEW.comment);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_records_fts_ad AFTER DELETE ON records
+        BEGIN
+            INSERT INTO records_fts (records_fts, rowid, comment) VALUES ('delete', OLD.id, OLD.comment);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_records_fts_au AFTER UPDATE OF id, comment ON records
+        BEGIN
+            INSERT INTO records_fts (records_fts, rowid, comment) VALUES ('delete', OLD.id, OLD.comment);
+            INSERT INTO records_fts (rowid, comment) VALUES (NEW.id, NEW.comment);
+        END
+    ''')
+    conn.execute("INSERT INTO records_fts (records_fts) VALUES ('rebuild')")
+
+MIGRATIONS.append((4, [_records_fts_migration]))
+
+HOT_QUERIES.append(
+    ("records: поиск по комментарию",
+     "SELECT * FROM records r WHERE r.id IN (SELECT rowid FROM records_fts WHERE records_fts MATCH ?)",
+     ('"насос"*',)))
+
+# --------------------- АГРЕГАТЫ ЗАГРУЗКИ ---------------------
+
+# Часы и число записей по (вид сущности, id, день, статус) и по месяцам.
+# usage_daily поддерживают триггеры на records, usage_monthly — триггеры на usage_daily;
+# days в usage_monthly — число дней месяца, в которые у сущности был этот статус.
+USAGE_KINDS = (
+    ("machine", "machine_id"),
+    ("driver", "driver_id"),
+    ("counterparty", "counterparty_id"),
+)
+
+def _usage_add_sql(kind, column, ref):
+    return f'''
+        INSERT INTO usage_daily (kind, entity_id, day, status, hours, records)
+        SELECT '{kind}', {ref}.{column}, {ref}.date, {ref}.status, IFNULL({ref}.hours, 0), 1
+         WHERE {ref}.{column} IS NOT NULL
+        ON CONFLICT (kind, entity_id, day, status)
+        DO UPDATE SET hours = hours + excluded.hours, records = records + 1;
+    '''
+
+def _usage_sub_sql(kind, column, ref):
+    key = (f"kind='{kind}' AND entity_id={ref}.{column} "
+           f"AND day={ref}.date AND status={ref}.status")
+    return f'''
+        UPDATE usage_daily SET hours = hours - IFNULL({ref}.hours, 0), records = records - 1
+         WHERE {key};
+        DELETE FROM usage_daily WHERE {key} AND records <= 0;
+    '''
+
+def _usage_migration(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS usage_daily (
+            kind TEXT NOT NULL,
+            entity_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            status TEXT NOT NULL,
+            hours INTEGER NOT NULL DEFAULT 0,
+            records INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (kind, entity_id, day, status)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS usage_monthly (
+            kind TEXT NOT NULL,
+            entity_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            status TEXT NOT NULL,
+            hours INTEGER NOT NULL DEFAULT 0,
+            records INTEGER NOT NULL DEFAULT 0,
+            days INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (kind, entity_id, month, status)
+        ) WITHOUT ROWID
+    ''')
+    # отчёт по всему парку за период: kind=? AND month BETWEEN ? AND ?
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_usage_daily_kind_day ON usage_daily(kind, day)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_usage_monthly_kind_month ON usage_monthly(kind, month)")
+
+    # usage_daily -> usage_monthly
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_usage_daily_ai AFTER INSERT ON usage_daily
+        BEGIN
+            INSERT INTO usage_monthly (kind, entity_id, month, status, hours, records, days)
+            VALUES (NEW.kind, NEW.entity_id, substr(NEW.day, 1, 7), NEW.status, NEW.hours, NEW.records, 1)
+            ON CONFLICT (kind, entity_id, month, status)
+            DO UPDATE SET hours = hours + excluded.hours,
+                          records = records + excluded.records,
+                          days = days + 1;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_usage_daily_au AFTER UPDATE ON usage_daily
+        BEGIN
+            UPDATE usage_monthly
+               SET hours = hours + NEW.hours - OLD.hours,
+                   records = records + NEW.records - OLD.records
+             WHERE kind=NEW.kind AND entity_id=NEW.entity_id
+               AND month=substr(NEW.day, 1, 7) AND status=NEW.status;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_usage_daily_ad AFTER DELETE ON usage_daily
+        BEGIN
+            UPDATE usage_monthly
+               SET hours = hours - OLD.hours,
+                   records = records - OLD.records,
+                   days = days - 1
+             WHERE kind=OLD.kind AND entity_id=OLD.entity_id
+               AND month=substr(OLD.day, 1, 7) AND status=OLD.status;
+            DELETE FROM usage_monthly
+             WHERE kind=OLD.kind AND entity_id=OLD.entity_id
+               AND month=substr(OLD.day, 1, 7) AND status=OLD.status AND days <= 0;
+        END
+    ''')
+
+    # Заполняем агрегаты по уже существующим записям (месяцы считает триггер выше)
+    for kind, column in USAGE_KINDS:
+        conn.execute(f'''
+            INSERT INTO usage_daily (kind, entity_id, day, status, hours, records)
+            SELECT '{kind}', {column}, date, status, SUM(IFNULL(hours, 0)), COUNT(*)
+              FROM records
+             WHERE {column} IS NOT NULL
+             GROUP BY {column}, date, status
+        ''')
+
+    # records -> usage_daily
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_records_usage_ai AFTER INSERT ON records
+        BEGIN
+            {"".join(_usage_add_sql(k, c, "NEW") for k, c in USAGE_KINDS)}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_records_usage_ad AFTER DELETE ON records
+        BEGIN
+            {"".join(_usage_sub_sql(k, c, "OLD") for k, c in USAGE_KINDS)}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_records_usage_au
+        AFTER UPDATE OF date, machine_id, driver_id, counterparty_id, status, hours ON records
+        BEGIN
+            {"".join(_usage_sub_sql(k, c, "OLD") for k, c in USAGE_KINDS)}
+            {"".join(_usage_add_sql(k, c, "NEW") for k, c in USAGE_KINDS)}
+        END
+    ''')
+
+MIGRATIONS.append((5, [_usage_migration]))
+
+# --------------------- ЖУРНАЛ ИЗМЕНЕНИЙ ---------------------
+
+# Монотонный журнал изменений записей и справочников: по нему клиенты API
+# забирают только то, что изменилось после последнего увиденного seq.
+# AUTOINCREMENT гарантирует, что seq никогда не повторяется.
+def _change_log_migration(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tbl TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            op TEXT NOT NULL CHECK(op IN ('insert', 'update', 'delete')),
+            changed_at INTEGER NOT NULL
+        )
+    ''')
+    for t in VERSIONED_TABLES:
+        for event, op, ref in (("INSERT", "insert", "NEW"), ("UPDATE", "update", "NEW"), ("DELETE", "delete", "OLD")):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{t}_change_log_{op} AFTER {event} ON {t}
+                BEGIN
+                    INSERT INTO change_log (tbl, row_id, op, changed_at)
+                    VALUES ('{t}', {ref}.id, '{op}', CAST(strftime('%s','now') AS INTEGER));
+                END
+            ''')
+
+MIGRATIONS.append((6, [_change_log_migration]))
+
+# --------------------- ВЕРСИИ МЕСЯЦЕВ КАЛЕНДАРЯ ---------------------
+
+# Счётчик изменений записей по (техника, месяц): календарь одной машины
+# устаревает только при правке её записей за этот месяц, а не любой записи.
+# Строки не удаляются, поэтому сумма версий за месяц тоже только растёт.
+def _month_versions_migration(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS month_versions (
+            machine_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0,
+            updated_at INTEGER,
+            PRIMARY KEY (machine_id, month)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_month_versions_month ON month_versions(month)")
+
+    def bump(ref):
+        # WHERE обязателен: без него SQLite не разберёт INSERT ... SELECT ... ON CONFLICT
+        return f'''
+                    INSERT INTO month_versions (machine_id, month, version, updated_at)
+                    SELECT {ref}.machine_id, substr({ref}.date, 1, 7), 1,
+                           CAST(strftime('%s','now') AS INTEGER)
+                     WHERE {ref}.machine_id IS NOT NULL
+                    ON CONFLICT (machine_id, month) DO UPDATE
+                       SET version = version + 1, updated_at = excluded.updated_at;'''
+
+    for event, suffix, refs in (("INSERT", "ai", ("NEW",)),
+                                ("UPDATE", "au", ("NEW", "OLD")),
+                                ("DELETE", "ad", ("OLD",))):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_records_month_version_{suffix} AFTER {event} ON records
+            BEGIN{"".join(bump(ref) for ref in refs)}
+            END
+        ''')
+
+    conn.execute('''
+        INSERT OR IGNORE INTO month_versions (machine_id, month, version, updated_at)
+        SELECT DISTINCT machine_id, substr(date, 1, 7), 0, CAST(strftime('%s','now') AS INTEGER)
+          FROM records
+         WHERE machine_id IS NOT NULL
+    ''')
+
+MIGRATIONS.append((7, [_month_versions_migration]))
+
+def get_version_stamps(conn, names=VERSIONED_TABLES):
+    """
+    {имя таблицы: (версия, updated_at)} для указанных таблиц одним запросом.
+    """
+    marks = ",".join("?" for _ in names)
+    rows = conn.execute(f"SELECT name, version, updated_at FROM data_versions WHERE name IN ({marks})",
+                        tuple(names)).fetchall()
+    stamps = dict.fromkeys(names, (0, None))
+    stamps.update((name, (version, updated_at)) for name, version, updated_at in rows)
+    return stamps
+
+def get_month_version(conn, year: int, month: int, machine_id=None):
+    """
+    (версия, updated_at) записей за месяц: одной техники или, если machine_id
+    не указан, всего парка (сумма версий по машинам).
+    """
+    key = f"{year:04d}-{month:02d}"
+    if machine_id is None:
+        row = conn.execute("SELECT TOTAL(version), MAX(updated_at) FROM month_versions WHERE month=?",
+                           (key,)).fetchone()
+    else:
+        row = conn.execute("SELECT version, updated_at FROM month_versions WHERE machine_id=? AND month=?",
+                           (machine_id, key)).fetchone()
+    if not row:
+        return 0, None
+    return int(row[0] or 0), row[1]
+
+# --------------------- АРХИВ ---------------------
+
+# Закрытые периоды records переносятся в отдельный файл (см. archive.py).
+# archive_state — граница: все записи с датой < cutoff лежат в архиве.
+# archive_guard непуст только внутри транзакции переноса: удаление строк
+# при переносе не должно освобождать их id, вычитаться из агрегатов
+# загрузки и попадать в change_log как удаление.
+ARCHIVE_GUARD_SQL = "NOT EXISTS (SELECT 1 FROM archive_guard)"
+
+def _archive_migration(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS archive_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            cutoff TEXT,
+            archived_at INTEGER
+        )
+    ''')
+    conn.execute("CREATE TABLE IF NOT EXISTS archive_guard (active INTEGER NOT NULL)")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS id_floors (
+            tbl TEXT PRIMARY KEY,
+            max_id INTEGER NOT NULL
+        )
+    ''')
+
+    conn.execute("DROP TRIGGER IF EXISTS trg_records_free_id_ad")
+    conn.execute(f'''
+        CREATE TRIGGER trg_records_free_id_ad AFTER DELETE ON records
+        WHEN {ARCHIVE_GUARD_SQL}
+        BEGIN
+            INSERT OR IGNORE INTO free_ids (tbl, id) VALUES ('records', OLD.id);
+        END
+    ''')
+    conn.execute("DROP TRIGGER IF EXISTS trg_records_usage_ad")
+    conn.execute(f'''
+        CREATE TRIGGER trg_records_usage_ad AFTER DELETE ON records
+        WHEN {ARCHIVE_GUARD_SQL}
+        BEGIN
+            {"".join(_usage_sub_sql(k, c, "OLD") for k, c in USAGE_KINDS)}
+        END
+    ''')
+    conn.execute("DROP TRIGGER IF EXISTS trg_records_change_log_delete")
+    conn.execute(f'''
+        CREATE TRIGGER trg_records_change_log_delete AFTER DELETE ON records
+        WHEN {ARCHIVE_GUARD_SQL}
+        BEGIN
+            INSERT INTO change_log (tbl, row_id, op, changed_at)
+            VALUES ('records', OLD.id, 'delete', CAST(strftime('%s','now') AS INTEGER));
+        END
+    ''')
+
+MIGRATIONS.append((8, [_archive_migration]))
+
+# --------------------- МЯГКОЕ УДАЛЕНИЕ СПРАВОЧНИКОВ ---------------------
+
+# Техника, водители и контрагенты не удаляются, а помечаются active=0:
+# удаление — смена одного флага вместо ON DELETE SET NULL по всем записям,
+# и в старых записях и отчётах остаются имена. Частичные индексы покрывают
+# только действующие строки — выпадающие списки читают их в порядке имени.
+SOFT_DELETE_TABLES = ("machines", "drivers", "counterparties")
+
+def _soft_delete_migration(conn):
+    for t in SOFT_DELETE_TABLES:
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({t})")}
+        if "active" not in columns:
+            conn.execute(f"ALTER TABLE {t} ADD COLUMN active INTEGER NOT NULL DEFAULT 1")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{t}_active_name ON {t}(name) WHERE active=1")
+
+MIGRATIONS.append((9, [_soft_delete_migration]))
+
+# Список действующих в порядке имени — по частичному индексу, без сортировки
+ACTIVE_REFERENCE_SQL = "SELECT * FROM {table} WHERE active=1 ORDER BY name"
+
+for _t in SOFT_DELETE_TABLES:
+    HOT_QUERIES.append((f"{_t}: действующие по имени", ACTIVE_REFERENCE_SQL.format(table=_t), ()))
+
+# --------------------- ЖУРНАЛ ИЗМЕНЕНИЙ: ТЕХНИКА И ДЕНЬ ---------------------
+
+# Для живых страниц (changefeed.py) запись журнала по records несёт технику
+# и дату: календарь перерисовывает только затронутый день. Если правка
+# перенесла запись на другую технику или дату, пишутся две строки — для
+# прежнего и нового места, обе со ссылкой на ту же запись.
+def _change_log_place_migration(conn):
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(change_log)")}
+    if "machine_id" not in columns:
+        conn.execute("ALTER TABLE change_log ADD COLUMN machine_id INTEGER")
+    if "day" not in columns:
+        conn.execute("ALTER TABLE change_log ADD COLUMN day TEXT")
+
+    def log(op, ref, where=""):
+        return f'''
+            INSERT INTO change_log (tbl, row_id, op, changed_at, machine_id, day)
+            SELECT 'records', {ref}.id, '{op}', CAST(strftime('%s','now') AS INTEGER),
+                   {ref}.machine_id, {ref}.date{where};'''
+
+    moved = " WHERE OLD.machine_id IS NOT NEW.machine_id OR OLD.date IS NOT NEW.date"
+    for event, op, body, when in (("INSERT", "insert", log("insert", "NEW"), ""),
+                                  ("UPDATE", "update", log("update", "NEW") + log("update", "OLD", moved), ""),
+                                  ("DELETE", "delete", log("delete", "OLD"), f"WHEN {ARCHIVE_GUARD_SQL}")):
+        conn.execute(f"DROP TRIGGER IF EXISTS trg_records_change_log_{op}")
+        conn.execute(f'''
+            CREATE TRIGGER trg_records_change_log_{op} AFTER {event} ON records
+            {when}
+            BEGIN{body}
+            END
+        ''')
+
+MIGRATIONS.append((10, [_change_log_place_migration]))
@@ -0,0 +1,225 @@
+# app/export.py
+
+import csv
+import io
+import json
+import tempfile
+from datetime import datetime
+from functools import lru_cache
+from types import SimpleNamespace
+
+from .archive import archive_cutoff_for, cutoff_for_filters, records_source
+from .queries import parse_record_filters, build_where, order_sql, fts_join_sql
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+CSV_MIMETYPE = 'text/csv; charset=utf-8'
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+# Ключи NDJSON — те же имена, что в JSON API
+NDJSON_KEYS = ("date", "machine", "driver", "status", "start_time", "end_time", "hours", "counterparty", "comment")
+
+HEADERS = ["Дата", "Техника", "Водитель", "Статус", "Начало", "Конец", "Часы", "Контрагент", "Комментарий"]
+
+# Цвета статусов — те же, что COLORS['status'] в routes.py
+STATUS_COLORS = {
+    'work':    "C8E6C9",
+    'stop':    "FFCDD2",
+    'repair':  "FFF9C4",
+    'holiday': "E1BEE7",
+}
+
+
+# openpyxl импортируется при первой выгрузке xlsx, а не при старте воркера:
+# это самый тяжёлый импорт приложения, а нужен он только /export и импорту.
+
+@lru_cache(maxsize=None)
+def xlsx_styles():
+    """
+    Стили ячеек xlsx: создаются один раз и переиспользуются всеми ячейками.
+    """
+    from openpyxl.styles import PatternFill, Font
+    return SimpleNamespace(
+        header_fill=PatternFill(start_color="444444", fill_type="solid"),
+        header_font=Font(color="FFFFFF", bold=True),
+        status_fills={st: PatternFill(start_color=color, fill_type="solid")
+                      for st, color in STATUS_COLORS.items()},
+        default_status_fill=PatternFill(start_color="FFFFFF", fill_type="solid"),
+    )
+
+EXPORT_SELECT = '''
+    SELECT
+      r.date,
+      CASE
+        WHEN r.machine_id IS NULL THEN '—'
+        WHEN m.id IS NULL THEN 'Техника удалёна'
+        ELSE m.name
+      END AS machine_name,
+      CASE
+        WHEN r.driver_id IS NULL THEN '—'
+        WHEN d.id IS NULL THEN 'Водитель удалён'
+        ELSE d.name
+      END AS driver_name,
+      r.status,
+      IFNULL(r.start_time,""),
+      IFNULL(r.end_time,""),
+      r.hours,
+      CASE
+        WHEN r.counterparty_id IS NULL THEN '—'
+        WHEN c.id IS NULL THEN 'Контрагент удалён'
+        ELSE c.name
+      END AS cparty_name,
+      IFNULL(r.comment,"-")
+    FROM {source} r
+    LEFT JOIN machines m ON r.machine_id=m.id
+    LEFT JOIN drivers d ON r.driver_id=d.id
+    LEFT JOIN counterparties c ON r.counterparty_id=c.id
+    {fts_join}
+    {where_sql}
+    {order_sql}
+'''
+
+
+def export_query(conn, args):
+    """
+    SQL и параметры выгрузки: export=filtered — с фильтрами списка записей,
+    иначе — все записи по возрастанию даты (вместе с архивом).
+    Если выгрузка заходит в архивный период, архив подключается к conn.
+    """
+    if args.get('export', '') == 'filtered':
+        f = parse_record_filters(args)
+        cutoff = cutoff_for_filters(conn, f)
+        source, source_pr = records_source(cutoff)
+        where_sql, pr = build_where(f, cutoff)
+        fts_join, join_pr = "", []
+        if f['sort'] == 'relevance':
+            fts_join, join_pr = fts_join_sql(f, cutoff)
+        return (EXPORT_SELECT.format(source=source, fts_join=fts_join, where_sql=where_sql,
+                                     order_sql=order_sql(f['sort'])),
+                source_pr + join_pr + pr)
+    source, source_pr = records_source(archive_cutoff_for(conn, include=True))
+    return (EXPORT_SELECT.format(source=source, fts_join="", where_sql="",
+                                 order_sql="ORDER BY r.date ASC, r.id ASC"),
+            source_pr)
+
+
+def iter_batches(cursor, batch_size):
+    """
+    Отдаёт строки курсора списками по batch_size, не загружая результат целиком.
+    """
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield rows
+
+
+def iter_rows(cursor, batch_size):
+    """
+    То же, что iter_batches(), но по одной строке.
+    """
+    for rows in iter_batches(cursor, batch_size):
+        yield from rows
+
+
+def format_date(date_db):
+    # Перевод даты в формат дд.мм.гггг
+    try:
+        return datetime.strptime(date_db, '%Y-%m-%d').strftime('%d.%m.%Y')
+    except (TypeError, ValueError):
+        return date_db
+
+
+def write_detail_sheet(wb, rows):
+    """
+    Добавляет в write-only книгу лист со строками выгрузки.
+    """
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.utils import get_column_letter
+
+    styles = xlsx_styles()
+    ws = wb.create_sheet("AN-30 Отчёт")
+    for col in range(1, len(HEADERS) + 1):
+        ws.column_dimensions[get_column_letter(col)].width = 20
+
+    header = []
+    for title in HEADERS:
+        cell = WriteOnlyCell(ws, value=title)
+        cell.fill = styles.header_fill
+        cell.font = styles.header_font
+        header.append(cell)
+    ws.append(header)
+
+    for row in rows:
+        status_ = row[3]
+        # Заливаем ячейку статуса
+        st_cell = WriteOnlyCell(ws, value=status_.capitalize())
+        st_cell.fill = styles.status_fills.get(status_, styles.default_status_fill)
+        ws.append([
+            format_date(row[0]), row[1], row[2],
+            st_cell, row[4], row[5], row[6] or 0, row[7], row[8]
+        ])
+
+
+def write_xlsx(rows, fileobj):
+    """
+    Пишет строки выгрузки в xlsx в режиме write-only: строки сразу
+    сбрасываются на диск, и память не растёт с числом строк.
+    """
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    write_detail_sheet(wb, rows)
+    wb.save(fileobj)
+
+
+def build_xlsx_spool(conn, sql, params, batch_size, spool_max_size):
+    """
+    Строит отчёт во временный spool-файл (в памяти до spool_max_size, дальше на диске)
+    и возвращает его, перемотанным на начало.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=spool_max_size)
+    try:
+        cursor = conn.execute(sql, params)
+        write_xlsx(iter_rows(cursor, batch_size), spool)
+    except Exception:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+# --------------------- ПОТОКОВЫЕ ФОРМАТЫ ---------------------
+# CSV и NDJSON не требуют openpyxl и отдаются по мере чтения курсора:
+# каждая пачка fetchmany превращается в один кусок ответа. Дата — ISO,
+# статус — код (work/stop/...), чтобы файлы было удобно грузить в другие системы.
+
+def iter_csv(cursor, batch_size):
+    """
+    Куски CSV (bytes, UTF-8 с BOM — для Excel): заголовок, затем по куску на пачку строк.
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator='\r\n')
+    writer.writerow(HEADERS)
+    yield ('\ufeff' + buf.getvalue()).encode('utf-8')
+    for rows in iter_batches(cursor, batch_size):
+        buf.seek(0)
+        buf.truncate()
+        writer.writerows(row[:6] + (row[6] or 0,) + row[7:] for row in rows)
+        yield buf.getvalue().encode('utf-8')
+
+
+def iter_ndjson(cursor, batch_size):
+    """
+    Куски NDJSON (bytes): по объекту на строку, кусок на пачку строк.
+    """
+    for rows in iter_batches(cursor, batch_size):
+        yield "".join(
+            json.dumps(dict(zip(NDJSON_KEYS, row[:6] + (row[6] or 0,) + row[7:])), ensure_ascii=False) + "\n"
+            for row in rows
+        ).encode('utf-8')
+
+
+# формат -> (генератор кусков, mimetype, расширение файла)
+STREAM_FORMATS = {
+    'csv': (iter_csv, CSV_MIMETYPE, 'csv'),
+    'ndjson': (iter_ndjson, NDJSON_MIMETYPE, 'ndjson'),
+}
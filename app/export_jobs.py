@@ -0,0 +1,219 @@
+# app/export_jobs.py
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from werkzeug.datastructures import MultiDict
+
+from .analytics import write_analytics
+from .database import get_db, data_version_stamp
+from .export import XLSX_MIMETYPE, STREAM_FORMATS, export_query, iter_rows, write_xlsx
+from .queries import parse_record_filters
+
+# Фоновая сборка отчётов. Пул потоков живёт в каждом воркере, а состояние
+# задач и готовые файлы лежат в EXPORT_CACHE_DIR — поэтому статус задачи
+# можно опросить у любого воркера gunicorn, а не только у того, кто её принял.
+
+# формат выгрузки -> (mimetype, расширение файла) готового отчёта
+JOB_FORMATS = {'xlsx': (XLSX_MIMETYPE, 'xlsx'), 'analytics': (XLSX_MIMETYPE, 'xlsx')}
+JOB_FORMATS.update((fmt, (mimetype, ext)) for fmt, (_, mimetype, ext) in STREAM_FORMATS.items())
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+# Отчёты, которые уже собираются в этом процессе: ключ кэша -> id задачи
+_building = {}
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    with _executor_lock:
+        # пул создаётся лениво и заново после fork — см. app/writer.py
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=current_app.config['EXPORT_JOB_WORKERS'],
+                                           thread_name_prefix='export-job')
+            _executor_pid = os.getpid()
+            _building.clear()
+        return _executor
+
+
+def _cache_dir():
+    path = current_app.config['EXPORT_CACHE_DIR']
+    os.makedirs(os.path.join(path, 'jobs'), exist_ok=True)
+    return path
+
+
+def normalize_export_args(args):
+    """
+    Приводит параметры выгрузки к каноническому виду: одинаковые по смыслу
+    запросы (порядок параметров, пустые значения) дают одинаковый набор.
+    """
+    fmt = args.get('format') or 'xlsx'
+    if fmt == 'analytics':
+        # сводки зависят от периода, лист детализации — от фильтров (analytics.detail_query)
+        f = parse_record_filters(args)
+        norm = {k: v for k, v in f.items() if v not in (None, '')}
+        norm['detail'] = args.get('detail') == '1'
+    elif args.get('export', '') != 'filtered':
+        norm = {'export': 'all'}
+    else:
+        f = parse_record_filters(args)
+        norm = {k: v for k, v in f.items() if v not in (None, '')}
+        norm['export'] = 'filtered'
+    norm['format'] = fmt
+    return norm
+
+
+def cache_key(args, stamp):
+    """
+    Ключ кэша: хэш нормализованных фильтров плюс штамп версий данных.
+    После любого изменения данных ключ меняется, и старый файл больше не отдаётся.
+    """
+    payload = json.dumps([normalize_export_args(args), stamp], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+def artifact_path(key, fmt='xlsx'):
+    return os.path.join(_cache_dir(), f"{key}.{JOB_FORMATS[fmt][1]}")
+
+
+def _job_path(job_id):
+    return os.path.join(_cache_dir(), 'jobs', f"{job_id}.json")
+
+
+def _write_job(job_id, **state):
+    path = _job_path(job_id)
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as fh:
+        json.dump(dict(state, job_id=job_id, updated_at=time.time()), fh)
+    os.replace(tmp, path)
+
+
+def get_job(job_id):
+    """
+    Состояние задачи: dict со status = pending / done / error, или None.
+    """
+    # id задачи — hex uuid; всё остальное не может быть именем нашего файла
+    if not job_id.isalnum():
+        return None
+    try:
+        with open(_job_path(job_id), encoding='utf-8') as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def submit_export(args):
+    """
+    Ставит выгрузку в очередь и возвращает состояние новой задачи.
+    Если отчёт с теми же фильтрами и той же версией данных уже собран,
+    задача сразу получает статус done. ValueError — неизвестный формат.
+    """
+    args = MultiDict(args)
+    fmt = args.get('format') or 'xlsx'
+    if fmt not in JOB_FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+    key = cache_key(args, data_version_stamp(get_db()))
+    path = artifact_path(key, fmt)
+    job_id = uuid.uuid4().hex
+
+    if os.path.exists(path):
+        os.utime(path)  # отмечаем использование для вытеснения по давности
+        _write_job(job_id, status='done', key=key, format=fmt)
+        return get_job(job_id)
+
+    executor = _get_executor()
+    with _executor_lock:
+        running = _building.get(key)
+        if running:
+            return get_job(running)
+        _building[key] = job_id
+    _write_job(job_id, status='pending', key=key, format=fmt)
+    executor.submit(_run_job, current_app._get_current_object(), job_id, key, fmt, args)
+    return get_job(job_id)
+
+
+def _run_job(app, job_id, key, fmt, args):
+    with app.app_context():
+        path = artifact_path(key, fmt)
+        tmp = f"{path}.{job_id}.tmp"
+        batch_size = app.config['EXPORT_BATCH_SIZE']
+        try:
+            conn = get_db()
+            with open(tmp, 'wb') as fh:
+                if fmt == 'analytics':
+                    write_analytics(conn, args, batch_size, fh)
+                else:
+                    sql, pr = export_query(conn, args)
+                    cursor = conn.execute(sql, pr)
+                    if fmt in STREAM_FORMATS:
+                        for chunk in STREAM_FORMATS[fmt][0](cursor, batch_size):
+                            fh.write(chunk)
+                    else:
+                        write_xlsx(iter_rows(cursor, batch_size), fh)
+            os.replace(tmp, path)
+            _write_job(job_id, status='done', key=key, format=fmt)
+        except Exception as e:
+            app.logger.exception("Ошибка фоновой выгрузки %s", job_id)
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            _write_job(job_id, status='error', key=key, format=fmt, error=str(e))
+        finally:
+            with _executor_lock:
+                _building.pop(key, None)
+        evict_cache()
+
+
+def evict_cache():
+    """
+    Удаляет из кэша отчёты и задачи старше EXPORT_CACHE_MAX_AGE,
+    затем самые давние отчёты, пока общий размер больше EXPORT_CACHE_MAX_BYTES.
+    """
+    cfg = current_app.config
+    root = _cache_dir()
+    now = time.time()
+    max_age = cfg['EXPORT_CACHE_MAX_AGE']
+
+    for name in os.listdir(os.path.join(root, 'jobs')):
+        path = os.path.join(root, 'jobs', name)
+        try:
+            if now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+        except OSError:
+            pass
+
+    extensions = {f".{ext}" for _, ext in JOB_FORMATS.values()}
+    files = []
+    for name in os.listdir(root):
+        if os.path.splitext(name)[1] not in extensions:
+            continue
+        path = os.path.join(root, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if now - st.st_mtime > max_age:
+            _remove_quietly(path)
+        else:
+            files.append((st.st_mtime, st.st_size, path))
+
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= cfg['EXPORT_CACHE_MAX_BYTES']:
+            break
+        _remove_quietly(path)
+        total -= size
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,100 @@
+# app/heatmap.py
+
+from datetime import date
+
+from .database import HOT_QUERIES
+from .queries import STATUSES
+
+# Год техники одним взглядом: вместо двенадцати страниц календаря (запрос
+# на месяц) — один сгруппированный запрос к агрегату usage_daily (migration 5)
+# сразу по нескольким машинам. Ответ компактный: на машину два массива длиной
+# в число дней года — код статуса дня и часы, а не строка на запись.
+# Рисует тепловую карту браузер (templates/heatmap.html).
+
+# код статуса в массиве = индекс в STATUSES + 1, 0 — записей в этот день нет
+STATUS_CODES = {s: i + 1 for i, s in enumerate(STATUSES)}
+
+# Если в один день у техники несколько статусов, день окрашивается главным:
+# работа важнее ремонта, ремонт — простоя, простой — выходного
+STATUS_PRIORITY = ("work", "repair", "stop", "holiday")
+
+HEATMAP_MAX_MACHINES = 100
+
+# По первичному ключу usage_daily (kind, entity_id, day, status)
+YEAR_DAYS_SQL = '''
+    SELECT entity_id, day, GROUP_CONCAT(status), SUM(hours)
+      FROM usage_daily
+     WHERE kind='machine' AND entity_id IN ({marks}) AND day BETWEEN ? AND ?
+     GROUP BY entity_id, day
+'''
+
+HOT_QUERIES.append((
+    "heatmap: год техники",
+    YEAR_DAYS_SQL.format(marks="?,?"),
+    (1, 2, '2024-01-01', '2024-12-31'),
+))
+
+# Версия года — сумма версий месяцев (month_versions, migration 7)
+YEAR_VERSION_SQL = '''
+    SELECT TOTAL(version), MAX(updated_at)
+      FROM month_versions
+     WHERE machine_id IN ({marks}) AND month BETWEEN ? AND ?
+'''
+
+
+def _main_status(statuses):
+    present = set(statuses.split(","))
+    for status in STATUS_PRIORITY:
+        if status in present:
+            return STATUS_CODES[status]
+    return 0
+
+
+def parse_machine_ids(values):
+    """
+    id техники из ?machine=1&machine=2 или ?machine=1,2; None — некорректное значение.
+    """
+    ids = []
+    for value in values:
+        for part in value.split(","):
+            part = part.strip()
+            if not part:
+                continue
+            if not part.isdigit():
+                return None
+            if int(part) not in ids:
+                ids.append(int(part))
+    return ids
+
+
+def get_year_version(conn, year: int, machine_ids):
+    """
+    (версия, updated_at) записей указанной техники за год.
+    """
+    marks = ",".join("?" for _ in machine_ids)
+    row = conn.execute(YEAR_VERSION_SQL.format(marks=marks),
+                       list(machine_ids) + [f"{year:04d}-01", f"{year:04d}-12"]).fetchone()
+    return int(row[0] or 0), row[1]
+
+
+def load_year_heatmap(conn, year: int, machine_ids):
+    """
+    Статусы и часы по дням года для каждой техники из machine_ids.
+    Возвращает (first_day, days, {machine_id: (коды статусов, часы)}),
+    оба списка длиной days, индекс — номер дня от 1 января.
+    """
+    first = date(year, 1, 1)
+    days = (date(year + 1, 1, 1) - first).days
+    result = {m_id: ([0] * days, [0] * days) for m_id in machine_ids}
+    if not machine_ids:
+        return first, days, result
+
+    marks = ",".join("?" for _ in machine_ids)
+    rows = conn.execute(YEAR_DAYS_SQL.format(marks=marks),
+                        list(machine_ids) + [first.isoformat(), f"{year:04d}-12-31"])
+    for machine_id, day, statuses, hours in rows:
+        codes, hours_by_day = result[machine_id]
+        i = date.fromisoformat(day).toordinal() - first.toordinal()
+        codes[i] = _main_status(statuses)
+        hours_by_day[i] = hours or 0
+    return first, days, result
@@ -0,0 +1,218 @@
+# app/importer.py
+
+import csv
+import io
+
+from flask import current_app
+
+from . import calendar_cache
+from .archive import ensure_open_period
+from .database import NEXT_FREE_ID_SQL
+from .refcache import get_references
+from .writer import run_write, WriteTimeout
+from .validation import compute_hours, parse_date, parse_status, parse_time
+
+# Заголовки столбцов файла импорта -> поля записи.
+# Русские заголовки совпадают с выгрузкой /export, так что её можно загрузить обратно.
+COLUMN_ALIASES = {
+    'дата': 'date', 'date': 'date',
+    'техника': 'machine', 'machine': 'machine',
+    'водитель': 'driver', 'driver': 'driver',
+    'статус': 'status', 'status': 'status',
+    'начало': 'start_time', 'start_time': 'start_time',
+    'конец': 'end_time', 'end_time': 'end_time',
+    'контрагент': 'counterparty', 'counterparty': 'counterparty',
+    'комментарий': 'comment', 'comment': 'comment',
+}
+
+# Пустые значения в выгрузке ("—" для связей, "-" для комментария)
+EMPTY_MARKS = ('', '—', '-')
+
+# Вставка с наименьшим свободным id; повтор по (дата, техника, водитель, начало) пропускается
+INSERT_SQL = f'''
+    INSERT INTO records
+    (id, date, machine_id, driver_id, status, start_time, end_time, hours, comment, counterparty_id)
+    SELECT {NEXT_FREE_ID_SQL.format(table="records")}, ?, ?, ?, ?, ?, ?, ?, ?, ?
+     WHERE NOT EXISTS (
+        SELECT 1 FROM records
+         WHERE machine_id=? AND date=? AND driver_id IS ? AND start_time IS ?
+     )
+'''
+
+
+class ImportResult:
+    def __init__(self):
+        self.inserted = 0
+        self.duplicates = 0
+        self.errors = []  # (номер строки файла, сообщение)
+        self.touched = set()  # (machine_id, дата) загруженных строк — для сброса кэша календаря
+
+
+class ImportStopped(Exception):
+    """
+    Импорт остановлен: line_no — строка, с которой файл не загружен.
+    """
+    def __init__(self, line_no, message):
+        super().__init__(line_no, message)
+        self.line_no = line_no
+        self.message = message
+
+
+def _header_map(header):
+    return {i: COLUMN_ALIASES[str(h).strip().lower()]
+            for i, h in enumerate(header)
+            if h is not None and str(h).strip().lower() in COLUMN_ALIASES}
+
+
+def read_xlsx(fileobj):
+    """
+    Строки первого листа .xlsx как dict; файл читается потоково (read-only).
+    """
+    from openpyxl import load_workbook  # тяжёлый импорт — только при загрузке xlsx
+
+    wb = load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        columns = _header_map(next(rows, ()))
+        for row in rows:
+            yield {field: row[i] for i, field in columns.items() if i < len(row)}
+    finally:
+        wb.close()
+
+
+def read_csv(fileobj):
+    """
+    Строки CSV (UTF-8, разделитель ';' или ',') как dict; файл читается потоково.
+    """
+    text = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+    first = text.readline()
+    delimiter = ';' if first.count(';') > first.count(',') else ','
+    columns = _header_map(next(csv.reader([first], delimiter=delimiter), []))
+    for row in csv.reader(text, delimiter=delimiter):
+        yield {field: row[i] for i, field in columns.items() if i < len(row)}
+
+
+def read_rows(fileobj, filename):
+    if filename.lower().endswith('.xlsx'):
+        return read_xlsx(fileobj)
+    return read_csv(fileobj)
+
+
+def _name(value):
+    text = '' if value is None else str(value).strip()
+    return None if text in EMPTY_MARKS else text
+
+
+def _resolve(value, refs, what, required):
+    name = _name(value)
+    if name is None:
+        if required:
+            raise ValueError(f"Не указан(а) {what}")
+        return None
+    if name not in refs:
+        raise ValueError(f"{what.capitalize()} не найден(а) в справочнике: {name}")
+    ref_id, active = refs[name]
+    if not active:
+        raise ValueError(f"{what.capitalize()} удалён(а) из справочника: {name}")
+    return ref_id
+
+
+def _validate(conn, raw, lookup):
+    machines, drivers, cparties = lookup
+    date_str = parse_date(raw.get('date'))
+    ensure_open_period(conn, date_str)
+    machine_id = _resolve(raw.get('machine'), machines, 'техника', True)
+    driver_id = _resolve(raw.get('driver'), drivers, 'водитель', True)
+    cpar_id = _resolve(raw.get('counterparty'), cparties, 'контрагент', False)
+    status = parse_status(raw.get('status'))
+    st_t = parse_time(raw.get('start_time'))
+    end_t = parse_time(raw.get('end_time'))
+    comment = _name(raw.get('comment')) or ''
+    hours = compute_hours(st_t, end_t)
+    return (date_str, machine_id, driver_id, status, st_t, end_t, hours, comment, cpar_id,
+            machine_id, date_str, driver_id, st_t)
+
+
+def _write_batch(conn, batch):
+    """
+    Задание писателя: вставляет пачку строк (номер строки, параметры).
+    Граница архива перепроверяется здесь — она могла сдвинуться после
+    проверки строки. Возвращает (строк к вставке, вставлено, ошибки).
+    """
+    params, errors = [], []
+    for line_no, row in batch:
+        try:
+            ensure_open_period(conn, row[0])
+        except ValueError as e:
+            errors.append((line_no, str(e)))
+        else:
+            params.append(row)
+    inserted = conn.executemany(INSERT_SQL, params).rowcount if params else 0
+    return len(params), inserted, errors
+
+
+def _flush(batch, result):
+    if batch:
+        try:
+            total, inserted, errors = run_write(_write_batch, list(batch))
+        except WriteTimeout:
+            raise ImportStopped(batch[0][0], "Запись не подтверждена вовремя, загрузка остановлена "
+                                             "на этой строке — повторите импорт позже, "
+                                             "уже загруженные строки не задвоятся")
+        except Exception as e:
+            current_app.logger.exception("Импорт: ошибка записи пачки со строки %s", batch[0][0])
+            raise ImportStopped(batch[0][0], f"Ошибка записи, загрузка остановлена на этой строке: {e}")
+        finally:
+            # даже без подтверждения пачка могла записаться — календарь сбрасываем
+            result.touched.update((row[1], row[0]) for _, row in batch)
+        result.inserted += inserted
+        result.duplicates += total - inserted
+        result.errors.extend(errors)
+        batch.clear()
+
+
+def import_records(conn, rows, batch_size=500):
+    """
+    Импортирует строки (dict от read_rows) в records: строки проверяются,
+    названия сопоставляются с id действующих строк справочников, вставка идёт
+    пачками executemany — каждая пачка отдельным заданием писателя (run_write),
+    так что правки из других запросов не ждут конца всего файла. Уже
+    существующие записи (та же дата, техника, водитель и время начала) не
+    дублируются, поэтому прерванный импорт можно просто повторить. Строки
+    с ошибками пропускаются и перечисляются в результате; если файл дальше
+    не читается или пачка не записалась, импорт останавливается, и строка
+    остановки тоже попадает в ошибки. Кэш календаря за загруженные дни
+    сбрасывается в любом случае.
+    """
+    # удалённые строки справочников тоже в словаре — чтобы сказать, что имя удалено
+    lookup = tuple({row[1]: (row[0], row[2]) for row in ref} for ref in get_references(conn))
+
+    result = ImportResult()
+    batch = []
+    line_no = 1  # строка 1 — заголовки
+    try:
+        try:
+            for line_no, raw in enumerate(rows, start=2):
+                if not any(v not in (None, '') for v in raw.values()):
+                    continue
+                try:
+                    batch.append((line_no, _validate(conn, raw, lookup)))
+                except ValueError as e:
+                    result.errors.append((line_no, str(e)))
+                    continue
+                if len(batch) >= batch_size:
+                    _flush(batch, result)
+        except ImportStopped:
+            raise
+        except Exception as e:
+            # файл оборвался или битый: уже проверенные строки всё равно загружаем
+            current_app.logger.exception("Импорт: файл не читается после строки %s", line_no)
+            _flush(batch, result)
+            raise ImportStopped(line_no + 1, f"Файл не читается дальше, загрузка остановлена: {e}")
+        _flush(batch, result)
+    except ImportStopped as e:
+        # дальше не читаем: при таймауте каждая следующая пачка тоже ждала бы его
+        result.errors.append((e.line_no, e.message))
+    finally:
+        calendar_cache.evict_records(result.touched)
+    return result
@@ -0,0 +1,172 @@
+# app/metrics.py
+
+import threading
+from collections import deque
+from time import perf_counter
+
+from flask import g, request
+from jinja2 import Template
+
+from .sqltrace import InstrumentedConnection
+
+# Метрики запросов по эндпоинтам: время ответа, время БД и число SQL-команд.
+# Каждый ответ получает заголовок Server-Timing (db, render, total) — его
+# видно во вкладке Network браузера. Счётчики живут в памяти воркера.
+#
+# Гистограммы кумулятивные (как в Prometheus) плюс скользящее окно последних
+# WINDOW_SIZE запросов для перцентилей на странице /admin/metrics.
+
+# Границы корзин гистограммы, секунды
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+WINDOW_SIZE = 500
+
+
+class EndpointMetrics:
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.statements = 0
+        self.slow_queries = 0
+        self.buckets = [0] * len(BUCKETS)  # запросы с временем <= BUCKETS[i]
+        self.window = deque(maxlen=WINDOW_SIZE)  # (total, db, statements)
+
+    def observe(self, total, db, render, statements, slow):
+        self.count += 1
+        self.total_time += total
+        self.db_time += db
+        self.render_time += render
+        self.statements += statements
+        self.slow_queries += slow
+        for i, bound in enumerate(BUCKETS):
+            if total <= bound:
+                self.buckets[i] += 1
+        self.window.append((total, db, statements))
+
+    def summary(self):
+        window = sorted(w[0] for w in self.window)
+        n = len(window)
+
+        def pct(q):
+            return window[min(int(q * n), n - 1)] * 1000 if n else None
+
+        return {
+            'count': self.count,
+            'mean_ms': self.total_time / self.count * 1000 if self.count else None,
+            'p50_ms': pct(0.5),
+            'p90_ms': pct(0.9),
+            'p99_ms': pct(0.99),
+            'db_mean_ms': self.db_time / self.count * 1000 if self.count else None,
+            'render_mean_ms': self.render_time / self.count * 1000 if self.count else None,
+            'statements_mean': self.statements / self.count if self.count else None,
+            'slow_queries': self.slow_queries,
+            # распределение по корзинам в окне (не кумулятивное)
+            'window_buckets': [sum(1 for t in window if lo < t <= hi)
+                               for lo, hi in zip((0,) + BUCKETS, BUCKETS)],
+        }
+
+
+_endpoints = {}  # имя эндпоинта -> EndpointMetrics
+_lock = threading.Lock()
+
+
+def snapshot():
+    """
+    {эндпоинт: summary()} для страницы метрик.
+    """
+    with _lock:
+        return {name: m.summary() for name, m in sorted(_endpoints.items())}
+
+
+def request_stats():
+    """
+    Счётчики SQL текущего запроса (dict) или None, если БД не использовалась.
+    """
+    conn = g.get('db')
+    if isinstance(conn, InstrumentedConnection):
+        return conn.stats.as_dict()
+    return None
+
+
+class TimedTemplate(Template):
+    """
+    Шаблон, который прибавляет время рендеринга к g._render_time.
+    """
+    def render(self, *args, **kwargs):
+        t0 = perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            if g:
+                g._render_time = g.get('_render_time', 0.0) + perf_counter() - t0
+
+
+def _start_timer():
+    g._t0 = perf_counter()
+    g._render_time = 0.0
+
+
+def _record(response):
+    t0 = g.get('_t0')
+    if t0 is None:
+        return response
+    total = perf_counter() - t0
+    render = g.get('_render_time', 0.0)
+    stats = request_stats() or {'db_time': 0.0, 'statements': 0, 'queries': 0, 'slow': 0}
+
+    response.headers['Server-Timing'] = ", ".join([
+        f'db;dur={stats["db_time"] * 1000:.1f};desc="{stats["queries"]} SQL"',
+        f'render;dur={render * 1000:.1f}',
+        f'total;dur={total * 1000:.1f}',
+    ])
+
+    endpoint = request.endpoint or '<404>'
+    if endpoint == 'static':
+        return response
+    with _lock:
+        metrics = _endpoints.get(endpoint)
+        if metrics is None:
+            metrics = _endpoints[endpoint] = EndpointMetrics()
+        metrics.observe(total, stats['db_time'], render, stats['statements'], stats['slow'])
+    return response
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def prometheus_text():
+    """
+    Метрики в текстовом формате Prometheus (exposition format 0.0.4).
+    """
+    with _lock:
+        items = sorted(_endpoints.items())
+        lines = [
+            "# HELP an30_request_duration_seconds Время обработки запроса.",
+            "# TYPE an30_request_duration_seconds histogram",
+        ]
+        for name, m in items:
+            ep = _label(name)
+            for bound, count in zip(BUCKETS, m.buckets):
+                lines.append(f'an30_request_duration_seconds_bucket{{endpoint="{ep}",le="{bound}"}} {count}')
+            lines.append(f'an30_request_duration_seconds_bucket{{endpoint="{ep}",le="+Inf"}} {m.count}')
+            lines.append(f'an30_request_duration_seconds_sum{{endpoint="{ep}"}} {m.total_time:.6f}')
+            lines.append(f'an30_request_duration_seconds_count{{endpoint="{ep}"}} {m.count}')
+        for metric, help_text, attr, fmt in (
+            ("an30_db_seconds_total", "Время в SQLite.", "db_time", "{:.6f}"),
+            ("an30_render_seconds_total", "Время рендеринга шаблонов.", "render_time", "{:.6f}"),
+            ("an30_sql_statements_total", "Выполнено SQL-команд.", "statements", "{}"),
+            ("an30_slow_queries_total", "Медленных SQL-запросов.", "slow_queries", "{}"),
+        ):
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            for name, m in items:
+                lines.append(f'{metric}{{endpoint="{_label(name)}"}} ' + fmt.format(getattr(m, attr)))
+    return "\n".join(lines) + "\n"
+
+
+def init_app(app):
+    app.jinja_env.template_class = TimedTemplate
+    app.before_request(_start_timer)
+    app.after_request(_record)
@@ -0,0 +1,291 @@
+# app/queries.py
+
+import base64
+import json
+import re
+import threading
+from collections import OrderedDict
+
+from .archive import ARCHIVE_SCHEMA, records_source
+
+# Общие фильтры и сортировки списка записей: их используют
+# /admin/records и /export, чтобы условия совпадали один в один.
+
+STATUSES = ("work", "stop", "repair", "holiday")
+
+MACHINE_NAME_SQL = """CASE
+        WHEN r.machine_id IS NULL THEN '—'
+        WHEN m.id IS NULL THEN 'Техника удалена'
+        ELSE m.name
+      END"""
+DRIVER_NAME_SQL = """CASE
+        WHEN r.driver_id IS NULL THEN '—'
+        WHEN d.id IS NULL THEN 'Водитель удалён'
+        ELSE d.name
+      END"""
+CPARTY_NAME_SQL = """CASE
+        WHEN r.counterparty_id IS NULL THEN '—'
+        WHEN c.id IS NULL THEN 'Контрагент удалён'
+        ELSE c.name
+      END"""
+
+# Строки списка записей: (id, date, machine_name, driver_name, start_time,
+# end_time, hours, comment, cparty_name, status, machine_id, driver_id,
+# counterparty_id[, rank])
+RECORDS_LIST_SELECT = f'''
+    SELECT
+      r.id,
+      r.date,
+      {MACHINE_NAME_SQL} AS machine_name,
+      {DRIVER_NAME_SQL} AS driver_name,
+      r.start_time,
+      r.end_time,
+      r.hours,
+      r.comment,
+      {CPARTY_NAME_SQL} AS cparty_name,
+      r.status,
+      r.machine_id,
+      r.driver_id,
+      r.counterparty_id{{rank_col}}
+    FROM {{source}} r
+    LEFT JOIN machines m ON r.machine_id=m.id
+    LEFT JOIN drivers  d ON r.driver_id=d.id
+    LEFT JOIN counterparties c ON r.counterparty_id=c.id
+    {{fts_join}}
+'''
+
+# Ранг совпадения в records_fts (bm25: чем меньше, тем релевантнее)
+FTS_RANK_JOIN = '''JOIN (SELECT rowid AS fid, rank AS frank
+          FROM records_fts WHERE records_fts MATCH ?) f ON f.fid=r.id'''
+# То же вместе с индексом архива (параметр MATCH передаётся дважды)
+FTS_RANK_JOIN_ARCHIVE = f'''JOIN (SELECT rowid AS fid, rank AS frank
+          FROM records_fts WHERE records_fts MATCH ?
+          UNION ALL
+          SELECT rowid, rank FROM {ARCHIVE_SCHEMA}.records_fts WHERE records_fts MATCH ?) f ON f.fid=r.id'''
+
+FTS_IDS_SQL = "SELECT rowid FROM records_fts WHERE records_fts MATCH ?"
+FTS_IDS_ARCHIVE_SQL = (f"{FTS_IDS_SQL} UNION ALL "
+                       f"SELECT rowid FROM {ARCHIVE_SCHEMA}.records_fts WHERE records_fts MATCH ?")
+
+# Сортировки: (SQL-выражение, направление, индекс столбца в RECORDS_LIST_SELECT).
+# Последний ключ всегда r.id — он делает порядок однозначным и нужен для
+# постраничного вывода по курсору (keyset).
+SORTS = {
+    'date_asc':    (("r.date", "ASC", 1), ("r.id", "ASC", 0)),
+    'date_desc':   (("r.date", "DESC", 1), ("r.id", "DESC", 0)),
+    'hours_asc':   (("r.hours", "ASC", 6), ("r.date", "ASC", 1), ("r.id", "ASC", 0)),
+    'hours_desc':  (("r.hours", "DESC", 6), ("r.date", "DESC", 1), ("r.id", "DESC", 0)),
+    'machine_asc': ((MACHINE_NAME_SQL, "ASC", 2), ("r.date", "DESC", 1), ("r.id", "DESC", 0)),
+    'driver_asc':  ((DRIVER_NAME_SQL, "ASC", 3), ("r.date", "DESC", 1), ("r.id", "DESC", 0)),
+    # только вместе с поиском по комментарию (см. parse_record_filters)
+    'relevance':   (("f.frank", "ASC", 13), ("r.id", "ASC", 0)),
+}
+DEFAULT_SORT = 'date_desc'
+
+_FLIP = {"ASC": "DESC", "DESC": "ASC"}
+
+
+def parse_record_filters(args):
+    """
+    Читает фильтры списка записей из request.args (или любого dict-подобного объекта).
+    """
+    f = {
+        'date_from':   args.get('date_from', ''),
+        'date_to':     args.get('date_to', ''),
+        'mach':        args.get('mach', type=int),
+        'driv':        args.get('driv', type=int),
+        'cpar':        args.get('cpar', type=int),
+        'status':      args.get('status', ''),
+        'comment_sub': args.get('comment_sub', '').strip(),
+        'sort':        args.get('sort', DEFAULT_SORT),
+        # читать архив закрытых периодов и в списке без фильтров (см. cutoff_for_filters)
+        'archive':     args.get('archive', '') == '1',
+    }
+    # Сортировать по релевантности можно только при поиске по комментарию
+    if f['sort'] not in SORTS or (f['sort'] == 'relevance' and not fts_query(f['comment_sub'])):
+        f['sort'] = DEFAULT_SORT
+    return f
+
+
+def fts_query(text):
+    """
+    Превращает поисковую строку в запрос FTS5: каждое слово ищется как
+    префикс ("насос" найдёт «насосы», «насосная»), все слова обязательны.
+    Пустая строка — если слов нет.
+    """
+    words = re.findall(r"\w+", text or "")
+    return " ".join(f'"{w}"*' for w in words)
+
+
+def fts_join_sql(f, cutoff=None):
+    """
+    JOIN с рангом совпадения для сортировки по релевантности. Возвращает (sql, params).
+    """
+    match = fts_query(f['comment_sub'])
+    if cutoff is None:
+        return FTS_RANK_JOIN, [match]
+    return FTS_RANK_JOIN_ARCHIVE, [match, match]
+
+
+def records_list_sql(f, cutoff=None):
+    """
+    SELECT ... FROM списка записей для фильтров f; при сортировке по релевантности
+    добавляет ранг совпадения последним столбцом. cutoff — граница архива, если
+    список должен включать архивные записи (см. archive.cutoff_for_filters).
+    Возвращает (sql, params).
+    """
+    source, pr = records_source(cutoff)
+    if f['sort'] == 'relevance':
+        fts_join, join_pr = fts_join_sql(f, cutoff)
+        return (RECORDS_LIST_SELECT.format(rank_col=",\n      f.frank", source=source, fts_join=fts_join),
+                pr + join_pr)
+    return RECORDS_LIST_SELECT.format(rank_col="", source=source, fts_join=""), pr
+
+
+def build_where(f, cutoff=None):
+    """
+    Строит WHERE по фильтрам. Условия ссылаются только на столбцы records (алиас r).
+    cutoff — граница архива, если источник строк включает архив.
+    Возвращает (where_sql, params).
+    """
+    where = []
+    pr = []
+    if f['date_from']:
+        where.append("r.date>=?")
+        pr.append(f['date_from'])
+    if f['date_to']:
+        where.append("r.date<=?")
+        pr.append(f['date_to'])
+    if f['mach']:
+        where.append("r.machine_id=?")
+        pr.append(f['mach'])
+    if f['driv']:
+        where.append("r.driver_id=?")
+        pr.append(f['driv'])
+    if f['cpar']:
+        where.append("r.counterparty_id=?")
+        pr.append(f['cpar'])
+    if f['status'] in STATUSES:
+        where.append("r.status=?")
+        pr.append(f['status'])
+    if f['comment_sub']:
+        match = fts_query(f['comment_sub'])
+        if match and cutoff is not None:
+            where.append(f"r.id IN ({FTS_IDS_ARCHIVE_SQL})")
+            pr.extend([match, match])
+        elif match:
+            where.append(f"r.id IN ({FTS_IDS_SQL})")
+            pr.append(match)
+        else:
+            # в строке нет ни одного слова (только знаки) — ищем подстроку
+            where.append("r.comment LIKE ?")
+            pr.append(f"%{f['comment_sub']}%")
+
+    where_sql = ""
+    if where:
+        where_sql = "WHERE " + " AND ".join(where)
+    return where_sql, pr
+
+
+def _sort_spec(sort_key):
+    return SORTS.get(sort_key, SORTS[DEFAULT_SORT])
+
+
+def order_sql(sort_key, reverse=False):
+    """
+    ORDER BY для ключа сортировки; reverse=True — обратный порядок
+    (нужен, чтобы листать назад от курсора).
+    """
+    parts = []
+    for expr, direction, _ in _sort_spec(sort_key):
+        parts.append(f"{expr} {_FLIP[direction] if reverse else direction}")
+    return "ORDER BY " + ", ".join(parts)
+
+
+def and_where(where_sql, cond):
+    """
+    Добавляет условие к результату build_where().
+    """
+    return f"{where_sql} AND ({cond})" if where_sql else f"WHERE ({cond})"
+
+
+def keyset_condition(sort_key, values, backward=False):
+    """
+    Условие «строго после курсора» в порядке сортировки
+    (backward=True — «строго до курсора»). Возвращает (sql, params).
+    """
+    spec = _sort_spec(sort_key)
+    ops = []
+    for _, direction, _ in spec:
+        forward_op = ">" if direction == "ASC" else "<"
+        ops.append(forward_op if not backward else {">": "<", "<": ">"}[forward_op])
+
+    # Все направления одинаковые — сравнение кортежей, SQLite ведёт его по индексу
+    if len(set(ops)) == 1:
+        cols = ", ".join(expr for expr, _, _ in spec)
+        marks = ", ".join("?" for _ in spec)
+        return f"({cols}) {ops[0]} ({marks})", list(values)
+
+    # Разные направления — раскрываем в цепочку OR
+    terms = []
+    params = []
+    for i, (expr, _, _) in enumerate(spec):
+        eqs = [f"{e}=?" for e, _, _ in spec[:i]]
+        terms.append("(" + " AND ".join(eqs + [f"{expr} {ops[i]} ?"]) + ")")
+        params.extend(values[:i])
+        params.append(values[i])
+    return " OR ".join(terms), params
+
+
+def encode_cursor(sort_key, row):
+    """
+    Курсор страницы: значения ключей сортировки строки, упакованные в base64.
+    """
+    values = [row[idx] for _, _, idx in _sort_spec(sort_key)]
+    raw = json.dumps([sort_key, values], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(sort_key, token):
+    """
+    Значения ключей сортировки из курсора или None, если курсор
+    испорчен или выдан для другой сортировки.
+    """
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        key, values = json.loads(raw.decode('utf-8'))
+    except (ValueError, TypeError):
+        return None
+    if key != sort_key or not isinstance(values, list) or len(values) != len(_sort_spec(sort_key)):
+        return None
+    return values
+
+
+# --------------------- КЭШ COUNT(*) ---------------------
+
+# Число строк по набору фильтров, привязанное к версии данных records.
+# Пока в records ничего не менялось, повторный COUNT(*) не нужен.
+COUNT_CACHE_SIZE = 256
+_count_cache = OrderedDict()
+_count_lock = threading.Lock()
+
+
+def count_records(conn, where_sql, params, version, cutoff=None):
+    """
+    COUNT(*) по фильтрам без JOIN-ов (условия ссылаются только на records),
+    с кэшем по (условие, параметры, версия данных, граница архива).
+    """
+    key = (where_sql, tuple(params), version, cutoff)
+    with _count_lock:
+        if key in _count_cache:
+            _count_cache.move_to_end(key)
+            return _count_cache[key]
+    source, source_pr = records_source(cutoff)
+    total = conn.execute(f"SELECT COUNT(*) FROM {source} r {where_sql}", source_pr + list(params)).fetchone()[0]
+    with _count_lock:
+        _count_cache[key] = total
+        while len(_count_cache) > COUNT_CACHE_SIZE:
+            _count_cache.popitem(last=False)
+    return total
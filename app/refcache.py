@@ -0,0 +1,86 @@
+# app/refcache.py
+
+import threading
+
+from flask import g
+
+from .database import ACTIVE_REFERENCE_SQL, get_data_versions
+
+# Кэш справочников (техника, водители, контрагенты) в памяти воркера.
+# Актуальность проверяется по счётчикам data_versions, которые поднимают
+# триггеры SQLite: один короткий запрос вместо перечитывания таблиц, и
+# изменения, сделанные другим воркером gunicorn, тоже замечаются.
+#
+# Справочники удаляются мягко (active=0, migration 9): get_reference отдаёт
+# все строки — по ним старые записи находят имена, а get_active — только
+# действующие, для выпадающих списков и главной страницы.
+
+REFERENCE_TABLES = ("machines", "drivers", "counterparties")
+
+_cache = {}  # таблица -> (версия, все строки, действующие по имени)
+_lock = threading.Lock()
+
+
+def _current_versions(conn):
+    # Версии читаются один раз за запрос, сколько бы справочников ни понадобилось
+    versions = g.get('_ref_versions')
+    if versions is None:
+        versions = g._ref_versions = get_data_versions(conn, REFERENCE_TABLES)
+    return versions
+
+
+def _load(conn, table):
+    if table not in REFERENCE_TABLES:
+        raise ValueError(f"Неизвестный справочник: {table}")
+    version = _current_versions(conn)[table]
+    with _lock:
+        cached = _cache.get(table)
+    if cached and cached[0] == version:
+        return cached
+
+    rows = conn.execute(f"SELECT * FROM {table} ORDER BY id").fetchall()
+    active = conn.execute(ACTIVE_REFERENCE_SQL.format(table=table)).fetchall()
+    cached = (version, rows, active)
+    with _lock:
+        _cache[table] = cached
+    return cached
+
+
+def get_reference(conn, table):
+    """
+    Все строки справочника, включая удалённые (SELECT * ... ORDER BY id), из кэша;
+    перечитывает таблицу только если её версия изменилась.
+    """
+    return _load(conn, table)[1]
+
+
+def get_active(conn, table):
+    """
+    Действующие строки справочника (active=1) в порядке имени.
+    """
+    return _load(conn, table)[2]
+
+
+def get_references(conn):
+    """
+    Все три справочника: (machines, drivers, cparties).
+    """
+    return tuple(get_reference(conn, t) for t in REFERENCE_TABLES)
+
+
+def get_active_references(conn):
+    """
+    Действующие строки всех трёх справочников: (machines, drivers, cparties).
+    """
+    return tuple(get_active(conn, t) for t in REFERENCE_TABLES)
+
+
+def invalidate(*tables):
+    """
+    Сбрасывает кэш указанных справочников (все, если не указаны).
+    Вызывается после записи в справочник в этом процессе.
+    """
+    with _lock:
+        for t in tables or REFERENCE_TABLES:
+            _cache.pop(t, None)
+    g.pop('_ref_versions', None)
@@ -0,0 +1,48 @@
+# app/reports.py
+
+from .queries import STATUSES
+
+# Отчёты загрузки читают только агрегаты usage_monthly (см. миграцию 5),
+# поэтому отчёт за год — пара индексных выборок, а не проход по records.
+
+# вид сущности -> (справочник, заголовок)
+REPORT_KINDS = {
+    'machine':      ('machines', 'Техника'),
+    'driver':       ('drivers', 'Водители'),
+    'counterparty': ('counterparties', 'Контрагенты'),
+}
+
+
+def load_year_report(conn, kind: str, year: int):
+    """
+    Отчёт за год по сущностям одного вида.
+    Возвращает {entity_id: {'hours': [часы по 12 месяцам], 'total': часы за год,
+    'days': {статус: число дней}}}.
+    """
+    first, last = f"{year}-01", f"{year}-12"
+    report = {}
+
+    def entry(entity_id):
+        if entity_id not in report:
+            report[entity_id] = {'hours': [0] * 12, 'total': 0, 'days': dict.fromkeys(STATUSES, 0)}
+        return report[entity_id]
+
+    for entity_id, month, hours in conn.execute('''
+        SELECT entity_id, month, SUM(hours)
+          FROM usage_monthly
+         WHERE kind=? AND month BETWEEN ? AND ?
+         GROUP BY entity_id, month
+    ''', (kind, first, last)):
+        e = entry(entity_id)
+        e['hours'][int(month[5:7]) - 1] = hours
+        e['total'] += hours
+
+    for entity_id, status, days in conn.execute('''
+        SELECT entity_id, status, SUM(days)
+          FROM usage_monthly
+         WHERE kind=? AND month BETWEEN ? AND ?
+         GROUP BY entity_id, status
+    ''', (kind, first, last)):
+        entry(entity_id)['days'][status] = days
+
+    return report
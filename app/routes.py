@@ -1,14 +1,36 @@
 # app/routes.py
 
+import os
 import sqlite3
-from flask import render_template, request, redirect, send_file, url_for
-from datetime import datetime, timedelta
-from openpyxl import Workbook
-from openpyxl.styles import PatternFill, Font
-from openpyxl.utils import get_column_letter
-
-from . import app
-from .database import get_db, init_db, get_next_free_id
+import time
+from flask import (Blueprint, current_app, render_template, request, redirect, send_file, url_for,
+                   jsonify, Response, stream_with_context, flash)
+from markupsafe import Markup
+from datetime import date, datetime
+
+from .database import get_db, insert_with_free_id, get_version_stamps, get_month_version
+from .queries import (parse_record_filters, build_where, order_sql, and_where, keyset_condition,
+                      encode_cursor, decode_cursor, count_records, records_list_sql)
+from .export import XLSX_MIMETYPE, STREAM_FORMATS, export_query, build_xlsx_spool
+from .export_jobs import JOB_FORMATS, submit_export, get_job, artifact_path
+from .analytics import build_analytics_spool
+from .refcache import REFERENCE_TABLES, get_reference, get_references, get_active, get_active_references, invalidate
+from .reports import REPORT_KINDS, load_year_report
+from .validation import compute_hours
+from .importer import import_records, read_rows
+from .calendar_data import (clamp_year_month, month_nav, load_machine_month, load_machine_day,
+                            load_fleet_month)
+from .conditional import page_validator, not_modified, conditional_response
+from . import calendar_cache
+from .archive import get_cutoff, archive_cutoff_for, cutoff_for_filters, ensure_open_period
+from .conflicts import ensure_no_conflicts, audit_conflicts
+from .writer import run_write, WriteTimeout
+from .heatmap import parse_machine_ids
+from .changefeed import get_feed, get_change_seq
+from . import metrics, sqltrace
+
+# Страницы приложения; регистрируется в create_app()
+bp = Blueprint('main', __name__)
 
 # Сколько записей на одной странице (для пагинации)
 RECORDS_PER_PAGE = 10
@@ -28,294 +50,446 @@ COLORS = {
     }
 }
 
-# --------------------- ФУНКЦИИ ДОБАВЛЕНИЯ В БД ---------------------
+# --------------------- ФУНКЦИИ ЗАПИСИ В БД ---------------------
+# Все записи идут через поток-писатель (app/writer.py): функции _write_*
+# выполняются в его транзакции на его соединении и не коммитят сами.
+
+RECORD_FIELDS = ("date", "machine_id", "driver_id", "status", "start_time",
+                 "end_time", "hours", "comment", "counterparty_id")
+
+def _write_name(conn, table, row_id, name):
+    if row_id is None:
+        # имя удалённой строки занято (UNIQUE) — повторное добавление её восстанавливает
+        restored = conn.execute(f"UPDATE {table} SET active=1 WHERE name=? AND active=0", (name,))
+        if restored.rowcount:
+            return conn.execute(f"SELECT id FROM {table} WHERE name=?", (name,)).fetchone()[0]
+        return insert_with_free_id(conn, table, ("name",), (name,))
+    conn.execute(f"UPDATE {table} SET name=? WHERE id=?", (name, row_id))
+    return row_id
+
+def _write_delete(conn, table, row_id):
+    # мягкое удаление: записи сохраняют ссылку и имя, SET NULL по records не запускается
+    conn.execute(f"UPDATE {table} SET active=0 WHERE id=? AND active=1", (row_id,))
+
+def _check_record(conn, values, exclude_id=None):
+    # проверки под блокировкой записи: между проверкой и вставкой никто не вклинится
+    date_str, machine_id, driver_id, _, start_t, end_t = values[:6]
+    ensure_open_period(conn, date_str)
+    ensure_no_conflicts(conn, date_str, start_t, end_t, machine_id, driver_id, exclude_id)
+
+def _write_record(conn, rec_id, values):
+    """
+    Вставка (rec_id=None) или изменение записи. Возвращает (id, (machine_id, date)
+    прежней версии или None) — для сброса кэша календаря.
+    """
+    _check_record(conn, values, rec_id)
+    if rec_id is None:
+        return insert_with_free_id(conn, "records", RECORD_FIELDS, values), None
+    old = conn.execute("SELECT machine_id, date FROM records WHERE id=?", (rec_id,)).fetchone()
+    sets = ", ".join(f"{c}=?" for c in RECORD_FIELDS)
+    conn.execute(f"UPDATE records SET {sets} WHERE id=?", tuple(values) + (rec_id,))
+    return rec_id, old
+
+def _write_delete_record(conn, rec_id):
+    old = conn.execute("SELECT machine_id, date FROM records WHERE id=?", (rec_id,)).fetchone()
+    conn.execute("DELETE FROM records WHERE id=?", (rec_id,))
+    return old
 
 def insert_machine(name: str):
-    conn = get_db()
-    try:
-        new_id = get_next_free_id(conn, "machines")
-        conn.execute("INSERT INTO machines (id, name) VALUES (?,?)", (new_id, name))
-        conn.commit()
-    finally:
-        conn.close()
+    run_write(_write_name, "machines", None, name)
+    invalidate("machines")
 
 def insert_driver(name: str):
-    conn = get_db()
-    try:
-        new_id = get_next_free_id(conn, "drivers")
-        conn.execute("INSERT INTO drivers (id, name) VALUES (?,?)", (new_id, name))
-        conn.commit()
-    finally:
-        conn.close()
+    run_write(_write_name, "drivers", None, name)
+    invalidate("drivers")
 
 def insert_counterparty(name: str):
-    conn = get_db()
-    try:
-        new_id = get_next_free_id(conn, "counterparties")
-        conn.execute("INSERT INTO counterparties (id, name) VALUES (?,?)", (new_id, name))
-        conn.commit()
-    finally:
-        conn.close()
+    run_write(_write_name, "counterparties", None, name)
+    invalidate("counterparties")
+
+WRITE_PENDING_MESSAGE = "Запись ещё сохраняется — обновите страницу через несколько секунд"
 
 def insert_record(date_str, machine_id, driver_id, status, start_t, end_t, hours, comment, cpar_id):
-    conn = get_db()
-    try:
-        new_id = get_next_free_id(conn, "records")
-        conn.execute('''
-            INSERT INTO records
-            (id, date, machine_id, driver_id, status, start_time, end_time, hours, comment, counterparty_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (new_id, date_str, machine_id, driver_id, status, start_t, end_t, hours, comment, cpar_id))
-        conn.commit()
-    finally:
-        conn.close()
+    """
+    Добавляет запись; ValueError — закрытый период или пересечение смен,
+    WriteTimeout — писатель не ответил за WRITE_TIMEOUT (запись ещё может сохраниться).
+    """
+    run_write(_write_record, None,
+              (date_str, machine_id, driver_id, status, start_t, end_t, hours, comment, cpar_id))
+    calendar_cache.evict_records([(machine_id, date_str)])
 
 # --------------------- ГЛАВНАЯ СТРАНИЦА (список техники) ---------------------
 
-@app.route('/')
+@bp.route('/')
 def index():
     conn = get_db()
-    try:
-        machines = conn.execute("SELECT * FROM machines ORDER BY id").fetchall()
-    finally:
-        conn.close()
+    validator = page_validator('index', get_version_stamps(conn, ("machines",)))
+    cached = not_modified(validator)
+    if cached is not None:
+        return cached
+
+    machines = get_active(conn, "machines")
 
-    return render_template('index.html', machines=machines)
+    return conditional_response(validator, render_template('index.html', machines=machines))
 
 # --------------------- КАЛЕНДАРЬ ---------------------
 
-@app.route('/calendar/<int:machine_id>')
+def _machine_grid(conn, machine_id, year, month, stamps):
+    def render_grid():
+        # Все записи месяца одним запросом, разложенные по дням
+        dates, recs_dict = load_machine_month(conn, machine_id, year, month)
+        return render_template('_calendar_grid.html', dates=dates, recs_dict=recs_dict, COLORS=COLORS)
+
+    # Сетка зависит от записей месяца и от имён водителей/контрагентов
+    grid_version = "m{}-d{}-c{}".format(stamps['month'][0], stamps['drivers'][0], stamps['counterparties'][0])
+    return calendar_cache.get_grid(machine_id, year, month, grid_version, render_grid)
+
+@bp.route('/calendar/<int:machine_id>')
 def calendar(machine_id):
     year = request.args.get('year', type=int, default=datetime.now().year)
     month = request.args.get('month', type=int, default=datetime.now().month)
-    if month < 1: 
-        month = 1
-    if month > 12: 
-        month = 12
-    if year < 2020: 
-        year = 2020
-    if year > 2030: 
-        year = 2030
+    year, month = clamp_year_month(year, month)
 
     conn = get_db()
-    try:
-        machine = conn.execute("SELECT * FROM machines WHERE id=?", (machine_id,)).fetchone()
-        if not machine:
-            # Если техника не найдена
-            return render_template('base.html', content="<h2>Такой техники нет</h2>"), 404
-
-        first_day = datetime(year, month, 1)
-        last_day  = (first_day.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
-        dates = [first_day + timedelta(days=i) for i in range((last_day - first_day).days + 1)]
-
-        # Получаем записи для каждого дня
-        recs_dict = {}
-        for d in dates:
-            day_recs = conn.execute('''
-                SELECT 
-                  CASE 
-                    WHEN r.driver_id IS NULL THEN '—'
-                    WHEN d.id IS NULL THEN 'Водитель удалён'
-                    ELSE d.name
-                  END AS driver_name,
-                  r.status,
-                  r.start_time,
-                  r.end_time,
-                  CASE
-                    WHEN r.counterparty_id IS NULL THEN ''
-                    WHEN c.id IS NULL THEN 'Контрагент удалён'
-                    ELSE c.name
-                  END AS counterparty_name
-                FROM records r
-                LEFT JOIN drivers d ON r.driver_id=d.id
-                LEFT JOIN counterparties c ON r.counterparty_id=c.id
-                WHERE r.machine_id=? AND r.date=?
-            ''', (machine_id, d.date())).fetchall()
-            recs_dict[d.date()] = day_recs
-    finally:
-        conn.close()
+    # с этого места страница подписывается на ленту изменений (/events);
+    # читается до версий, чтобы правка между ними не потерялась
+    change_seq = get_change_seq(conn)
+    # Страница зависит от записей этой техники за месяц и от справочников
+    stamps = get_version_stamps(conn, ("machines", "drivers", "counterparties"))
+    stamps['month'] = get_month_version(conn, year, month, machine_id)
+    validator = page_validator('calendar', stamps, machine_id, year, month)
+    cached = not_modified(validator)
+    if cached is not None:
+        return cached
+
+    machine = conn.execute("SELECT * FROM machines WHERE id=?", (machine_id,)).fetchone()
+    if not machine:
+        # Если техника не найдена
+        return render_template('base.html', content="<h2>Такой техники нет</h2>"), 404
+
+    grid_html = _machine_grid(conn, machine_id, year, month, stamps)
 
     # Рассчитываем ссылки на предыдущий/следующий месяц
-    prev_month = month - 1
-    prev_year = year
-    if prev_month < 1:
-        prev_month = 12
-        prev_year -= 1
-
-    next_month = month + 1
-    next_year = year
-    if next_month > 12:
-        next_month = 1
-        next_year += 1
-
-    return render_template('calendar.html',
+    prev_year, prev_month, next_year, next_month = month_nav(year, month)
+
+    return conditional_response(validator, render_template('calendar.html',
                            machine=machine,
+                           change_seq=change_seq,
+                           year=year,
+                           month=month,
+                           grid_html=Markup(grid_html),
+                           COLORS=COLORS,
+                           prev_year=prev_year,
+                           prev_month=prev_month,
+                           next_year=next_year,
+                           next_month=next_month))
+
+@bp.route('/calendar/<int:machine_id>/grid')
+def calendar_grid(machine_id):
+    # Сетка месяца целиком — страница заменяет её после reset ленты изменений
+    year = request.args.get('year', type=int, default=datetime.now().year)
+    month = request.args.get('month', type=int, default=datetime.now().month)
+    year, month = clamp_year_month(year, month)
+
+    conn = get_db()
+    stamps = get_version_stamps(conn, ("drivers", "counterparties"))
+    stamps['month'] = get_month_version(conn, year, month, machine_id)
+    return _machine_grid(conn, machine_id, year, month, stamps)
+
+@bp.route('/calendar/<int:machine_id>/day/<day>')
+def calendar_day(machine_id, day):
+    # Одна ячейка календаря — страница перерисовывает её по событию из /events
+    try:
+        day = date.fromisoformat(day)
+    except ValueError:
+        return "Некорректная дата", 404
+    day_data = load_machine_day(get_db(), machine_id, day)
+    return render_template('_calendar_day.html', d=day, day_data=day_data, COLORS=COLORS)
+
+@bp.route('/calendar')
+def calendar_fleet():
+    year = request.args.get('year', type=int, default=datetime.now().year)
+    month = request.args.get('month', type=int, default=datetime.now().month)
+    year, month = clamp_year_month(year, month)
+
+    conn = get_db()
+    stamps = get_version_stamps(conn, ("machines", "drivers", "counterparties"))
+    stamps['month'] = get_month_version(conn, year, month)
+    validator = page_validator('calendar_fleet', stamps, year, month)
+    cached = not_modified(validator)
+    if cached is not None:
+        return cached
+
+    # Весь парк за месяц: два запроса независимо от числа машин и дней
+    machines, dates, grid = load_fleet_month(conn, year, month, get_reference(conn, "machines"))
+
+    prev_year, prev_month, next_year, next_month = month_nav(year, month)
+
+    return conditional_response(validator, render_template('calendar_fleet.html',
+                           machines=machines,
                            year=year,
                            month=month,
                            dates=dates,
-                           recs_dict=recs_dict,
+                           grid=grid,
                            COLORS=COLORS,
                            prev_year=prev_year,
                            prev_month=prev_month,
                            next_year=next_year,
-                           next_month=next_month)
+                           next_month=next_month))
+
+# --------------------- ГОД ТЕХНИКИ (тепловая карта) ---------------------
+
+@bp.route('/heatmap')
+def heatmap():
+    # Страница — только каркас: данные за год браузер берёт одним запросом
+    # к /api/v1/heatmap и рисует карту сам
+    year = request.args.get('year', type=int, default=datetime.now().year)
+    year, _ = clamp_year_month(year, 1)
+    ids = parse_machine_ids(request.args.getlist('machine')) or []
+
+    conn = get_db()
+    validator = page_validator('heatmap', get_version_stamps(conn, ("machines",)), year, ids)
+    cached = not_modified(validator)
+    if cached is not None:
+        return cached
+
+    return conditional_response(validator, render_template('heatmap.html',
+                           year=year,
+                           machines=get_active(conn, "machines"),
+                           selected=ids,
+                           data_url=url_for('api.api_heatmap', year=year, machine=ids),
+                           prev_url=url_for('.heatmap', year=year - 1, machine=ids),
+                           next_url=url_for('.heatmap', year=year + 1, machine=ids),
+                           COLORS=COLORS))
+
+# --------------------- ЖИВЫЕ ОБНОВЛЕНИЯ (SSE) ---------------------
+
+@bp.route('/events')
+def events():
+    """
+    Лента изменений (text/event-stream) после seq=since, без since — с текущего
+    момента; при переподключении браузер сам присылает Last-Event-ID.
+    machine=<id> — из записей только события этой техники.
+    Событие reset — клиент отстал больше чем на буфер: в нём текущий seq,
+    с которого страница переподписывается, обновив показанные данные целиком.
+    503 — в воркере уже SSE_MAX_SUBSCRIBERS подписчиков.
+    """
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', type=int)
+    machine_id = request.args.get('machine', type=int)
+
+    app = current_app._get_current_object()
+    feed = get_feed(app)
+    if since is None:
+        since = feed.last_seq  # без since — только новые события
+    backlog = feed.replay(get_db(), since)
+    if not feed.subscribe(app.config['SSE_MAX_SUBSCRIBERS']):
+        # остальные потоки воркера нужны обычным запросам
+        retry = app.config['SSE_RETRY_AFTER']
+        return Response(f"retry: {retry * 1000}\n\n", status=503, mimetype='text/event-stream',
+                        headers={'Retry-After': str(retry), 'Cache-Control': 'no-store'})
+    keepalive = app.config['SSE_KEEPALIVE']
+    max_age = app.config['SSE_MAX_AGE']
+
+    def wanted(event):
+        return machine_id is None or event[1] != "records" or event[2] == machine_id
+
+    def stream(since):
+        yield "retry: 3000\n\n"
+        if backlog is None:
+            yield feed.reset_event()
+            return
+        events, upto = backlog
+        deadline = time.monotonic() + max_age
+        while True:
+            sent = [event for event in events if wanted(event)]
+            if sent:
+                yield "".join(event[3] for event in sent)
+            if upto != since:
+                since = upto
+                # отфильтрованные события тоже сдвигают Last-Event-ID клиента
+                if not sent or sent[-1][0] != since:
+                    yield f"id: {since}\n\n"
+            if time.monotonic() >= deadline:
+                return
+            events = feed.wait(since, keepalive)
+            if events is None:
+                yield feed.reset_event()
+                return
+            if events:
+                upto = events[-1][0]
+            else:
+                yield ": keepalive\n\n"
+
+    # поток не держит ни контекст запроса, ни соединение с базой:
+    # простаивающий подписчик ждёт на Condition ленты
+    response = Response(stream(since), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(feed.unsubscribe)
+    return response
 
 # --------------------- АДМИНКА (меню) ---------------------
 
-@app.route('/admin')
+@bp.route('/admin')
 def admin():
     return render_template('admin.html')
 
+# --------------------- МЕТРИКИ ---------------------
+
+@bp.route('/admin/metrics')
+def admin_metrics():
+    with sqltrace._slow_lock:
+        slow = list(reversed(sqltrace.slow_queries))
+    return render_template('metrics.html',
+                           endpoints=metrics.snapshot(),
+                           buckets=metrics.BUCKETS,
+                           slow=slow,
+                           slow_ms=current_app.config['SQL_SLOW_MS'],
+                           COLORS=COLORS)
+
+@bp.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.prometheus_text(), mimetype='text/plain; version=0.0.4')
+
 # --------------------- СПРАВОЧНИКИ: МАШИНЫ ---------------------
 
-@app.route('/admin/machines', methods=['GET','POST'])
+@bp.route('/admin/machines', methods=['GET','POST'])
 def admin_machines():
     if request.method == 'POST':
         insert_machine(request.form['name'])
         return redirect('/admin/machines')
 
     conn = get_db()
-    try:
-        machines = conn.execute("SELECT * FROM machines ORDER BY id").fetchall()
-    finally:
-        conn.close()
+    validator = page_validator('admin_machines', get_version_stamps(conn, ("machines",)))
+    cached = not_modified(validator)
+    if cached is not None:
+        return cached
+
+    machines = get_active(conn, "machines")
 
-    return render_template('admin_machines.html', machines=machines)
+    return conditional_response(validator, render_template('admin_machines.html', machines=machines))
 
-@app.route('/edit/machine/<int:id>', methods=['GET','POST'])
+@bp.route('/edit/machine/<int:id>', methods=['GET','POST'])
 def edit_machine(id):
     conn = get_db()
     if request.method == 'POST':
         new_name = request.form['name']
         try:
-            conn.execute("UPDATE machines SET name=? WHERE id=?", (new_name, id))
-            conn.commit()
-        except:
-            conn.rollback()
-        finally:
-            conn.close()
+            run_write(_write_name, "machines", id, new_name)
+            invalidate("machines")
+        except Exception:
+            current_app.logger.exception("Ошибка переименования: machines %s", id)
         return redirect('/admin/machines')
     else:
         machine = conn.execute("SELECT * FROM machines WHERE id=?", (id,)).fetchone()
-        conn.close()
         if not machine:
             return render_template('base.html', content="<h2>Машина не найдена</h2>"), 404
         return render_template('admin_machines.html', machine_edit=machine)
 
-@app.route('/delete/machine/<int:id>', methods=['POST'])
+@bp.route('/delete/machine/<int:id>', methods=['POST'])
 def delete_machine(id):
-    conn = get_db()
     try:
-        conn.execute("DELETE FROM machines WHERE id=?", (id,))
-        conn.commit()
-    except:
-        conn.rollback()
+        run_write(_write_delete, "machines", id)
+        invalidate("machines")
+    except Exception:
+        current_app.logger.exception("Ошибка удаления: machines %s", id)
         return "Ошибка удаления", 500
-    finally:
-        conn.close()
     return redirect('/admin/machines')
 
 # --------------------- СПРАВОЧНИКИ: ВОДИТЕЛИ ---------------------
 
-@app.route('/admin/drivers', methods=['GET','POST'])
+@bp.route('/admin/drivers', methods=['GET','POST'])
 def admin_drivers():
     if request.method == 'POST':
         insert_driver(request.form['name'])
         return redirect('/admin/drivers')
 
     conn = get_db()
-    try:
-        drivers = conn.execute("SELECT * FROM drivers ORDER BY id").fetchall()
-    finally:
-        conn.close()
+    validator = page_validator('admin_drivers', get_version_stamps(conn, ("drivers",)))
+    cached = not_modified(validator)
+    if cached is not None:
+        return cached
 
-    return render_template('admin_drivers.html', drivers=drivers)
+    drivers = get_active(conn, "drivers")
 
-@app.route('/edit/driver/<int:id>', methods=['GET','POST'])
+    return conditional_response(validator, render_template('admin_drivers.html', drivers=drivers))
+
+@bp.route('/edit/driver/<int:id>', methods=['GET','POST'])
 def edit_driver(id):
     conn = get_db()
     if request.method == 'POST':
         new_name = request.form['name']
         try:
-            conn.execute("UPDATE drivers SET name=? WHERE id=?", (new_name, id))
-            conn.commit()
-        except:
-            conn.rollback()
-        finally:
-            conn.close()
+            run_write(_write_name, "drivers", id, new_name)
+            invalidate("drivers")
+        except Exception:
+            current_app.logger.exception("Ошибка переименования: drivers %s", id)
         return redirect('/admin/drivers')
     else:
         dr = conn.execute("SELECT * FROM drivers WHERE id=?", (id,)).fetchone()
-        conn.close()
         if not dr:
             return render_template('base.html', content="<h2>Водитель не найден</h2>"), 404
         return render_template('admin_drivers.html', driver_edit=dr)
 
-@app.route('/delete/driver/<int:id>', methods=['POST'])
+@bp.route('/delete/driver/<int:id>', methods=['POST'])
 def delete_driver(id):
-    conn = get_db()
     try:
-        conn.execute("DELETE FROM drivers WHERE id=?", (id,))
-        conn.commit()
-    except:
-        conn.rollback()
+        run_write(_write_delete, "drivers", id)
+        invalidate("drivers")
+    except Exception:
+        current_app.logger.exception("Ошибка удаления: drivers %s", id)
         return "Ошибка удаления", 500
-    finally:
-        conn.close()
     return redirect('/admin/drivers')
 
 # --------------------- СПРАВОЧНИКИ: КОНТРАГЕНТЫ ---------------------
 
-@app.route('/admin/counterparties', methods=['GET','POST'])
+@bp.route('/admin/counterparties', methods=['GET','POST'])
 def admin_counterparties():
     if request.method == 'POST':
         insert_counterparty(request.form['name'])
         return redirect('/admin/counterparties')
 
     conn = get_db()
-    try:
-        cparties = conn.execute("SELECT * FROM counterparties ORDER BY id").fetchall()
-    finally:
-        conn.close()
+    validator = page_validator('admin_counterparties', get_version_stamps(conn, ("counterparties",)))
+    cached = not_modified(validator)
+    if cached is not None:
+        return cached
 
-    return render_template('admin_counterparties.html', cparties=cparties)
+    cparties = get_active(conn, "counterparties")
 
-@app.route('/edit/counterparty/<int:id>', methods=['GET','POST'])
+    return conditional_response(validator, render_template('admin_counterparties.html', cparties=cparties))
+
+@bp.route('/edit/counterparty/<int:id>', methods=['GET','POST'])
 def edit_counterparty(id):
     conn = get_db()
     if request.method == 'POST':
         new_name = request.form['name']
         try:
-            conn.execute("UPDATE counterparties SET name=? WHERE id=?", (new_name, id))
-            conn.commit()
-        except:
-            conn.rollback()
-        finally:
-            conn.close()
+            run_write(_write_name, "counterparties", id, new_name)
+            invalidate("counterparties")
+        except Exception:
+            current_app.logger.exception("Ошибка переименования: counterparties %s", id)
         return redirect('/admin/counterparties')
     else:
         cp = conn.execute("SELECT * FROM counterparties WHERE id=?", (id,)).fetchone()
-        conn.close()
         if not cp:
             return render_template('base.html', content="<h2>Контрагент не найден</h2>"), 404
         return render_template('admin_counterparties.html', cparty_edit=cp)
 
-@app.route('/delete/counterparty/<int:id>', methods=['POST'])
+@bp.route('/delete/counterparty/<int:id>', methods=['POST'])
 def delete_counterparty(id):
-    conn = get_db()
     try:
-        conn.execute("DELETE FROM counterparties WHERE id=?", (id,))
-        conn.commit()
-    except:
-        conn.rollback()
+        run_write(_write_delete, "counterparties", id)
+        invalidate("counterparties")
+    except Exception:
+        current_app.logger.exception("Ошибка удаления: counterparties %s", id)
         return "Ошибка удаления", 500
-    finally:
-        conn.close()
     return redirect('/admin/counterparties')
 
 # --------------------- СПИСОК ЗАПИСЕЙ (records) ---------------------
 
-@app.route('/admin/records', methods=['GET','POST'])
+@bp.route('/admin/records', methods=['GET','POST'])
 def admin_records():
     if request.method == 'POST':
         # Добавляем запись
@@ -329,136 +503,106 @@ def admin_records():
         c_id       = request.form.get('counterparty_id')
         cpar_id    = int(c_id) if c_id else None
 
-        hours = 0
-        if st_time and end_time:
-            try:
-                st = datetime.strptime(st_time, '%H:%M')
-                en = datetime.strptime(end_time, '%H:%M')
-                if en < st:
-                    en += timedelta(days=1)
-                delta = en - st
-                hours = delta.seconds // 3600
-            except:
-                pass
-
-        insert_record(date_str, machine_id, driver_id, status, 
-                      st_time or None, end_time or None,
-                      hours, comm, cpar_id)
+        hours = compute_hours(st_time, end_time)
+
+        try:
+            insert_record(date_str, machine_id, driver_id, status,
+                          st_time or None, end_time or None,
+                          hours, comm, cpar_id)
+        except ValueError as e:
+            flash(str(e), 'error')
+        except WriteTimeout:
+            # задание осталось в очереди писателя и ещё может закоммититься
+            flash(WRITE_PENDING_MESSAGE, 'error')
         return redirect('/admin/records')
 
     # Фильтры
-    date_from = request.args.get('date_from','')
-    date_to   = request.args.get('date_to','')
-    mach_f    = request.args.get('mach', type=int)
-    driv_f    = request.args.get('driv', type=int)
-    cpar_f    = request.args.get('cpar', type=int)
-    stat_f    = request.args.get('status','')
-    comm_sub  = request.args.get('comment_sub','').strip()
-    sort_key  = request.args.get('sort','date_desc')
+    f = parse_record_filters(request.args)
+    date_from = f['date_from']
+    date_to   = f['date_to']
+    mach_f    = f['mach']
+    driv_f    = f['driv']
+    cpar_f    = f['cpar']
+    stat_f    = f['status']
+    comm_sub  = f['comment_sub']
+    sort_key  = f['sort']
     page      = request.args.get('page', type=int, default=1)
     if page < 1:
         page = 1
 
-    where = []
-    pr = []
-    if date_from:
-        where.append("r.date>=?")
-        pr.append(date_from)
-    if date_to:
-        where.append("r.date<=?")
-        pr.append(date_to)
-    if mach_f:
-        where.append("r.machine_id=?")
-        pr.append(mach_f)
-    if driv_f:
-        where.append("r.driver_id=?")
-        pr.append(driv_f)
-    if cpar_f:
-        where.append("r.counterparty_id=?")
-        pr.append(cpar_f)
-    if stat_f in ("work","stop","repair","holiday"):
-        where.append("r.status=?")
-        pr.append(stat_f)
-    if comm_sub:
-        where.append("r.comment LIKE ?")
-        pr.append(f"%{comm_sub}%")
-
-    where_sql = ""
-    if where:
-        where_sql = "WHERE " + " AND ".join(where)
-
-    if sort_key=="date_asc":
-        order_sql="ORDER BY r.date ASC, r.id ASC"
-    elif sort_key=="date_desc":
-        order_sql="ORDER BY r.date DESC, r.id DESC"
-    elif sort_key=="hours_asc":
-        order_sql="ORDER BY r.hours ASC, r.date ASC"
-    elif sort_key=="hours_desc":
-        order_sql="ORDER BY r.hours DESC, r.date DESC"
-    elif sort_key=="machine_asc":
-        order_sql="ORDER BY machine_name ASC, r.date DESC"
-    elif sort_key=="driver_asc":
-        order_sql="ORDER BY driver_name ASC, r.date DESC"
-    else:
-        order_sql="ORDER BY r.date DESC, r.id DESC"
-
     conn = get_db()
-    count_sql = f'''
-        SELECT COUNT(*)
-          FROM records r
-          LEFT JOIN machines m ON r.machine_id=m.id
-          LEFT JOIN drivers d ON r.driver_id=d.id
-          LEFT JOIN counterparties c ON r.counterparty_id=c.id
-        {where_sql}
-    '''
-    total_count = conn.execute(count_sql, pr).fetchone()[0]
-    offset = (page-1)*RECORDS_PER_PAGE
+    change_seq = get_change_seq(conn)  # см. calendar()
+    stamps = get_version_stamps(conn)
+    validator = page_validator('admin_records', stamps)
+    cached = not_modified(validator)
+    if cached is not None:
+        return cached
+
+    # Архив читается, если период фильтра заходит в закрытые месяцы;
+    # список без фильтров показывает только рабочую базу
+    archive_cutoff = get_cutoff(conn)
+    cutoff = cutoff_for_filters(conn, f, hot_when_unfiltered=True)
+    where_sql, pr = build_where(f, cutoff)
+
+    # COUNT(*) без JOIN-ов; результат кэшируется до следующего изменения records
+    records_version = stamps["records"][0]
+    total_count = count_records(conn, where_sql, pr, records_version, cutoff)
     total_pages = (total_count+RECORDS_PER_PAGE-1)//RECORDS_PER_PAGE
 
+    # Постраничный вывод по курсору: after — следующая страница, before — предыдущая.
+    # Без курсора page>1 (старые ссылки) обрабатываем через OFFSET.
+    after = decode_cursor(sort_key, request.args.get('after'))
+    before = decode_cursor(sort_key, request.args.get('before')) if after is None else None
+    page_where, page_pr, offset = where_sql, list(pr), 0
+    if after is not None or before is not None:
+        cond, cond_pr = keyset_condition(sort_key, after if after is not None else before,
+                                         backward=before is not None)
+        page_where = and_where(where_sql, cond)
+        page_pr += cond_pr
+    else:
+        offset = (page-1)*RECORDS_PER_PAGE
+
+    select_sql, select_pr = records_list_sql(f, cutoff)
     sql = f'''
-    SELECT 
-      r.id,
-      r.date,
-      CASE 
-        WHEN r.machine_id IS NULL THEN '—'
-        WHEN m.id IS NULL THEN 'Техника удалена'
-        ELSE m.name
-      END AS machine_name,
-      CASE
-        WHEN r.driver_id IS NULL THEN '—'
-        WHEN d.id IS NULL THEN 'Водитель удалён'
-        ELSE d.name
-      END AS driver_name,
-      r.start_time,
-      r.end_time,
-      r.hours,
-      r.comment,
-      CASE
-        WHEN r.counterparty_id IS NULL THEN '—'
-        WHEN c.id IS NULL THEN 'Контрагент удалён'
-        ELSE c.name
-      END AS cparty_name,
-      r.status
-    FROM records r
-    LEFT JOIN machines m ON r.machine_id=m.id
-    LEFT JOIN drivers  d ON r.driver_id=d.id
-    LEFT JOIN counterparties c ON r.counterparty_id=c.id
-    {where_sql}
-    {order_sql}
+    {select_sql}
+    {page_where}
+    {order_sql(sort_key, reverse=before is not None)}
     LIMIT ? OFFSET ?
     '''
-    records = conn.execute(sql, pr + [RECORDS_PER_PAGE, offset]).fetchall()
-
-    machines = conn.execute("SELECT * FROM machines ORDER BY id").fetchall()
-    drivers  = conn.execute("SELECT * FROM drivers ORDER BY id").fetchall()
-    cparties = conn.execute("SELECT * FROM counterparties ORDER BY id").fetchall()
-    conn.close()
-
-    return render_template('admin_records.html',
+    # Берём на одну строку больше, чтобы узнать, есть ли страница дальше
+    records = conn.execute(sql, select_pr + page_pr + [RECORDS_PER_PAGE + 1, offset]).fetchall()
+    has_more = len(records) > RECORDS_PER_PAGE
+    records = records[:RECORDS_PER_PAGE]
+    if before is not None:
+        records.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = page > 1, has_more
+
+    # Ссылки на соседние страницы: текущие параметры + курсор
+    nav_args = request.args.to_dict()
+    for k in ('after', 'before', 'page'):
+        nav_args.pop(k, None)
+    prev_url = next_url = None
+    if has_prev and records:
+        prev_url = url_for('.admin_records', **nav_args, page=max(page-1, 1),
+                           before=encode_cursor(sort_key, records[0]))
+    if has_next and records:
+        next_url = url_for('.admin_records', **nav_args, page=page+1,
+                           after=encode_cursor(sort_key, records[-1]))
+
+    # фильтры — по всем, включая удалённых (их записи остаются); новая запись — только на действующих
+    machines, drivers, cparties = get_references(conn)
+    active_machines, active_drivers, active_cparties = get_active_references(conn)
+
+    return conditional_response(validator, render_template('admin_records.html',
                            records=records,
                            machines=machines,
                            drivers=drivers,
                            cparties=cparties,
+                           active_machines=active_machines,
+                           active_drivers=active_drivers,
+                           active_cparties=active_cparties,
                            COLORS=COLORS,
                            date_from=date_from,
                            date_to=date_to,
@@ -469,11 +613,27 @@ def admin_records():
                            comm_sub=comm_sub,
                            sort_key=sort_key,
                            page=page,
+                           prev_url=prev_url,
+                           next_url=next_url,
                            total_pages=total_pages,
                            total_count=total_count,
-                           RECORDS_PER_PAGE=RECORDS_PER_PAGE)
-
-@app.route('/edit/record/<int:id>', methods=['GET','POST'])
+                           archive_cutoff=archive_cutoff,
+                           archive_included=cutoff is not None,
+                           archive_url=url_for('.admin_records', **dict(nav_args, archive='1')),
+                           change_seq=change_seq,
+                           RECORDS_PER_PAGE=RECORDS_PER_PAGE))
+
+def _choices(conn, table, current_id):
+    """
+    Варианты выпадающего списка: действующие строки справочника и,
+    если запись ссылается на удалённую, она сама в конце списка.
+    """
+    rows = get_active(conn, table)
+    if current_id is None or any(r[0] == current_id for r in rows):
+        return rows
+    return rows + [r for r in get_reference(conn, table) if r[0] == current_id]
+
+@bp.route('/edit/record/<int:id>', methods=['GET','POST'])
 def edit_record(id):
     conn = get_db()
     if request.method == 'POST':
@@ -488,38 +648,19 @@ def edit_record(id):
             c_id       = request.form.get('counterparty_id')
             cpar_id    = int(c_id) if c_id else None
 
-            hrs = 0
-            if st_t and end_t:
-                try:
-                    sdt = datetime.strptime(st_t, '%H:%M')
-                    edt = datetime.strptime(end_t, '%H:%M')
-                    if edt < sdt:
-                        edt += timedelta(days=1)
-                    delta = edt - sdt
-                    hrs = delta.seconds // 3600
-                except:
-                    pass
-
-            conn.execute('''
-                UPDATE records
-                   SET date=?,
-                       machine_id=?,
-                       driver_id=?,
-                       status=?,
-                       start_time=?,
-                       end_time=?,
-                       hours=?,
-                       comment=?,
-                       counterparty_id=?
-                 WHERE id=?
-            ''', (date_str, machine_id, driver_id, status, 
-                  st_t or None, end_t or None, hrs, comm, cpar_id, id))
-            conn.commit()
-        except Exception as e:
-            print(f"Ошибка редактирования записи: {e}")
-            conn.rollback()
-        finally:
-            conn.close()
+            hrs = compute_hours(st_t, end_t)
+            _, old = run_write(_write_record, id, (date_str, machine_id, driver_id, status,
+                                                   st_t or None, end_t or None, hrs, comm, cpar_id))
+            # календарь старого и нового месяца
+            calendar_cache.evict_records([old, (machine_id, date_str)] if old else [(machine_id, date_str)])
+        except ValueError as e:
+            # закрытый период или пересечение смен — показываем причину на форме
+            flash(str(e), 'error')
+            return redirect(url_for('.edit_record', id=id))
+        except WriteTimeout:
+            flash(WRITE_PENDING_MESSAGE, 'error')
+        except Exception:
+            current_app.logger.exception("Ошибка редактирования записи %s", id)
         return redirect('/admin/records')
     else:
         record = conn.execute('''
@@ -528,14 +669,13 @@ def edit_record(id):
              WHERE id=?
         ''', (id,)).fetchone()
 
-        machines = conn.execute("SELECT * FROM machines ORDER BY id").fetchall()
-        drivers  = conn.execute("SELECT * FROM drivers ORDER BY id").fetchall()
-        cparties = conn.execute("SELECT * FROM counterparties ORDER BY id").fetchall()
-        conn.close()
-
         if not record:
             return render_template('base.html', content="<h2>Запись не найдена</h2>"), 404
 
+        # действующие + текущие значения записи, даже если они уже удалены
+        machines, drivers, cparties = (_choices(conn, t, current)
+                                       for t, current in zip(REFERENCE_TABLES, (record[1], record[2], record[8])))
+
         return render_template('record_edit.html',
                                rec_id=id,
                                record=record,
@@ -543,192 +683,180 @@ def edit_record(id):
                                drivers=drivers,
                                cparties=cparties)
 
-@app.route('/delete/record/<int:id>', methods=['POST'])
+@bp.route('/delete/record/<int:id>', methods=['POST'])
 def delete_record(id):
-    conn = get_db()
     try:
-        conn.execute("DELETE FROM records WHERE id=?", (id,))
-        conn.commit()
-    except:
-        conn.rollback()
+        old = run_write(_write_delete_record, id)
+    except Exception:
+        current_app.logger.exception("Ошибка удаления записи %s", id)
         return "Ошибка удаления записи", 500
-    finally:
-        conn.close()
+    if old:
+        calendar_cache.evict_records([old])
     return redirect('/admin/records')
 
+@bp.route('/admin/records/row/<int:id>')
+def record_row(id):
+    # Одна строка списка записей — страница заменяет её по событию из /events
+    conn = get_db()
+    select_sql, select_pr = records_list_sql({'sort': None}, archive_cutoff_for(conn, include=True))
+    row = conn.execute(f"{select_sql} WHERE r.id=?", select_pr + [id]).fetchone()
+    if not row:
+        return "Запись не найдена", 404
+    return render_template('_record_row.html', r=row, archive_cutoff=get_cutoff(conn), COLORS=COLORS)
+
+# --------------------- ПЕРЕСЕЧЕНИЯ СМЕН ---------------------
+
+@bp.route('/admin/conflicts')
+def admin_conflicts():
+    conn = get_db()
+    stamps = get_version_stamps(conn)
+    validator = page_validator('admin_conflicts', stamps)
+    cached = not_modified(validator)
+    if cached is not None:
+        return cached
+
+    machines, drivers, _ = get_references(conn)
+    names = {'machine': {m[0]: m[1] for m in machines},
+             'driver': {d[0]: d[1] for d in drivers}}
+    conflicts = [(kind, names[kind].get(resource_id, f"#{resource_id}"), a, b)
+                 for kind, resource_id, a, b in audit_conflicts(conn)]
+    return conditional_response(validator, render_template('admin_conflicts.html', conflicts=conflicts))
+
+# --------------------- ИМПОРТ ЗАПИСЕЙ ---------------------
+
+@bp.route('/admin/import', methods=['GET','POST'])
+def admin_import():
+    result = None
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            return render_template('import.html', error="Выберите файл .xlsx или .csv"), 400
+        result = import_records(get_db(), read_rows(upload.stream, upload.filename),
+                                current_app.config['IMPORT_BATCH_SIZE'])
+    return render_template('import.html', result=result)
+
+# --------------------- ОТЧЁТЫ ЗАГРУЗКИ ---------------------
+
+@bp.route('/reports')
+def reports():
+    year = request.args.get('year', type=int, default=datetime.now().year)
+    year, _ = clamp_year_month(year, 1)
+    kind = request.args.get('kind', 'machine')
+    if kind not in REPORT_KINDS:
+        kind = 'machine'
+
+    table, title = REPORT_KINDS[kind]
+
+    conn = get_db()
+    validator = page_validator('reports', get_version_stamps(conn, ("records", table)), kind, year)
+    cached = not_modified(validator)
+    if cached is not None:
+        return cached
+
+    report = load_year_report(conn, kind, year)
+    names = {row[0]: row[1] for row in get_reference(conn, table)}
+
+    return conditional_response(validator, render_template('reports.html',
+                           year=year,
+                           kind=kind,
+                           kinds=REPORT_KINDS,
+                           title=title,
+                           report=report,
+                           names=names,
+                           COLORS=COLORS))
+
 # --------------------- ЭКСПОРТ В EXCEL ---------------------
 
-@app.route('/export')
+@bp.route('/export')
 def export_excel():
-    export_mode = request.args.get('export','')
     conn = get_db()
-    try:
-        if export_mode == 'filtered':
-            # Читаем те же фильтры
-            date_from = request.args.get('date_from','')
-            date_to   = request.args.get('date_to','')
-            mach_f    = request.args.get('mach', type=int)
-            driv_f    = request.args.get('driv', type=int)
-            cpar_f    = request.args.get('cpar', type=int)
-            stat_f    = request.args.get('status','')
-            comm_sub  = request.args.get('comment_sub','').strip()
-            sort_key  = request.args.get('sort','date_desc')
-
-            where = []
-            pr = []
-            if date_from:
-                where.append("r.date>=?")
-                pr.append(date_from)
-            if date_to:
-                where.append("r.date<=?")
-                pr.append(date_to)
-            if mach_f:
-                where.append("r.machine_id=?")
-                pr.append(mach_f)
-            if driv_f:
-                where.append("r.driver_id=?")
-                pr.append(driv_f)
-            if cpar_f:
-                where.append("r.counterparty_id=?")
-                pr.append(cpar_f)
-            if stat_f in ("work","stop","repair","holiday"):
-                where.append("r.status=?")
-                pr.append(stat_f)
-            if comm_sub:
-                where.append("r.comment LIKE ?")
-                pr.append(f"%{comm_sub}%")
-
-            where_sql = ""
-            if where:
-                where_sql = "WHERE " + " AND ".join(where)
-
-            if sort_key=="date_asc":
-                order_sql="ORDER BY r.date ASC, r.id ASC"
-            elif sort_key=="date_desc":
-                order_sql="ORDER BY r.date DESC, r.id DESC"
-            elif sort_key=="hours_asc":
-                order_sql="ORDER BY r.hours ASC, r.date ASC"
-            elif sort_key=="hours_desc":
-                order_sql="ORDER BY r.hours DESC, r.date DESC"
-            elif sort_key=="machine_asc":
-                order_sql="ORDER BY machine_name ASC, r.date DESC"
-            elif sort_key=="driver_asc":
-                order_sql="ORDER BY driver_name ASC, r.date DESC"
-            else:
-                order_sql="ORDER BY r.date DESC, r.id DESC"
-
-            rows = conn.execute(f'''
-                SELECT 
-                  r.date,
-                  CASE
-                    WHEN r.machine_id IS NULL THEN '—'
-                    WHEN m.id IS NULL THEN 'Техника удалёна'
-                    ELSE m.name
-                  END AS machine_name,
-                  CASE
-                    WHEN r.driver_id IS NULL THEN '—'
-                    WHEN d.id IS NULL THEN 'Водитель удалён'
-                    ELSE d.name
-                  END AS driver_name,
-                  r.status,
-                  IFNULL(r.start_time,""),
-                  IFNULL(r.end_time,""),
-                  r.hours,
-                  CASE
-                    WHEN r.counterparty_id IS NULL THEN '—'
-                    WHEN c.id IS NULL THEN 'Контрагент удалён'
-                    ELSE c.name
-                  END AS cparty_name,
-                  IFNULL(r.comment,"-")
-                FROM records r
-                LEFT JOIN machines m ON r.machine_id=m.id
-                LEFT JOIN drivers d  ON r.driver_id=d.id
-                LEFT JOIN counterparties c ON r.counterparty_id=c.id
-                {where_sql}
-                {order_sql}
-            ''', pr).fetchall()
-        else:
-            # Экспорт всех записей
-            rows = conn.execute('''
-                SELECT
-                  r.date,
-                  CASE
-                    WHEN r.machine_id IS NULL THEN '—'
-                    WHEN m.id IS NULL THEN 'Техника удалёна'
-                    ELSE m.name
-                  END AS machine_name,
-                  CASE
-                    WHEN r.driver_id IS NULL THEN '—'
-                    WHEN d.id IS NULL THEN 'Водитель удалён'
-                    ELSE d.name
-                  END AS driver_name,
-                  r.status,
-                  IFNULL(r.start_time,""),
-                  IFNULL(r.end_time,""),
-                  r.hours,
-                  CASE
-                    WHEN r.counterparty_id IS NULL THEN '—'
-                    WHEN c.id IS NULL THEN 'Контрагент удалён'
-                    ELSE c.name
-                  END AS cparty_name,
-                  IFNULL(r.comment,"-")
-                FROM records r
-                LEFT JOIN machines m ON r.machine_id=m.id
-                LEFT JOIN drivers d ON r.driver_id=d.id
-                LEFT JOIN counterparties c ON r.counterparty_id=c.id
-                ORDER BY r.date ASC, r.id ASC
-            ''').fetchall()
-    finally:
-        conn.close()
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "AN-30 Отчёт"
-
-    headers = ["Дата", "Техника", "Водитель", "Статус", "Начало", "Конец", "Часы", "Контрагент", "Комментарий"]
-    ws.append(headers)
-
-    header_fill = PatternFill(start_color="444444", fill_type="solid")
-    header_font = Font(color="FFFFFF", bold=True)
-    for col in range(1, len(headers)+1):
-        cell = ws.cell(row=1, column=col)
-        cell.fill = header_fill
-        cell.font = header_font
-        ws.column_dimensions[get_column_letter(col)].width = 20
-
-    for row in rows:
-        date_db     = row[0]
-        machine_nm  = row[1]
-        driver_nm   = row[2]
-        status_     = row[3]
-        start_      = row[4]
-        end_        = row[5]
-        hrs_        = row[6] or 0
-        cpar_       = row[7]
-        comm_       = row[8]
-
-        # Перевод даты в формат дд.мм.гггг
-        try:
-            date_fmt = datetime.strptime(date_db, '%Y-%m-%d').strftime('%d.%m.%Y')
-        except:
-            date_fmt = date_db
+    sql, pr = export_query(conn, request.args)
+    stamp = datetime.now().strftime("%Y%m%d_%H%M")
+
+    # format=csv|ndjson — потоковая выгрузка без openpyxl: строки уходят клиенту
+    # пачками по мере чтения курсора, память не зависит от размера выгрузки
+    fmt = request.args.get('format', 'xlsx')
+    if fmt in STREAM_FORMATS:
+        chunks, mimetype, ext = STREAM_FORMATS[fmt]
+        cursor = conn.execute(sql, pr)
+        return Response(
+            stream_with_context(chunks(cursor, current_app.config['EXPORT_BATCH_SIZE'])),
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename=report_{stamp}.{ext}'},
+        )
+
+    if fmt == 'analytics':
+        # сводные листы по агрегатам + лист записей при detail=1
+        spool = build_analytics_spool(conn, request.args,
+                                      current_app.config['EXPORT_BATCH_SIZE'],
+                                      current_app.config['EXPORT_SPOOL_MAX_SIZE'])
+        fname = "analytics_" + stamp + ".xlsx"
+    elif fmt == 'xlsx':
+        spool = build_xlsx_spool(conn, sql, pr,
+                                 current_app.config['EXPORT_BATCH_SIZE'],
+                                 current_app.config['EXPORT_SPOOL_MAX_SIZE'])
+        fname = "report_" + stamp + ".xlsx"
+    else:
+        return render_template('base.html', content="<h2>Неизвестный формат выгрузки</h2>"), 400
 
-        st_hex = COLORS['status'].get(status_, "#FFFFFF")[1:]  # берем цвет без "#"
+    # send_file отдаёт spool кусками и закрывает его после ответа
+    return send_file(
+        spool,
+        as_attachment=True,
+        download_name=fname,
+        mimetype=XLSX_MIMETYPE
+    )
 
-        ws.append([
-            date_fmt, machine_nm, driver_nm, 
-            status_.capitalize(), start_, end_, hrs_, cpar_, comm_
-        ])
-        # Заливаем ячейку статуса
-        st_cell = ws.cell(row=ws.max_row, column=4)
-        st_cell.fill = PatternFill(start_color=st_hex, fill_type="solid")
+# --------------------- ФОНОВЫЙ ЭКСПОРТ ---------------------
 
-    fname = "report_" + datetime.now().strftime("%Y%m%d_%H%M") + ".xlsx"
-    wb.save(fname)
+def _job_response(job):
+    return {
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'error': job.get('error'),
+        'status_url': url_for('.export_job_status', job_id=job['job_id']),
+        'download_url': url_for('.export_job_download', job_id=job['job_id']),
+    }
 
+@bp.route('/export/jobs', methods=['POST'])
+def export_job_submit():
+    # Параметры те же, что у /export: в строке запроса или в теле формы
+    args = request.args.copy()
+    args.update(request.form)
+    try:
+        job = submit_export(args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(_job_response(job)), 202
+
+@bp.route('/export/jobs/<job_id>')
+def export_job_status(job_id):
+    job = get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Задача не найдена'}), 404
+    return jsonify(_job_response(job))
+
+@bp.route('/export/jobs/<job_id>/download')
+def export_job_download(job_id):
+    job = get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Задача не найдена'}), 404
+    if job['status'] != 'done':
+        return jsonify(_job_response(job)), 409
+    fmt = job.get('format', 'xlsx')
+    path = artifact_path(job['key'], fmt)
+    if not os.path.exists(path):
+        # Файл уже вытеснен из кэша — выгрузку нужно запустить заново
+        return jsonify({'error': 'Файл отчёта больше недоступен'}), 410
+
+    # имя файла — по времени готовности отчёта, как у /export
+    stamp = datetime.fromtimestamp(job.get('updated_at') or time.time()).strftime("%Y%m%d_%H%M")
+    mimetype, ext = JOB_FORMATS[fmt]
+    prefix = "analytics" if fmt == 'analytics' else "report"  # как у /export
     return send_file(
-        fname,
+        path,
         as_attachment=True,
-        download_name=fname,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        download_name=f"{prefix}_{stamp}.{ext}",
+        mimetype=mimetype
     )
+
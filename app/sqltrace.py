@@ -0,0 +1,191 @@
+# app/sqltrace.py
+
+import logging
+import sqlite3
+import threading
+from collections import deque
+from time import perf_counter
+
+# Инструментированные соединения SQLite: считают команды и время БД
+# для текущего запроса и пишут в лог медленные запросы вместе с планом.
+#
+# - время: обёртки execute/fetch* курсора (включая выборку строк, а не только
+#   первый шаг запроса);
+# - число команд: trace callback — видит и команды внутри триггеров;
+# - объём работы: progress handler, вызывается каждые PROGRESS_STEP инструкций VM.
+
+log = logging.getLogger(__name__)
+
+PROGRESS_STEP = 1000
+
+# Последние медленные запросы процесса — для страницы /admin/metrics
+SLOW_LOG_SIZE = 50
+slow_queries = deque(maxlen=SLOW_LOG_SIZE)
+_slow_lock = threading.Lock()
+
+
+class QueryStats:
+    """
+    Счётчики соединения с момента reset() (соединение выдаётся на один запрос).
+    """
+    __slots__ = ('queries', 'statements', 'trigger_statements', 'db_time', 'vm_steps', 'slow')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.queries = 0             # вызовы execute/executemany из Python
+        self.statements = 0          # команды по trace callback, без триггеров
+        self.trigger_statements = 0  # команды внутри триггеров
+        self.db_time = 0.0           # секунд в SQLite
+        self.vm_steps = 0            # инструкций VM (с точностью до PROGRESS_STEP)
+        self.slow = 0
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def explain(conn, sql, params):
+    """
+    EXPLAIN QUERY PLAN запроса в виде строк с отступами; пустая строка, если план не получить.
+    """
+    try:
+        rows = sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    except sqlite3.Error:
+        return ""
+    depth = {0: 0}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, 0) + 1
+        lines.append("  " * depth[node_id] + detail)
+    return "\n".join(lines)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    _sql = None
+    _params = ()
+    _elapsed = 0.0
+
+    def _add(self, elapsed):
+        self._elapsed += elapsed
+        self.connection.stats.db_time += elapsed
+
+    def _finish(self):
+        # Команда выполнена и строки выбраны (или курсор переиспользуют/закрывают)
+        sql, self._sql = self._sql, None
+        if sql is None:
+            return
+        conn = self.connection
+        if conn.slow_ms is not None and self._elapsed * 1000 >= conn.slow_ms:
+            conn.stats.slow += 1
+            plan = explain(conn, sql, self._params) if self._params is not None else ""
+            entry = {'ms': round(self._elapsed * 1000, 1), 'sql': " ".join(sql.split()), 'plan': plan}
+            with _slow_lock:
+                slow_queries.append(entry)
+            log.warning("Медленный запрос %.1f мс: %s\n%s", entry['ms'], entry['sql'], plan)
+
+    def _start(self, sql, params):
+        self._finish()
+        self._sql, self._params, self._elapsed = sql, params, 0.0
+        self.connection.stats.queries += 1
+
+    def execute(self, sql, parameters=()):
+        self._start(sql, parameters)
+        t0 = perf_counter()
+        try:
+            super().execute(sql, parameters)
+        finally:
+            self._add(perf_counter() - t0)
+        if self.description is None:
+            self._finish()
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        # план для пачки параметров не строим
+        self._start(sql, None)
+        t0 = perf_counter()
+        try:
+            super().executemany(sql, seq_of_parameters)
+        finally:
+            self._add(perf_counter() - t0)
+        self._finish()
+        return self
+
+    def fetchone(self):
+        t0 = perf_counter()
+        row = super().fetchone()
+        self._add(perf_counter() - t0)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        t0 = perf_counter()
+        rows = super().fetchmany(size)
+        self._add(perf_counter() - t0)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        t0 = perf_counter()
+        rows = super().fetchall()
+        self._add(perf_counter() - t0)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        t0 = perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._add(perf_counter() - t0)
+            self._finish()
+            raise
+        self._add(perf_counter() - t0)
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        # conn.execute(...).fetchone() не дочитывает курсор — итог подводим при его удалении
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """
+    Соединение, у которого все запросы идут через InstrumentedCursor.
+    slow_ms — порог медленного запроса в мс (None — не логировать).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = QueryStats()
+        self.slow_ms = None
+        self.set_trace_callback(self._on_statement)
+        self.set_progress_handler(self._on_progress, PROGRESS_STEP)
+
+    def _on_statement(self, statement):
+        if statement.startswith('--'):
+            self.stats.trigger_statements += 1
+        else:
+            self.stats.statements += 1
+
+    def _on_progress(self):
+        self.stats.vm_steps += PROGRESS_STEP
+        return 0
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
@@ -0,0 +1,103 @@
+# app/validation.py
+
+from datetime import date, datetime, time, timedelta
+
+from .queries import STATUSES
+
+# Допустимые написания статуса (в т.ч. как в выгрузке Excel: "Work")
+STATUS_ALIASES = {
+    'work': 'work', 'работа': 'work',
+    'stop': 'stop', 'простой': 'stop',
+    'repair': 'repair', 'ремонт': 'repair',
+    'holiday': 'holiday', 'выходной': 'holiday',
+}
+
+
+def compute_hours(start_time, end_time) -> int:
+    """
+    Число полных часов между start_time и end_time ('HH:MM').
+    Если конец раньше начала — смена переходит через полночь.
+    При пустом или некорректном времени возвращает 0.
+    """
+    if not (start_time and end_time):
+        return 0
+    try:
+        st = datetime.strptime(start_time, '%H:%M')
+        en = datetime.strptime(end_time, '%H:%M')
+    except (TypeError, ValueError):
+        return 0
+    if en < st:
+        en += timedelta(days=1)
+    return (en - st).seconds // 3600
+
+
+def parse_status(value) -> str:
+    status = STATUS_ALIASES.get(str(value or '').strip().lower())
+    if status not in STATUSES:
+        raise ValueError(f"Неизвестный статус: {value!r}")
+    return status
+
+
+def parse_date(value) -> str:
+    """
+    Дата в формате YYYY-MM-DD из date/datetime или строки
+    'YYYY-MM-DD' / 'ДД.ММ.ГГГГ'.
+    """
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    text = str(value or '').strip()
+    for fmt in ('%Y-%m-%d', '%d.%m.%Y'):
+        try:
+            return datetime.strptime(text, fmt).date().isoformat()
+        except ValueError:
+            pass
+    raise ValueError(f"Некорректная дата: {value!r}")
+
+
+def parse_time(value):
+    """
+    Время 'HH:MM' из time/datetime или строки 'H:MM'; None для пустого значения.
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, (datetime, time)):
+        return value.strftime('%H:%M')
+    text = str(value).strip()
+    try:
+        return datetime.strptime(text[:5] if len(text) == 8 else text, '%H:%M').strftime('%H:%M')
+    except ValueError:
+        raise ValueError(f"Некорректное время: {value!r}")
+
+
+def _optional_int(value, what):
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Некорректный {what}: {value!r}")
+
+
+def record_fields(data) -> dict:
+    """
+    Проверяет поля записи из JSON (dict) и возвращает словарь столбцов records
+    с рассчитанными часами. Обязательны date, machine_id, driver_id, status.
+    """
+    fields = {
+        'date': parse_date(data.get('date')),
+        'machine_id': _optional_int(data.get('machine_id'), 'machine_id'),
+        'driver_id': _optional_int(data.get('driver_id'), 'driver_id'),
+        'status': parse_status(data.get('status')),
+        'start_time': parse_time(data.get('start_time')),
+        'end_time': parse_time(data.get('end_time')),
+        'comment': str(data.get('comment') or ''),
+        'counterparty_id': _optional_int(data.get('counterparty_id'), 'counterparty_id'),
+    }
+    if fields['machine_id'] is None:
+        raise ValueError("Не указан machine_id")
+    if fields['driver_id'] is None:
+        raise ValueError("Не указан driver_id")
+    fields['hours'] = compute_hours(fields['start_time'], fields['end_time'])
+    return fields
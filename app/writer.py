@@ -0,0 +1,138 @@
+# app/writer.py
+
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future, TimeoutError as WriteTimeout
+
+from flask import current_app, g
+
+from .archive import get_cutoff, attach, is_attached
+from .database import get_db
+from . import changefeed
+
+# Единственный писатель: все записи из роутов идут через очередь в один поток
+# на процесс, который выполняет накопившиеся задания одной транзакцией
+# (group commit). Вместо N коротких транзакций, каждая из которых ждёт
+# блокировку записи SQLite и делает fsync, процесс берёт блокировку один раз
+# на пачку. Читатели остаются на своих соединениях из пула.
+#
+# Задание — функция fn(conn, *args): она не коммитит сама, а её ошибка
+# откатывает только её SAVEPOINT, не затрагивая соседей по пачке. Вызывающий
+# получает результат или исключение через Future — уже после COMMIT.
+#
+# Фоновые потоки процесса (писатель, опросчик changefeed, пул export_jobs)
+# запоминают pid, в котором запущены: с preload_app (gunicorn.conf.py)
+# приложение создаётся в мастере, а потоки при fork в воркеры не копируются.
+# Если pid не совпал или поток умер, поток запускается заново.
+
+# путь к базе -> (pid, очередь, поток)
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def _get_queue(app):
+    path = app.config['DATABASE']
+    with _writers_lock:
+        writer = _writers.get(path)
+        if writer is None or writer[0] != os.getpid() or not writer[2].is_alive():
+            jobs = queue.Queue()
+            thread = threading.Thread(target=_writer_loop, args=(app, jobs),
+                                      name='db-writer', daemon=True)
+            thread.start()
+            writer = _writers[path] = (os.getpid(), jobs, thread)
+        return writer[1]
+
+
+def _writer_loop(app, jobs):
+    batch_max = app.config['WRITE_BATCH_MAX']
+    while True:
+        batch = [jobs.get()]
+        # всё, что накопилось, пока шла предыдущая транзакция, — в одну пачку
+        while len(batch) < batch_max:
+            try:
+                batch.append(jobs.get_nowait())
+            except queue.Empty:
+                break
+        batch = [job for job in batch if job[2].set_running_or_notify_cancel()]
+        if batch:
+            with app.app_context():
+                _run_batch(get_db(), batch)
+            # живые страницы этого процесса узнают о коммите без ожидания опроса
+            changefeed.notify(app)
+
+
+def _run_batch(conn, batch):
+    done = []
+    try:
+        # ATTACH внутри транзакции невозможен — архив подключаем заранее
+        if get_cutoff(conn):
+            attach(conn)
+        conn.execute("BEGIN IMMEDIATE")
+        # граница архива могла сдвинуться до BEGIN (archive-records из CLI):
+        # задания проверяют закрытый период по значению, прочитанному под блокировкой
+        g.pop('_archive_cutoff', None)
+        if get_cutoff(conn) and not is_attached(conn):
+            # архив появился между чтением и BEGIN — подключаем и начинаем заново
+            conn.rollback()
+            attach(conn)
+            conn.execute("BEGIN IMMEDIATE")
+            g.pop('_archive_cutoff', None)
+        for fn, args, future in batch:
+            conn.execute("SAVEPOINT write_job")
+            try:
+                done.append((future, fn(conn, *args), None))
+                conn.execute("RELEASE write_job")
+            except Exception as e:
+                conn.execute("ROLLBACK TO write_job")
+                conn.execute("RELEASE write_job")
+                done.append((future, None, e))
+        conn.commit()
+    except Exception as e:
+        # сбой самой транзакции (блокировка, диск) — ошибка у всех заданий пачки
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            pass
+        for _, _, future in batch:
+            future.set_exception(e)
+        return
+    for future, result, error in done:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+
+def submit_write(fn, *args):
+    """
+    Ставит fn(conn, *args) в очередь писателя и возвращает Future.
+    При WRITE_QUEUE=False задание выполняется сразу на соединении запроса.
+    """
+    app = current_app._get_current_object()
+    future = Future()
+    if not app.config['WRITE_QUEUE']:
+        future.set_running_or_notify_cancel()
+        conn = get_db()
+        try:
+            result = fn(conn, *args)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+            changefeed.notify(app)
+        return future
+    _get_queue(app).put((fn, args, future))
+    return future
+
+
+def run_write(fn, *args):
+    """
+    Выполняет запись через писателя и ждёт результат (или пробрасывает ошибку задания).
+    WriteTimeout (concurrent.futures.TimeoutError; встроенный TimeoutError только
+    с Python 3.11) — результата нет за WRITE_TIMEOUT, задание ещё может выполниться.
+    """
+    return submit_write(fn, *args).result(timeout=current_app.config['WRITE_TIMEOUT'])
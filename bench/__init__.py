@@ -0,0 +1,7 @@
+# bench/__init__.py
+#
+# Нагрузочные замеры AN-30:
+#   python -m bench.generate --out bench.db --machines 50 --years 3
+#   python -m bench.harness --db bench.db --out before.json
+#   python -m bench.compare before.json after.json
+#   python -m bench.startup --db bench.db --out startup.json   # старт воркера
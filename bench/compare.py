@@ -0,0 +1,72 @@
+# bench/compare.py
+
+import argparse
+import json
+import sys
+
+# Сравнение двух прогонов bench.harness: изменение перцентилей, числа SQL
+# и памяти по каждому сценарию. Код возврата 1, если какой-то сценарий
+# замедлился сильнее порога — удобно для проверки перед слиянием.
+
+METRICS = ("p50_ms", "p90_ms", "db_p50_ms", "sql_statements", "peak_memory_kib")
+
+
+def _load(path):
+    with open(path, encoding='utf-8') as fh:
+        return json.load(fh)
+
+
+def _delta(old, new):
+    if old in (None, 0) or new is None:
+        return None
+    return (new - old) / old * 100
+
+
+def compare(base, head, metric="p50_ms", threshold=10.0):
+    """
+    Строки сравнения (сценарий, {метрика: (было, стало, %)}, регрессия?)
+    для сценариев, которые есть в обоих прогонах.
+    """
+    rows = []
+    for name, new in head['results'].items():
+        old = base['results'].get(name)
+        if old is None:
+            continue
+        values = {m: (old.get(m), new.get(m), _delta(old.get(m), new.get(m))) for m in METRICS}
+        change = values[metric][2]
+        rows.append((name, values, change is not None and change > threshold))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сравнение двух прогонов bench.harness")
+    parser.add_argument('base', help="JSON прогона «до»")
+    parser.add_argument('head', help="JSON прогона «после»")
+    parser.add_argument('--metric', default='p50_ms', choices=METRICS, help="метрика для порога регрессии")
+    parser.add_argument('--threshold', type=float, default=10.0, help="допустимое ухудшение, %%")
+    args = parser.parse_args(argv)
+
+    base, head = _load(args.base), _load(args.head)
+    print(f"до:    {base['meta'].get('git_revision')} {base['meta'].get('timestamp')}")
+    print(f"после: {head['meta'].get('git_revision')} {head['meta'].get('timestamp')}")
+    if base['meta'].get('db_rows') != head['meta'].get('db_rows'):
+        print("ВНИМАНИЕ: прогоны сделаны на разных базах")
+
+    rows = compare(base, head, args.metric, args.threshold)
+    print(f"{'сценарий':24} " + " ".join(f"{m:>28}" for m in METRICS))
+    for name, values, regressed in rows:
+        cells = []
+        for m in METRICS:
+            old, new, change = values[m]
+            pct = f"{change:+.1f}%" if change is not None else "—"
+            cells.append(f"{old!s:>9} → {new!s:>9} {pct:>6}")
+        print(f"{name:24} " + " ".join(cells) + ("  РЕГРЕССИЯ" if regressed else ""))
+
+    missing = sorted(set(base['results']) ^ set(head['results']))
+    if missing:
+        print("Есть только в одном прогоне: " + ", ".join(missing))
+    return 1 if any(r[2] for r in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+# bench/generate.py
+
+import argparse
+import os
+import random
+import sys
+from datetime import date, timedelta
+
+from app import create_app
+from app.database import init_db, get_db
+
+# Синтетический парк техники для замеров. При одинаковых параметрах и seed
+# база получается одинаковой, поэтому замеры разных версий кода сравнимы.
+
+STATUS_WEIGHTS = (("work", 70), ("stop", 12), ("repair", 10), ("holiday", 8))
+
+SHIFTS = (("08:00", "17:00"), ("08:00", "20:00"), ("20:00", "08:00"), ("09:00", "13:00"), (None, None))
+
+COMMENT_WORDS = ("насос", "гидравлика", "замена", "масла", "фильтр", "колесо", "погрузка", "рейс",
+                 "склад", "ремонт", "двигатель", "простой", "ожидание", "заказчика", "документы",
+                 "топливо", "доставка", "щебень", "песок", "трал", "кран", "стрела", "шина")
+
+SURNAMES = ("Иванов", "Петров", "Сидоров", "Смирнов", "Кузнецов", "Попов", "Васильев", "Соколов",
+            "Михайлов", "Новиков", "Фёдоров", "Морозов", "Волков", "Алексеев", "Лебедев", "Семёнов")
+
+
+def _names(prefix, count):
+    return [(i, f"{prefix} {i:03d}") for i in range(1, count + 1)]
+
+
+def _driver_names(rnd, count):
+    names = []
+    for i in range(1, count + 1):
+        initials = f"{rnd.choice('АБВГДЕИКЛМНОПРСТ')}.{rnd.choice('АБВГДЕИКЛМНОПРСТ')}."
+        names.append((i, f"{rnd.choice(SURNAMES)} {initials} #{i}"))
+    return names
+
+
+def _hours(start, end):
+    if not start or not end:
+        return 0
+    sh, sm = map(int, start.split(':'))
+    eh, em = map(int, end.split(':'))
+    minutes = (eh * 60 + em) - (sh * 60 + sm)
+    if minutes < 0:
+        minutes += 24 * 60
+    return round(minutes / 60)
+
+
+def generate_records(rnd, machines, drivers, counterparties, first_day, last_day, fill):
+    """
+    Записи по дням: у каждой техники в день 0–2 записи с вероятностью fill.
+    """
+    statuses = [s for s, w in STATUS_WEIGHTS for _ in range(w)]
+    day = first_day
+    while day <= last_day:
+        iso = day.isoformat()
+        for machine_id in range(1, machines + 1):
+            if rnd.random() > fill:
+                continue
+            for _ in range(1 if rnd.random() < 0.85 else 2):
+                status = rnd.choice(statuses)
+                start, end = rnd.choice(SHIFTS) if status == "work" else (None, None)
+                comment = " ".join(rnd.sample(COMMENT_WORDS, rnd.randint(0, 4)))
+                cpar = rnd.randint(1, counterparties) if status == "work" and rnd.random() < 0.8 else None
+                yield (iso, machine_id, rnd.randint(1, drivers), status, start, end,
+                       _hours(start, end), comment, cpar)
+        day += timedelta(days=1)
+
+
+def generate(path, machines=50, drivers=80, counterparties=30, years=3, end_year=2024,
+             fill=0.8, seed=1, batch_size=5000):
+    """
+    Создаёт базу path (существующий файл перезаписывается) и заполняет её.
+    Возвращает число записей.
+    """
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    rnd = random.Random(seed)
+    app = create_app({'DATABASE': os.path.abspath(path)})
+    with app.app_context():
+        init_db()
+        conn = get_db()
+        conn.executemany("INSERT INTO machines (id, name) VALUES (?, ?)", _names("Техника", machines))
+        conn.executemany("INSERT INTO drivers (id, name) VALUES (?, ?)", _driver_names(rnd, drivers))
+        conn.executemany("INSERT INTO counterparties (id, name) VALUES (?, ?)",
+                         _names("ООО Контрагент", counterparties))
+
+        first_day = date(end_year - years + 1, 1, 1)
+        last_day = date(end_year, 12, 31)
+        total = 0
+        batch = []
+        sql = '''INSERT INTO records (date, machine_id, driver_id, status, start_time, end_time,
+                                      hours, comment, counterparty_id)
+                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+        for row in generate_records(rnd, machines, drivers, counterparties, first_day, last_day, fill):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                conn.executemany(sql, batch)
+                total += len(batch)
+                batch.clear()
+        if batch:
+            conn.executemany(sql, batch)
+            total += len(batch)
+        conn.commit()
+        conn.execute("ANALYZE")
+        conn.commit()
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Генератор синтетической базы AN-30 для замеров")
+    parser.add_argument('--out', default='bench.db', help="файл базы (перезаписывается)")
+    parser.add_argument('--machines', type=int, default=50)
+    parser.add_argument('--drivers', type=int, default=80)
+    parser.add_argument('--counterparties', type=int, default=30)
+    parser.add_argument('--years', type=int, default=3, help="лет ежедневных записей")
+    parser.add_argument('--end-year', type=int, default=2024, help="последний год данных")
+    parser.add_argument('--fill', type=float, default=0.8, help="доля дней с записями у техники")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    total = generate(args.out, args.machines, args.drivers, args.counterparties,
+                     args.years, args.end_year, args.fill, args.seed)
+    print(f"{args.out}: техники {args.machines}, водителей {args.drivers}, "
+          f"контрагентов {args.counterparties}, записей {total}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,232 @@
+# bench/harness.py
+
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from urllib.parse import urlencode
+
+from app import create_app, calendar_cache, queries, refcache
+from app.metrics import request_stats
+from app.database import get_db
+from app.queries import SORTS, DEFAULT_SORT, encode_cursor, records_list_sql, order_sql
+
+# Прогон всех страниц через тестовый клиент Flask на базе из bench.generate.
+# Для каждого сценария: перцентили времени ответа, число SQL-команд и время БД
+# на запрос (счётчики app.sqltrace) и пик памяти Python (tracemalloc).
+# Результат — JSON, который сравнивает bench.compare.
+
+# Счётчики SQL последнего запроса
+_last_stats = {}
+
+
+def _capture_stats(response):
+    _last_stats.clear()
+    _last_stats.update(request_stats() or {})
+    return response
+
+
+def _url(path, **args):
+    return f"{path}?{urlencode(args)}" if args else path
+
+
+def build_scenarios(conn):
+    """
+    Список (имя, url, повторов-множитель) по данным базы: берутся реальные
+    id и диапазон дат, чтобы запросы что-то находили.
+    """
+    first, last = conn.execute("SELECT MIN(date), MAX(date) FROM records").fetchone()
+    last_year, last_month = int(last[:4]), int(last[5:7])
+    first_year, first_month = int(first[:4]), int(first[5:7])
+    machine_id = conn.execute("SELECT MIN(id) FROM machines").fetchone()[0]
+    driver_id = conn.execute("SELECT MIN(id) FROM drivers").fetchone()[0]
+    cparty_id = conn.execute("SELECT MIN(id) FROM counterparties").fetchone()[0]
+    month_from = f"{last[:7]}-01"
+
+    scenarios = [
+        ("index", "/", 1),
+        ("calendar_last_month", _url(f"/calendar/{machine_id}", year=last_year, month=last_month), 1),
+        ("calendar_first_month", _url(f"/calendar/{machine_id}", year=first_year, month=first_month), 1),
+        ("calendar_fleet", _url("/calendar", year=last_year, month=last_month), 1),
+        ("reports_machine", _url("/reports", year=last_year, kind="machine"), 1),
+        ("heatmap_machine", _url("/api/v1/heatmap", year=last_year, machine=machine_id), 1),
+        ("heatmap_fleet", _url("/api/v1/heatmap", year=last_year), 1),
+        ("admin_machines", "/admin/machines", 1),
+        ("admin_records", "/admin/records", 1),
+        ("filter_date_range", _url("/admin/records", date_from=month_from, date_to=last), 1),
+        ("filter_machine", _url("/admin/records", mach=machine_id), 1),
+        ("filter_driver", _url("/admin/records", driv=driver_id), 1),
+        ("filter_counterparty", _url("/admin/records", cpar=cparty_id), 1),
+        ("filter_status", _url("/admin/records", status="repair"), 1),
+        ("filter_comment", _url("/admin/records", comment_sub="насос"), 1),
+        ("filter_combined", _url("/admin/records", mach=machine_id, status="work",
+                                 date_from=month_from, date_to=last), 1),
+        ("api_records", _url("/api/v1/records", limit=100), 1),
+    ]
+    for sort_key in SORTS:
+        args = {'sort': sort_key}
+        if sort_key == 'relevance':
+            args['comment_sub'] = "насос"
+        scenarios.append((f"sort_{sort_key}", _url("/admin/records", **args), 1))
+
+    # Глубокая страница: через OFFSET (старые ссылки ?page=N) и через курсор
+    total = conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+    deep = max(total // 2, 0)
+    page = deep // 10 + 1
+    scenarios.append(("deep_page_offset", _url("/admin/records", page=page), 1))
+    select_sql, _ = records_list_sql({'sort': DEFAULT_SORT})
+    row = conn.execute(f"{select_sql} {order_sql(DEFAULT_SORT)} LIMIT 1 OFFSET ?", (deep,)).fetchone()
+    if row:
+        scenarios.append(("deep_page_keyset",
+                          _url("/admin/records", page=page, after=encode_cursor(DEFAULT_SORT, row)), 1))
+
+    # Выгрузки тяжёлые — повторяем их реже
+    scenarios.append(("export_all", "/export", 0.2))
+    scenarios.append(("export_filtered", _url("/export", export="filtered", mach=machine_id), 0.5))
+    scenarios.append(("export_all_csv", _url("/export", format="csv"), 0.2))
+    scenarios.append(("export_all_ndjson", _url("/export", format="ndjson"), 0.2))
+    scenarios.append(("export_analytics", _url("/export", format="analytics"), 0.5))
+    return scenarios
+
+
+def percentile(values, q):
+    """
+    Перцентиль q (0..100) методом ближайшего ранга.
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(int(round(q / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def _clear_caches():
+    with calendar_cache._lock:
+        calendar_cache._memory.clear()
+    with queries._count_lock:
+        queries._count_cache.clear()
+    with refcache._lock:
+        refcache._cache.clear()
+
+
+def _request(client, url, cold):
+    if cold:
+        _clear_caches()
+    t0 = time.perf_counter()
+    response = client.get(url)
+    response.get_data()
+    elapsed = time.perf_counter() - t0
+    response.close()
+    if response.status_code != 200:
+        raise RuntimeError(f"{url}: HTTP {response.status_code}")
+    return elapsed * 1000, dict(_last_stats)
+
+
+def run_scenario(client, url, repeat, warmup, cold):
+    for _ in range(warmup):
+        _request(client, url, cold)
+
+    timings = []
+    db_timings = []
+    counts = None
+    for _ in range(repeat):
+        ms, counts = _request(client, url, cold)
+        timings.append(ms)
+        db_timings.append(counts.get('db_time', 0.0) * 1000)
+
+    # Память меряем отдельным запросом: tracemalloc сильно замедляет выполнение
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        _request(client, url, cold)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'url': url,
+        'repeat': repeat,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p90_ms': round(percentile(timings, 90), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'mean_ms': round(sum(timings) / len(timings), 3),
+        'max_ms': round(max(timings), 3),
+        'db_p50_ms': round(percentile(db_timings, 50), 3),
+        'sql_statements': counts.get('statements', 0),
+        'sql_trigger_statements': counts.get('trigger_statements', 0),
+        'peak_memory_kib': round(peak / 1024, 1),
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(db_path, repeat=20, warmup=2, cold=False, only=None):
+    app = create_app({'DATABASE': os.path.abspath(db_path), 'TESTING': True, 'SQL_INSTRUMENTATION': True})
+    app.after_request(_capture_stats)
+    client = app.test_client()
+
+    with app.app_context():
+        conn = get_db()
+        scenarios = build_scenarios(conn)
+        db_stats = {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+                    for t in ("machines", "drivers", "counterparties", "records")}
+
+    results = {}
+    for name, url, factor in scenarios:
+        if only and not any(part in name for part in only):
+            continue
+        results[name] = run_scenario(client, url, max(int(repeat * factor), 1), warmup, cold)
+        r = results[name]
+        print(f"{name:24} p50 {r['p50_ms']:9.2f} ms  p90 {r['p90_ms']:9.2f} ms  "
+              f"sql {r['sql_statements']:4}  mem {r['peak_memory_kib']:10.1f} KiB", file=sys.stderr)
+
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'git_revision': _git_revision(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'database': os.path.basename(db_path),
+            'db_rows': db_stats,
+            'repeat': repeat,
+            'warmup': warmup,
+            'cold_caches': cold,
+        },
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры страниц AN-30 через тестовый клиент Flask")
+    parser.add_argument('--db', default='bench.db', help="база из bench.generate")
+    parser.add_argument('--out', default='bench-results.json', help="куда записать JSON с результатами")
+    parser.add_argument('--repeat', type=int, default=20, help="замеров на сценарий")
+    parser.add_argument('--warmup', type=int, default=2, help="прогревочных запросов на сценарий")
+    parser.add_argument('--cold', action='store_true', help="сбрасывать кэши приложения перед каждым запросом")
+    parser.add_argument('--only', nargs='*', help="только сценарии, в имени которых есть эти подстроки")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        parser.error(f"нет базы {args.db}: создайте её через python -m bench.generate")
+    report = run(args.db, args.repeat, args.warmup, args.cold, args.only)
+    with open(args.out, 'w', encoding='utf-8') as fh:
+        json.dump(report, fh, ensure_ascii=False, indent=2)
+    print(f"Результаты: {args.out}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
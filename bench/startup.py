@@ -0,0 +1,108 @@
+# bench/startup.py
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+
+from bench.harness import percentile, _git_revision
+
+# Время старта воркера: импорт пакета, create_app() и первый запрос.
+# Каждый замер — отдельный процесс python, чтобы импорты не были закэшированы
+# в sys.modules. Результат в том же формате, что у bench.harness, поэтому
+# два прогона сравнивает bench.compare.
+
+# Модули, которые не должны загружаться при старте (импортируются лениво)
+HEAVY_MODULES = ("openpyxl",)
+
+# Выполняется в дочернем процессе; печатает JSON с замерами
+CHILD = '''
+import json, sys, time
+t0 = time.perf_counter()
+from app import create_app
+t1 = time.perf_counter()
+app = create_app({"DATABASE": sys.argv[1], "TESTING": True})
+t2 = time.perf_counter()
+client = app.test_client()
+response = client.get(sys.argv[2])
+response.get_data()
+t3 = time.perf_counter()
+print(json.dumps({
+    "import_app": (t1 - t0) * 1000,
+    "create_app": (t2 - t1) * 1000,
+    "first_request": (t3 - t2) * 1000,
+    "boot_total": (t3 - t0) * 1000,
+    "status": response.status_code,
+    "loaded": [m for m in sys.argv[3:] if m in sys.modules],
+}))
+'''
+
+STEPS = ("import_app", "create_app", "first_request", "boot_total")
+
+
+def measure_once(db_path, url):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run([sys.executable, "-c", CHILD, db_path, url, *HEAVY_MODULES],
+                         capture_output=True, text=True, cwd=root, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def run(db_path, repeat=10, url="/"):
+    samples = [measure_once(os.path.abspath(db_path), url) for _ in range(repeat)]
+    statuses = {s['status'] for s in samples}
+    if statuses != {200}:
+        raise RuntimeError(f"{url}: HTTP {sorted(statuses)}")
+
+    results = {}
+    for step in STEPS:
+        timings = [s[step] for s in samples]
+        results[f"startup_{step}"] = {
+            'url': url,
+            'repeat': repeat,
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p90_ms': round(percentile(timings, 90), 3),
+            'max_ms': round(max(timings), 3),
+        }
+        r = results[f"startup_{step}"]
+        print(f"{step:16} p50 {r['p50_ms']:9.2f} ms  p90 {r['p90_ms']:9.2f} ms", file=sys.stderr)
+
+    loaded = sorted({m for s in samples for m in s['loaded']})
+    if loaded:
+        print("ВНИМАНИЕ: при старте загружены тяжёлые модули: " + ", ".join(loaded), file=sys.stderr)
+
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'git_revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'database': os.path.basename(db_path),
+            'repeat': repeat,
+            'heavy_modules_at_boot': loaded,
+        },
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замер старта воркера AN-30: импорт, create_app, первый запрос")
+    parser.add_argument('--db', default='bench.db', help="база из bench.generate")
+    parser.add_argument('--out', default='bench-startup.json', help="куда записать JSON с результатами")
+    parser.add_argument('--repeat', type=int, default=10, help="запусков процесса")
+    parser.add_argument('--url', default='/', help="первый запрос")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        parser.error(f"нет базы {args.db}: создайте её через python -m bench.generate")
+    report = run(args.db, args.repeat, args.url)
+    with open(args.out, 'w', encoding='utf-8') as fh:
+        json.dump(report, fh, ensure_ascii=False, indent=2)
+    print(f"Результаты: {args.out}", file=sys.stderr)
+    return 1 if report['meta']['heavy_modules_at_boot'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,21 @@
+# gunicorn.conf.py
+
+import os
+
+# Настройки gunicorn; файл подхватывается автоматически при запуске из корня
+# проекта: `gunicorn run:app`.
+#
+# Воркеры gthread: каждый запрос — поток воркера, а не весь воркер. Это нужно
+# живым страницам: подписчик /events держит поток до SSE_MAX_AGE секунд, и
+# с sync-воркерами каждый открытый календарь занимал бы целый процесс.
+# Простаивающий подписчик ждёт на Condition ленты изменений и не держит
+# соединение с базой, поэтому потоков может быть много больше SQLITE_POOL_SIZE.
+# Подписчиков на воркер не больше SSE_MAX_SUBSCRIBERS (create_app) — держите
+# его заметно меньше threads, иначе открытые вкладки займут все потоки.
+
+bind = os.environ.get('AN30_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('AN30_WORKERS', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('AN30_THREADS', 64))  # одновременных запросов и подписчиков на воркер
+preload_app = True
+timeout = 30
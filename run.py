@@ -1,12 +1,11 @@
 # run.py
 
-from app import app
-from app.database import init_db
+from app import create_app
 
-if __name__ == '__main__':
-    # Создаём контекст приложения, чтобы корректно вызвать init_db()
-    with app.app_context():
-        init_db()
+# Точка входа для gunicorn: `gunicorn run:app` (настройки — gunicorn.conf.py).
+# Схему базы создаёт отдельная команда: `flask --app app init-db`.
+app = create_app()
 
-    # Запускаем Flask-приложение
+if __name__ == '__main__':
+    # Запускаем Flask-приложение (сервер разработки)
     app.run(host='0.0.0.0', port=5000, debug=True)
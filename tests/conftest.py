@@ -0,0 +1,33 @@
+# tests/conftest.py
+
+import pytest
+
+from app import create_app
+from app.database import init_db
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'DATABASE': str(tmp_path / 'test.db'),
+        'EXPORT_CACHE_DIR': str(tmp_path / 'export_cache'),
+    })
+    with app.app_context():
+        init_db()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def refs(client):
+    """
+    Одна техника, один водитель, один контрагент (все с id=1).
+    """
+    client.post('/admin/machines', data={'name': 'Экскаватор'})
+    client.post('/admin/drivers', data={'name': 'Иванов'})
+    client.post('/admin/counterparties', data={'name': 'ООО Ромашка'})
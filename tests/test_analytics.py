@@ -0,0 +1,40 @@
+# tests/test_analytics.py
+
+import io
+
+from openpyxl import load_workbook
+
+from tests.test_export_jobs import _wait_done
+
+
+def _add(client, day):
+    client.post('/admin/records', data={'date': day, 'machine_id': 1, 'driver_id': 1, 'status': 'work',
+                                        'start_time': '08:00', 'end_time': '17:00'})
+
+
+def _detail_dates(data):
+    ws = load_workbook(io.BytesIO(data), read_only=True)['AN-30 Отчёт']
+    return [row[0] for row in ws.iter_rows(min_row=2, values_only=True)]
+
+
+def test_detail_sheet_covers_analytics_period(client, refs):
+    _add(client, '2024-02-10')
+    _add(client, '2024-03-10')
+    response = client.get('/export?format=analytics&detail=1&date_from=2024-03-01&date_to=2024-03-31')
+    assert response.status_code == 200
+    assert _detail_dates(response.get_data()) == ['10.03.2024']
+
+
+def test_analytics_job_builds_analytics_workbook(client, refs):
+    _add(client, '2024-03-10')
+    job = _wait_done(client, client.post('/export/jobs?format=analytics&detail=1').get_json())
+    assert job['status'] == 'done', job
+    response = client.get(job['download_url'])
+    assert 'analytics_' in response.headers['Content-Disposition']
+    wb = load_workbook(io.BytesIO(response.get_data()), read_only=True)
+    assert 'Техника по месяцам' in wb.sheetnames and 'AN-30 Отчёт' in wb.sheetnames
+
+    plain = _wait_done(client, client.post('/export/jobs').get_json())
+    assert plain['job_id'] != job['job_id']
+    wb = load_workbook(io.BytesIO(client.get(plain['download_url']).get_data()), read_only=True)
+    assert 'Техника по месяцам' not in wb.sheetnames
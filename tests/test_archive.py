@@ -0,0 +1,95 @@
+# tests/test_archive.py
+
+from app.archive import ARCHIVE_SCHEMA, archive_records, attach, _create_archive_schema, _copy_to_archive
+from app.database import get_db
+
+
+def _add(client, day):
+    response = client.post('/admin/records', data={'date': day, 'machine_id': 1, 'driver_id': 1,
+                                                   'status': 'repair'})
+    assert response.status_code == 302
+
+
+def test_record_deleted_after_interrupted_run_is_not_archived(app, client, refs):
+    _add(client, '2024-01-01')  # id 1
+    _add(client, '2024-01-02')  # id 2
+
+    # прерванный перенос: копия в архиве есть, граница не сдвинута
+    with app.app_context():
+        conn = get_db()
+        attach(conn)
+        _create_archive_schema(conn)
+        conn.execute("BEGIN")
+        _copy_to_archive(conn, '2024-02-01')
+        conn.commit()
+
+    # запись удаляется, её id достаётся новой записи за открытый период
+    assert client.post('/delete/record/1').status_code == 302
+    _add(client, '2024-12-30')
+
+    with app.app_context():
+        conn = get_db()
+        assert archive_records(conn, '2024-02-01') == 1
+        archived = conn.execute(f"SELECT id, date FROM {ARCHIVE_SCHEMA}.records ORDER BY id").fetchall()
+        main = conn.execute("SELECT id, date FROM main.records ORDER BY id").fetchall()
+    assert [tuple(r) for r in archived] == [(2, '2024-01-02')]
+    assert [tuple(r) for r in main] == [(1, '2024-12-30')]
+
+    item = client.get('/api/v1/records/1').get_json()
+    assert item['date'] == '2024-12-30'
+    items = client.get('/api/v1/records?archive=1&limit=10').get_json()['items']
+    assert sorted(i['id'] for i in items) == [1, 2]
+
+
+def test_record_moved_past_cutoff_is_not_archived(app, client, refs):
+    _add(client, '2024-01-01')  # id 1
+
+    with app.app_context():
+        conn = get_db()
+        attach(conn)
+        _create_archive_schema(conn)
+        conn.execute("BEGIN")
+        _copy_to_archive(conn, '2024-02-01')
+        conn.commit()
+
+    # дату записи перенесли за границу между шагами переноса
+    response = client.post('/edit/record/1', data={'date': '2024-03-01', 'machine_id': 1,
+                                                   'driver_id': 1, 'status': 'repair'})
+    assert response.status_code == 302
+
+    with app.app_context():
+        conn = get_db()
+        assert archive_records(conn, '2024-02-01') == 0
+        assert conn.execute(f"SELECT COUNT(*) FROM {ARCHIVE_SCHEMA}.records").fetchone()[0] == 0
+
+
+def _archive_january(app, client):
+    _add(client, '2024-01-15')
+    _add(client, '2024-12-15')
+    with app.app_context():
+        assert archive_records(get_db(), '2024-02-01') == 1
+
+
+def test_filtered_list_without_date_from_reads_archive(app, client, refs):
+    _archive_january(app, client)
+
+    html = client.get('/admin/records?mach=1').get_data(as_text=True)
+    assert '15.01.2024' in html and '15.12.2024' in html
+
+    # без фильтров страница остаётся на рабочей базе, архив — по ссылке
+    html = client.get('/admin/records').get_data(as_text=True)
+    assert '15.01.2024' not in html and '15.12.2024' in html
+    html = client.get('/admin/records?archive=1').get_data(as_text=True)
+    assert '15.01.2024' in html
+
+
+def test_filtered_export_and_api_without_date_from_read_archive(app, client, refs):
+    _archive_january(app, client)
+
+    text = client.get('/export?export=filtered&mach=1&format=csv').get_data(as_text=True)
+    assert '2024-01-15' in text and '2024-12-15' in text
+
+    items = client.get('/api/v1/records?mach=1&limit=10').get_json()['items']
+    assert sorted(i['date'] for i in items) == ['2024-01-15', '2024-12-15']
+    items = client.get('/api/v1/records?date_to=2024-01-31&limit=10').get_json()['items']
+    assert [i['date'] for i in items] == ['2024-01-15']
@@ -0,0 +1,32 @@
+# tests/test_backup.py
+
+import sqlite3
+
+from app.database import get_db
+
+
+def test_backup_while_database_is_open(app, client, refs, tmp_path):
+    response = client.post('/admin/records', data={'date': '2024-05-01', 'machine_id': 1,
+                                                   'driver_id': 1, 'status': 'work', 'hours': 8})
+    assert response.status_code == 302
+
+    dest = tmp_path / 'backup.db'
+    # другой процесс держит базу открытой посреди читающей транзакции
+    other = sqlite3.connect(app.config['DATABASE'])
+    other.execute("BEGIN")
+    other.execute("SELECT COUNT(*) FROM records").fetchone()
+    try:
+        result = app.test_cli_runner().invoke(args=['backup', str(dest)])
+    finally:
+        other.close()
+    assert result.exit_code == 0, result.output
+
+    copy = sqlite3.connect(dest)
+    try:
+        assert copy.execute("PRAGMA integrity_check").fetchone()[0] == 'ok'
+        assert copy.execute("SELECT date, status FROM records").fetchall() == [('2024-05-01', 'work')]
+    finally:
+        copy.close()
+
+    with app.app_context():
+        assert get_db().execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
@@ -0,0 +1,76 @@
+# tests/test_changefeed.py
+
+import json
+import re
+
+import pytest
+
+from app.database import get_db
+from app.changefeed import get_change_seq
+
+
+@pytest.fixture
+def app(app):
+    app.config.update(CHANGEFEED_BUFFER=5, SSE_KEEPALIVE=0.05, SSE_MAX_AGE=0.2)
+    return app
+
+
+def _stream(client, url, **kwargs):
+    response = client.get(url, buffered=False, **kwargs)
+    assert response.mimetype == 'text/event-stream'
+    try:
+        return "".join(c.decode() if isinstance(c, bytes) else c for c in response.response)
+    finally:
+        response.close()
+
+
+def _reset_seq(text):
+    match = re.search(r"event: reset\ndata: (.*)\n", text)
+    return json.loads(match.group(1))['seq'] if match else None
+
+
+def test_reset_carries_current_seq_for_cached_page(app, client, refs):
+    client.post('/admin/machines', data={'name': 'Бульдозер'})
+    page = client.get('/calendar/1?year=2024&month=3')
+    since = int(re.search(r"subscribeChanges\('/events\?machine=1', (\d+)", page.get_data(as_text=True)).group(1))
+
+    # правки другой техники: странице они не важны, но уводят ленту дальше буфера
+    for i in range(8):
+        client.post('/admin/records', data={'date': f'2024-03-{i + 1:02d}', 'machine_id': 2,
+                                            'driver_id': 1, 'status': 'repair'})
+
+    # браузер переспрашивает страницу — 304, тот же HTML со старым seq
+    cached = client.get('/calendar/1?year=2024&month=3', headers={'If-None-Match': page.headers['ETag']})
+    assert cached.status_code == 304
+
+    seq = _reset_seq(_stream(client, f'/events?machine=1&since={since}'))
+    with app.app_context():
+        assert seq == get_change_seq(get_db())
+
+    # переподписка с seq из reset: без нового reset
+    assert _reset_seq(_stream(client, f'/events?machine=1&since={seq}')) is None
+
+
+def test_grid_fragment(client, refs):
+    client.post('/admin/records', data={'date': '2024-03-05', 'machine_id': 1, 'driver_id': 1,
+                                        'status': 'repair'})
+    html = client.get('/calendar/1/grid?year=2024&month=3').get_data(as_text=True)
+    assert html.startswith('<!-- app/templates/_calendar_grid.html -->')
+    assert 'data-day="2024-03-05"' in html and 'Иванов' in html
+
+
+def test_subscriber_cap(app, client):
+    app.config.update(SSE_MAX_SUBSCRIBERS=1, SSE_MAX_AGE=5)
+    first = client.get('/events', buffered=False)
+    assert first.status_code == 200
+
+    busy = client.get('/events')
+    assert busy.status_code == 503
+    assert busy.headers['Retry-After'] == str(app.config['SSE_RETRY_AFTER'])
+    assert busy.get_data(as_text=True).startswith('retry: ')
+
+    # закрытый поток освобождает место
+    first.close()
+    again = client.get('/events', buffered=False)
+    assert again.status_code == 200
+    again.close()
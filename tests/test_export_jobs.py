@@ -0,0 +1,56 @@
+# tests/test_export_jobs.py
+
+import time
+
+
+def _wait_done(client, job):
+    deadline = time.monotonic() + 30
+    while job['status'] == 'pending' and time.monotonic() < deadline:
+        time.sleep(0.05)
+        job = client.get(job['status_url']).get_json()
+    return job
+
+
+def test_download_finished_job(client, refs):
+    client.post('/admin/records', data={'date': '2024-03-01', 'machine_id': 1, 'driver_id': 1,
+                                        'status': 'work', 'start_time': '08:00', 'end_time': '17:00'})
+    response = client.post('/export/jobs')
+    assert response.status_code == 202
+    job = _wait_done(client, response.get_json())
+    assert job['status'] == 'done', job
+
+    response = client.get(job['download_url'])
+    assert response.status_code == 200
+    assert response.mimetype.endswith('spreadsheetml.sheet')
+    disposition = response.headers['Content-Disposition']
+    assert 'attachment' in disposition and 'report_' in disposition and '.xlsx' in disposition
+    assert response.get_data()[:2] == b'PK'  # xlsx — zip-архив
+
+
+def test_download_unknown_job(client):
+    assert client.get('/export/jobs/deadbeef/download').status_code == 404
+
+
+def test_job_respects_format(client, refs):
+    client.post('/admin/records', data={'date': '2024-03-01', 'machine_id': 1, 'driver_id': 1,
+                                        'status': 'work', 'start_time': '08:00', 'end_time': '17:00'})
+    xlsx = _wait_done(client, client.post('/export/jobs').get_json())
+    csv = _wait_done(client, client.post('/export/jobs?format=csv').get_json())
+    ndjson = _wait_done(client, client.post('/export/jobs', data={'format': 'ndjson'}).get_json())
+
+    response = client.get(csv['download_url'])
+    assert response.status_code == 200 and response.mimetype == 'text/csv'
+    assert '.csv' in response.headers['Content-Disposition']
+    assert '2024-03-01' in response.get_data().decode('utf-8-sig')
+
+    response = client.get(ndjson['download_url'])
+    assert '.ndjson' in response.headers['Content-Disposition']
+    assert b'"date": "2024-03-01"' in response.get_data()
+
+    assert client.get(xlsx['download_url']).get_data()[:2] == b'PK'
+
+
+def test_unknown_job_format_is_rejected(client):
+    response = client.post('/export/jobs?format=pdf')
+    assert response.status_code == 400
+    assert 'pdf' in response.get_json()['error']
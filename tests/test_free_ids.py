@@ -0,0 +1,81 @@
+# tests/test_free_ids.py
+
+from app.archive import archive_records
+from app.database import get_db, get_next_free_id
+
+
+def _add(client, day='2024-05-01'):
+    response = client.post('/admin/records', data={'date': day, 'machine_id': 1, 'driver_id': 1,
+                                                   'status': 'repair'})
+    assert response.status_code == 302
+
+
+def _ids(app):
+    with app.app_context():
+        return [r[0] for r in get_db().execute("SELECT id FROM records ORDER BY id")]
+
+
+def test_lowest_freed_id_is_reused(app, client, refs):
+    for _ in range(5):
+        _add(client)
+    client.post('/delete/record/4')
+    client.post('/delete/record/2')
+
+    _add(client)
+    assert _ids(app) == [1, 2, 3, 5]
+    _add(client)
+    _add(client)
+    assert _ids(app) == [1, 2, 3, 4, 5, 6]
+
+
+def test_ids_after_bulk_delete(app, client, refs):
+    for _ in range(6):
+        _add(client)
+    with app.app_context():
+        conn = get_db()
+        conn.execute("DELETE FROM records WHERE id >= 3")
+        conn.commit()
+        assert get_next_free_id(conn, 'records') == 3
+        assert conn.execute("SELECT id FROM free_ids WHERE tbl='records' ORDER BY id").fetchall() == \
+            [(3,), (4,), (5,), (6,)]
+        conn.execute("DELETE FROM records")
+        conn.commit()
+        assert get_next_free_id(conn, 'records') == 1
+
+    _add(client)
+    _add(client)
+    assert _ids(app) == [1, 2]
+    with app.app_context():
+        free = get_db().execute("SELECT id FROM free_ids WHERE tbl='records' ORDER BY id").fetchall()
+    assert free == [(3,), (4,), (5,), (6,)]
+
+
+def test_archived_ids_are_not_reused(app, client, refs):
+    _add(client, '2024-01-10')  # id 1
+    _add(client, '2024-01-11')  # id 2
+    _add(client, '2024-12-10')  # id 3
+    with app.app_context():
+        assert archive_records(get_db(), '2024-02-01') == 2
+
+    _add(client, '2024-12-11')
+    assert _ids(app) == [3, 4]
+
+    client.post('/delete/record/3')
+    _add(client, '2024-12-12')
+    _add(client, '2024-12-13')
+    assert _ids(app) == [3, 4, 5]
+    with app.app_context():
+        free = get_db().execute("SELECT id FROM free_ids WHERE tbl='records'").fetchall()
+    assert free == []
+
+
+def test_floor_when_everything_is_archived(app, client, refs):
+    _add(client, '2024-01-10')  # id 1
+    _add(client, '2024-01-11')  # id 2
+    with app.app_context():
+        conn = get_db()
+        assert archive_records(conn, '2024-02-01') == 2
+        # рабочая таблица пуста: MAX(id)+1 не опускается ниже id_floors
+        assert get_next_free_id(conn, 'records') == 3
+    _add(client, '2024-12-10')
+    assert _ids(app) == [3]
@@ -0,0 +1,20 @@
+# tests/test_heatmap.py
+
+from app import api
+
+
+def test_fleet_heatmap_is_paged(client, monkeypatch):
+    monkeypatch.setattr(api, 'HEATMAP_MAX_MACHINES', 2)
+    for name in ('Бульдозер', 'Грейдер', 'Каток'):
+        client.post('/admin/machines', data={'name': name})
+
+    page = client.get('/api/v1/heatmap?year=2024').get_json()
+    assert [m['name'] for m in page['machines']] == ['Бульдозер', 'Грейдер']
+    assert page['next_offset'] == 2
+
+    page = client.get(f"/api/v1/heatmap?year=2024&offset={page['next_offset']}").get_json()
+    assert [m['name'] for m in page['machines']] == ['Каток']
+    assert page['next_offset'] is None
+
+    response = client.get('/api/v1/heatmap?year=2024&machine=1,2,3')
+    assert response.status_code == 400
@@ -0,0 +1,90 @@
+# tests/test_importer.py
+
+import io
+import sqlite3
+
+from app import importer
+from app.writer import WriteTimeout
+from app.database import get_db
+from app.importer import import_records, read_csv
+
+CSV = '''Дата;Техника;Водитель;Статус
+2024-05-01;Экскаватор;Иванов;work
+2024-05-02;Экскаватор;Иванов;work
+2024-05-03;Экскаватор;Иванов;stop
+2024-05-03;Экскаватор;Иванов;stop
+2024-05-04;Нет такой;Иванов;work
+'''.encode('utf-8')
+
+
+def test_import_writes_each_batch_through_writer(app, refs, monkeypatch):
+    calls = []
+
+    def run_write(fn, *args):
+        calls.append(len(args[0]))
+        return real_run_write(fn, *args)
+
+    real_run_write = importer.run_write
+    monkeypatch.setattr(importer, 'run_write', run_write)
+    with app.app_context():
+        result = import_records(get_db(), read_csv(io.BytesIO(CSV)), batch_size=2)
+        count = get_db().execute("SELECT COUNT(*) FROM records").fetchone()[0]
+    assert calls == [2, 2]
+    assert (result.inserted, result.duplicates, count) == (3, 1, 3)
+    assert [line_no for line_no, _ in result.errors] == [6]
+
+
+def test_import_stops_on_write_timeout(app, refs, monkeypatch):
+    def run_write(fn, *args):
+        raise WriteTimeout()
+
+    monkeypatch.setattr(importer, 'run_write', run_write)
+    with app.app_context():
+        result = import_records(get_db(), read_csv(io.BytesIO(CSV)), batch_size=2)
+    assert result.inserted == 0
+    assert [line_no for line_no, _ in result.errors] == [2]
+    assert (1, '2024-05-02') in result.touched
+
+
+def test_import_stops_on_write_error(app, refs, monkeypatch):
+    evicted = []
+    monkeypatch.setattr(importer.calendar_cache, 'evict_records', lambda touched: evicted.extend(touched))
+    real_run_write = importer.run_write
+
+    def run_write(fn, *args):
+        if args[0][0][0] > 2:
+            raise sqlite3.OperationalError("disk I/O error")
+        return real_run_write(fn, *args)
+
+    monkeypatch.setattr(importer, 'run_write', run_write)
+    with app.app_context():
+        result = import_records(get_db(), read_csv(io.BytesIO(CSV)), batch_size=1)
+    assert result.inserted == 1
+    line_no, message = result.errors[-1]
+    assert line_no == 3 and 'disk I/O error' in message
+    assert (1, '2024-05-01') in evicted and (1, '2024-05-02') in evicted
+
+
+def test_import_stops_on_unreadable_file(app, refs):
+    def broken():
+        for i, row in enumerate(read_csv(io.BytesIO(CSV))):
+            if i == 2:
+                raise UnicodeDecodeError('utf-8', b'\xff', 0, 1, 'invalid start byte')
+            yield row
+
+    with app.app_context():
+        result = import_records(get_db(), broken(), batch_size=10)
+        count = get_db().execute("SELECT COUNT(*) FROM records").fetchone()[0]
+    # проверенные до обрыва строки загружены
+    assert (result.inserted, count) == (2, 2)
+    assert result.errors[-1][0] == 4
+
+
+def test_import_rejects_deleted_reference(app, client, refs):
+    client.post('/admin/machines', data={'name': 'Бульдозер'})
+    assert client.post('/delete/machine/2').status_code == 302
+    data = 'Дата;Техника;Водитель;Статус\n2024-05-01;Бульдозер;Иванов;work\n'.encode('utf-8')
+    with app.app_context():
+        result = import_records(get_db(), read_csv(io.BytesIO(data)))
+    assert result.inserted == 0
+    assert result.errors == [(2, "Техника удалён(а) из справочника: Бульдозер")]
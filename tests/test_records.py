@@ -0,0 +1,28 @@
+# tests/test_records.py
+
+from app import routes
+from app.writer import WriteTimeout
+
+
+def _timeout(*args):
+    raise WriteTimeout()
+
+
+def test_insert_write_timeout_is_reported(client, refs, monkeypatch):
+    monkeypatch.setattr(routes, 'run_write', _timeout)
+    response = client.post('/admin/records', data={'date': '2024-05-01', 'machine_id': 1,
+                                                   'driver_id': 1, 'status': 'work'})
+    assert response.status_code == 302
+    with client.session_transaction() as session:
+        assert ('error', routes.WRITE_PENDING_MESSAGE) in session['_flashes']
+
+
+def test_edit_write_timeout_is_reported(client, refs, monkeypatch):
+    client.post('/admin/records', data={'date': '2024-05-01', 'machine_id': 1,
+                                        'driver_id': 1, 'status': 'work'})
+    monkeypatch.setattr(routes, 'run_write', _timeout)
+    response = client.post('/edit/record/1', data={'date': '2024-05-02', 'machine_id': 1,
+                                                   'driver_id': 1, 'status': 'work'})
+    assert response.status_code == 302
+    with client.session_transaction() as session:
+        assert ('error', routes.WRITE_PENDING_MESSAGE) in session['_flashes']
@@ -0,0 +1,83 @@
+# tests/test_usage.py
+
+from app.archive import ARCHIVE_RECORDS_SQL, archive_records, attach, get_cutoff
+from app.database import USAGE_KINDS, get_db
+
+# Агрегаты, посчитанные заново по записям (вместе с архивом — usage_daily его не теряет)
+DAILY_SQL = '''
+    SELECT '{kind}', {column}, date, status, SUM(IFNULL(hours, 0)), COUNT(*)
+      FROM {source}
+     WHERE {column} IS NOT NULL
+     GROUP BY {column}, date, status
+'''
+
+MONTHLY_SQL = '''
+    SELECT '{kind}', {column}, substr(date, 1, 7), status,
+           SUM(IFNULL(hours, 0)), COUNT(*), COUNT(DISTINCT date)
+      FROM {source}
+     WHERE {column} IS NOT NULL
+     GROUP BY {column}, substr(date, 1, 7), status
+'''
+
+
+def _assert_usage_matches(app):
+    with app.app_context():
+        conn = get_db()
+        source, pr = "records", []
+        cutoff = get_cutoff(conn)
+        if cutoff:
+            attach(conn)
+            source, pr = ARCHIVE_RECORDS_SQL, [cutoff]
+        for table, sql in (("usage_daily", DAILY_SQL), ("usage_monthly", MONTHLY_SQL)):
+            expected = set()
+            for kind, column in USAGE_KINDS:
+                expected.update(tuple(r) for r in conn.execute(
+                    sql.format(kind=kind, column=column, source=source), pr))
+            actual = {tuple(r) for r in conn.execute(f"SELECT * FROM {table}")}
+            assert actual == expected, table
+
+
+def _record(day, machine_id=1, start='08:00', end='17:00', status='work'):
+    return {'date': day, 'machine_id': machine_id, 'driver_id': 1, 'counterparty_id': 1,
+            'status': status, 'start_time': start, 'end_time': end}
+
+
+def _edit(client, rec_id, data):
+    response = client.post(f'/edit/record/{rec_id}', data=data)
+    assert response.headers['Location'].endswith('/admin/records')  # не вернули на форму с ошибкой
+
+
+def test_usage_follows_every_write(app, client, refs):
+    client.post('/admin/machines', data={'name': 'Бульдозер'})
+
+    client.post('/admin/records', data=_record('2024-01-10'))                     # id 1
+    client.post('/admin/records', data=_record('2024-01-10', start='18:00', end='20:00'))
+    client.post('/admin/records', data=_record('2024-03-05', machine_id=2))        # id 3
+    _assert_usage_matches(app)
+
+    # часы, техника, дата (в другой месяц) и статус
+    _edit(client, 1, _record('2024-01-10', start='08:00', end='12:00'))
+    _assert_usage_matches(app)
+    _edit(client, 2, _record('2024-01-10', machine_id=2, start='18:00', end='20:00'))
+    _assert_usage_matches(app)
+    _edit(client, 3, _record('2024-02-28', machine_id=2))
+    _assert_usage_matches(app)
+    _edit(client, 1, _record('2024-01-10', start='', end='', status='repair'))
+    _assert_usage_matches(app)
+
+    client.post('/delete/record/2')
+    _assert_usage_matches(app)
+
+    # перенос в архив не меняет агрегаты
+    with app.app_context():
+        assert archive_records(get_db(), '2024-02-01') == 1
+    _assert_usage_matches(app)
+
+    client.post('/delete/record/3')
+    _assert_usage_matches(app)
+    with app.app_context():
+        rows = get_db().execute("SELECT kind, entity_id, month, status, days FROM usage_monthly "
+                                "ORDER BY kind").fetchall()
+    assert [tuple(r) for r in rows] == [('counterparty', 1, '2024-01', 'repair', 1),
+                                        ('driver', 1, '2024-01', 'repair', 1),
+                                        ('machine', 1, '2024-01', 'repair', 1)]
@@ -0,0 +1,31 @@
+# tests/test_writer.py
+
+from concurrent.futures import Future
+
+import pytest
+
+from app.archive import archive_records, ensure_open_period, get_cutoff
+from app.database import get_db
+from app.writer import _run_batch
+
+
+def _check(conn):
+    ensure_open_period(conn, '2024-01-15')
+
+
+def test_batch_sees_cutoff_moved_before_begin(app, client, refs):
+    client.post('/admin/records', data={'date': '2024-01-10', 'machine_id': 1, 'driver_id': 1,
+                                        'status': 'work'})
+    with app.app_context():
+        conn = get_db()
+        assert get_cutoff(conn) is None  # писатель прочитал границу до BEGIN
+
+        # перенос в архив из другого процесса
+        with app.app_context():
+            assert archive_records(get_db(), '2024-02-01') == 1
+
+        future = Future()
+        future.set_running_or_notify_cancel()
+        _run_batch(conn, [(_check, (), future)])
+        with pytest.raises(ValueError):
+            future.result()